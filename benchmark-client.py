@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+
+    Times the client against a local kvtintri.mockserver.MockVMStore, so no appliance is needed.
+
+    For every inventory size the following are measured:
+
+        get_vms       - every VM through iter_vms (paged, with prefetch)
+        stream        - every VM through iter_vms(stream=True)
+        from_dict     - VirtualMachine.from_dict over already decoded VM dictionaries, no network
+        hydrate_all   - every VM with its virtual disks attached
+        bulk_qos      - set_qos_bulk on every VM
+        report        - a CSV report of name, vCenter, power state and QoS for every VM
+
+    Request counts and bytes come from a kvtintri.RequestMetrics attached to the session.
+
+    python benchmark-client.py --counts 1000 10000 100000 --latency 0.002
+
+"""
+
+import argparse
+import csv
+import os
+import tempfile
+import time
+import zlib
+
+import kvtintri
+from kvtintri.mockserver import MockVMStore
+
+
+def bench_get_vms(session, args):
+    return len(list(session.iter_vms(page_size=args.pagesize)))
+
+
+def bench_stream(session, args):
+    return len(list(session.iter_vms(page_size=args.pagesize, stream=True)))
+
+
+def bench_hydrate_all(session, args):
+    return len(kvtintri.VirtualMachine.hydrate_all(session, page_size=args.pagesize))
+
+
+def bench_bulk_qos(session, args):
+    vms = list(session.iter_vms(page_size=args.pagesize))
+    for vm in vms:
+        vm.qos_min_iops = 0
+        # crc32 rather than hash(), which is salted per process, so every run sends the same batches
+        vm.qos_max_iops = 1000 + 1000 * (zlib.crc32(vm.uuid.encode('utf-8')) % 4)
+
+    # Only the update itself is timed and counted
+    session.metrics.reset()
+    start = time.time()
+    results = session.set_qos_bulk(vms, batch_size=args.batchsize, max_workers=args.workers)
+    bench_bulk_qos.elapsed = time.time() - start
+    return len(results)
+
+
+def bench_report(session, args):
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'vcenter', 'powered', 'min_iops', 'max_iops'])
+            count = 0
+            for vm in session.iter_vms(page_size=args.pagesize):
+                writer.writerow([vm.name, vm.vcenter, vm.power_state, vm.qos_min_iops, vm.qos_max_iops])
+                count += 1
+    finally:
+        os.remove(path)
+    return count
+
+
+NETWORK_BENCHMARKS = (('get_vms', bench_get_vms),
+                      ('stream', bench_stream),
+                      ('hydrate_all', bench_hydrate_all),
+                      ('bulk_qos', bench_bulk_qos),
+                      ('report', bench_report))
+
+
+def run(count, args):
+    rows = []
+
+    with MockVMStore(vm_count=count, disks_per_vm=args.disks, latency=args.latency) as server:
+        items = list(kvtintri.mockserver.synthetic_vm(i) for i in range(count))
+        start = time.time()
+        for item in items:
+            kvtintri.VirtualMachine.from_dict(item)
+        rows.append(('from_dict', count, time.time() - start, 0, 0))
+        del items
+
+        for name, benchmark in NETWORK_BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+
+            metrics = kvtintri.RequestMetrics()
+            with kvtintri.VMStore.login(server.device, 'admin', 'admin', scheme='http', metrics=metrics) as session:
+                metrics.reset()
+                benchmark.elapsed = None
+                start = time.time()
+                result = benchmark(session, args)
+                elapsed = benchmark.elapsed if benchmark.elapsed is not None else time.time() - start
+
+                stats = metrics.snapshot().values()
+                requests = sum(s['calls'] for s in stats)
+                received = sum(s['bytes_received'] for s in stats)
+                rows.append((name, result, elapsed, requests, received))
+
+    return rows
+
+
+def getargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts',
+                        required=False,
+                        nargs='+',
+                        type=int,
+                        default=[1000, 10000, 100000],
+                        help='Inventory sizes to benchmark')
+    parser.add_argument('--latency',
+                        required=False,
+                        action='store',
+                        type=float,
+                        default=0.0,
+                        help='Seconds the mock server adds to every response')
+    parser.add_argument('--disks',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=2,
+                        help='Virtual disks per virtual machine')
+    parser.add_argument('--pagesize',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=kvtintri.classes.DEFAULT_PAGE_SIZE,
+                        help='Items requested per page')
+    parser.add_argument('--batchsize',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=kvtintri.bulk.DEFAULT_BATCH_SIZE,
+                        help='Maximum number of VMs updated per QoS request')
+    parser.add_argument('--workers',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=kvtintri.bulk.DEFAULT_WORKERS,
+                        help='Maximum number of concurrent QoS requests')
+    parser.add_argument('--only',
+                        required=False,
+                        nargs='+',
+                        help='Only run these network benchmarks')
+    return parser.parse_args()
+
+
+def main():
+    args = getargs()
+
+    print('%-12s %8s %10s %10s %12s %10s %12s' % ('benchmark', 'VMs', 'items', 'seconds', 'us/VM', 'requests',
+                                                  'MiB in'))
+    for count in args.counts:
+        for name, result, elapsed, requests, received in run(count, args):
+            print('%-12s %8d %10d %10.3f %12.1f %10d %12.2f' % (name, count, result, elapsed,
+                                                                 elapsed * 1e6 / count, requests,
+                                                                 received / 1048576.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+
+    Measures construction time and memory of VirtualMachine objects built from synthetic API dictionaries.
+
+    Two variants are compared for every run:
+
+        dict     - the previous __dict__ based model (kept here as a baseline)
+        slotted  - kvtintri.VirtualMachine
+
+    Timings are taken without tracing. Memory is measured in a separate traced run and is what stays allocated once
+    the list of source dictionaries has been dropped, i.e. what a long running script holding the objects pays per
+    VM.
+
+    python benchmark-models.py --count 10000
+
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+import kvtintri
+from kvtintri.mockserver import synthetic_vm
+
+
+class DictVirtualMachine(object):
+    """The dict based VirtualMachine model this library used before the slotted one"""
+
+    def __init__(self, virtualmachine, virtual_disks=None):
+        self.typeid = virtualmachine['typeId']
+        self.uuid = virtualmachine['uuid']['uuid']
+        self.vcenter = virtualmachine['vmware']['vcenterName']
+        self.name = virtualmachine['vmware']['name']
+        self.power_state = virtualmachine['vmware']['isPowered']
+        self.is_template = virtualmachine['vmware']['isTemplate']
+        self.hypervisor = virtualmachine['vmware']['hypervisorType']
+
+        if 'mor' in virtualmachine['vmware'].keys():
+            self.moref = virtualmachine['vmware']['mor']
+
+        if 'storageContainers' in virtualmachine['vmware'].keys():
+            self.storage_containers = virtualmachine['vmware']['storageContainers']
+
+        if 'qosConfig' in virtualmachine.keys():
+            self.qos_max_iops = virtualmachine['qosConfig']['maxNormalizedIops']
+            self.qos_min_iops = virtualmachine['qosConfig']['minNormalizedIops']
+            self.qos_typeid = virtualmachine['qosConfig']['typeId']
+        else:
+            self.qos_max_iops = False
+            self.qos_min_iops = False
+            self.qos_typeid = False
+
+        self.virtualdisks = virtual_disks
+
+
+def build(variant, items):
+    if variant == 'dict':
+        return [DictVirtualMachine(vm) for vm in items]
+    return [kvtintri.VirtualMachine.from_dict(vm) for vm in items]
+
+
+def touch(vms):
+    # Read the fields a typical report uses
+    for vm in vms:
+        (vm.name, vm.uuid, vm.vcenter, vm.power_state, vm.qos_min_iops, vm.qos_max_iops)
+
+
+def measure_time(variant, count):
+    items = [synthetic_vm(i) for i in range(count)]
+    gc.collect()
+
+    start = time.time()
+    vms = build(variant, items)
+    elapsed = time.time() - start
+
+    start = time.time()
+    touch(vms)
+    access = time.time() - start
+
+    return elapsed, access
+
+
+def measure_memory(variant, count):
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    items = [synthetic_vm(i) for i in range(count)]
+    vms = build(variant, items)
+    touch(vms)
+
+    del items
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    del vms
+    return retained
+
+
+def getargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=10000,
+                        help='Number of virtual machines to build')
+    parser.add_argument('--repeat',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=3,
+                        help='Number of runs per variant, the fastest is reported')
+    return parser.parse_args()
+
+
+def main():
+    args = getargs()
+
+    print('%d virtual machines' % args.count)
+    print('%-10s %14s %14s %14s %14s' % ('variant', 'build ms', 'access ms', 'retained MiB', 'bytes/VM'))
+
+    for variant in ('dict', 'slotted'):
+        runs = [measure_time(variant, args.count) for _ in range(args.repeat)]
+        elapsed = min(r[0] for r in runs)
+        access = min(r[1] for r in runs)
+        retained = measure_memory(variant, args.count)
+        print('%-10s %14.1f %14.1f %14.2f %14d' % (variant, elapsed * 1000, access * 1000,
+                                                     retained / 1048576.0, retained // args.count))
+
+
+if __name__ == '__main__':
+    main()
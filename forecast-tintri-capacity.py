@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+
+    Forecasts when the datastores of one or more tintris will run out of space and performance reserve, from a line
+    fitted to their historic stats, and prints the datastores closest to full first.
+
+    python forecast-tintri-capacity.py -s vmstore01 vmstore02 --days 30 --threshold 90 --csvout capacity.csv
+
+"""
+
+import argparse
+import csv
+import getpass
+import sys
+import time
+import kvtintri
+from kvtintri.forecast import CapacityForecaster, fetch_fleet_history
+
+try:
+    input = raw_input
+except NameError:
+    pass
+
+COLUMNS = ('VMStore', 'Datastore', 'Metric', 'Current', 'Capacity', 'Growth/day', 'Days to full', 'Full on', 'R2')
+
+def getargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--storage',
+                        required=True,
+                        nargs='+',
+                        help='One or more VMStore IPs or hostnames')
+    parser.add_argument('-u', '--username',
+                        required=False,
+                        action='store',
+                        help='Username to access the VMStore')
+    parser.add_argument('--days',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=30,
+                        help='Days of history to fit the trend to')
+    parser.add_argument('--threshold',
+                        required=False,
+                        action='store',
+                        type=float,
+                        default=100,
+                        help='Percentage of capacity counted as full')
+    parser.add_argument('--minsamples',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=10,
+                        help='Datastores with fewer historic samples than this are not forecast')
+    parser.add_argument('--csvout',
+                        required=False,
+                        action='store',
+                        help='Output the report to the specified CSV file')
+    return parser.parse_args()
+
+def format_row(forecast):
+    full_on = time.strftime('%Y-%m-%d', time.localtime(forecast.full_at)) if forecast.full_at is not None else ''
+    return (forecast.device, forecast.uuid, forecast.metric,
+            '' if forecast.current is None else '%.1f' % forecast.current,
+            '' if forecast.capacity is None else '%.1f' % forecast.capacity,
+            '' if forecast.slope_per_day is None else '%.2f' % forecast.slope_per_day,
+            '' if forecast.days_to_full is None else '%.0f' % forecast.days_to_full,
+            full_on,
+            '' if forecast.r2 is None else '%.2f' % forecast.r2)
+
+def main():
+
+    args = getargs()
+    username = args.username
+
+    if not username:
+        username = input("VMStore Username: ")
+
+    password = getpass.getpass("VMStore Password: ")
+
+    since = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(time.time() - args.days * 86400))
+
+    with kvtintri.VMStoreFleet.login(args.storage, username, password) as fleet:
+        history = fetch_fleet_history(fleet, since=since)
+        errors = sorted(fleet.errors.items())
+
+    forecaster = CapacityForecaster(threshold=args.threshold, min_samples=args.minsamples)
+    rows = [format_row(forecast) for forecast in forecaster.forecast(history)]
+
+    if args.csvout:
+        with open(args.csvout, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+
+    print('%-20s %-40s %-24s %12s %12s %10s %12s %10s %5s' % COLUMNS)
+    for row in rows:
+        print('%-20s %-40s %-24s %12s %12s %10s %12s %10s %5s' % row)
+
+    for device, error in errors:
+        sys.stderr.write('%s failed: %s\n' % (device, error))
+
+if __name__ == '__main__':
+    main()
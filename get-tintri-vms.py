@@ -2,23 +2,44 @@
 
 """
 
-    A sample script to retrieve a list of all the virtual machines and output a nicely formatted table or CSV
+    A sample script to retrieve a list of all the virtual machines and output a nicely formatted table, CSV or JSON
+
+    The report is a chain of generators: pages of VMs are fetched from every VMstore in parallel, each VM is built
+    into a VirtualMachine, formatted into a row and written out as soon as its page arrives. CSV and JSON lines
+    output therefore needs memory for one page per appliance no matter how many VMs there are. Only the console
+    table, which has to size its columns, holds every row; it's printed when no output file is given or --table is
+    set.
+
+    With --snapshot the inventory is kept in a local SQLite file between runs (see kvtintri.snapshot), so an
+    unfiltered report starts from the last snapshot while a fresh one is taken in the background.
+
+    python get-tintri-vms.py -s vmstore01 vmstore02 --csvout vms.csv --json vms.jsonl
 
 """
 
 import kvtintri
+import kvtintri.snapshot
 import getpass
 import argparse
-from prettytable import PrettyTable
 import csv
-import getpass
+import json
+import sys
+
+from kvtintri.query import Query
+
+try:
+    input = raw_input
+except NameError:
+    pass
+
+COLUMNS = ('Name', 'UUID', 'vCenter', 'Power', 'QoS Min', 'QoS Max')
 
 def getargs():
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--storage',
                         required=True,
-                        action='store',
-                        help='VMStore VMStor IP or hostname')
+                        nargs='+',
+                        help='One or more VMStore IPs or hostnames')
     parser.add_argument('-u', '--username',
                         required=False,
                         action='store',
@@ -35,72 +56,147 @@ def getargs():
                         required=False,
                         action='store',
                         help='Return virtual machines that contain the string specified in --match')
+    parser.add_argument('--vcenter',
+                        required=False,
+                        action='store',
+                        help='Return virtual machines in vCenters whose name contains this string')
     parser.add_argument('--json',
                         required=False,
                         action='store',
-                        help='Output JSON')
+                        help='Output the report as JSON lines, one object per VM, to this file or - for stdout')
+    parser.add_argument('--table',
+                        required=False,
+                        action='store_true',
+                        help='Print the console table even when writing CSV or JSON')
+    parser.add_argument('--snapshot',
+                        required=False,
+                        action='store',
+                        help='SQLite file to keep inventory snapshots in, e.g. ~/.kvtintri/inventory.db')
+    parser.add_argument('--maxage',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=kvtintri.snapshot.DEFAULT_MAX_AGE,
+                        help='Seconds a snapshot is used before it is refreshed in the background')
+    parser.add_argument('--pagesize',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=kvtintri.classes.DEFAULT_PAGE_SIZE,
+                        help='Virtual machines requested per page')
     args = parser.parse_args()
 
     return args
 
-def main():
-    # TODO add filter for vCenter server
+def fetch(fleet, args):
+    """Yields (device, VM dictionary) from every appliance as pages arrive"""
+    query = Query('vm', name=args.match, vcenterName=args.vcenter)
+    return fleet.find(query, page_size=args.pagesize)
 
-    args = getargs()
-    tintri = args.storage
-    username = args.username
-    outfile = args.csvout
+def hydrate(items):
+    """Yields (device, VirtualMachine)"""
+    for device, item in items:
+        yield device, kvtintri.VirtualMachine.from_dict(item)
 
-    if not username:
-        username = raw_input("VMStore Username: ")
+def format_rows(vms):
+    """Yields (device, row) where row holds the values of COLUMNS"""
+    for device, i in vms:
+        yield device, (i.name, i.uuid, i.vcenter, i.power_state, i.qos_min_iops, i.qos_max_iops)
+
+class CsvSink(object):
 
-    # password = getpass.getpass("VMStore Password: ")
-    password = "!Passw0rd"
-    session = kvtintri.VMStore.login(tintri, username, password)
+    def __init__(self, f, with_device):
+        self.writer = csv.writer(f)
+        self.with_device = with_device
+        self.writer.writerow((('VMStore',) if with_device else ()) + COLUMNS)
 
-    if args.match:
-        virtualmachines = session.get_vms(name=args.match)
-    else:
-        virtualmachines = session.get_vms()
+    def write(self, device, row):
+        self.writer.writerow(((device,) if self.with_device else ()) + row)
 
-    vm_list = []
-    for vm in virtualmachines['items']:
-        vm_list.append(kvtintri.VirtualMachine.from_dict(vm))
+class JsonLinesSink(object):
 
-    if args.displayuuid:
-        out = PrettyTable(['Name', 'UUID', 'vCenter', 'Power', 'QoS Min', 'QoS Max'])
-        out.align['Name'] = 'l'
-        out.padding_width = 1
-        for i in vm_list:
-            out.add_row((i.name, i.uuid, i.vcenter, i.power_state, i.qos_min_iops, i.qos_max_iops))
+    def __init__(self, f, with_device):
+        self.f = f
+        self.with_device = with_device
 
-        x  = session.get_datastores()
+    def write(self, device, row):
+        record = dict(zip(COLUMNS, row))
+        if self.with_device:
+            record['VMStore'] = device
+        self.f.write(json.dumps(record, sort_keys=True) + '\n')
 
-    else:
-        out = PrettyTable(['Name', 'vCenter', 'Power', 'QoS Min', 'QoS Max'])
-        out.align['Name'] = 'l'
-        out.padding_width = 1
-        for i in vm_list:
-            out.add_row((i.name, i.vcenter, i.power_state, i.qos_min_iops, i.qos_max_iops))
+class TableSink(object):
 
+    def __init__(self, with_device, with_uuid):
+        from prettytable import PrettyTable
 
-    print out
+        self.with_device = with_device
+        self.with_uuid = with_uuid
+        self.table = PrettyTable(list(self._select(('VMStore',), COLUMNS)))
+        self.table.align['Name'] = 'l'
+        self.table.padding_width = 1
 
-    if outfile:
-        with open(outfile, "w") as f:
-            csv_file = csv.writer(f)
-            csv_file.writerow((['Name', 'UUID', 'vCenter', 'Power', 'QoS Min', 'QoS Max']))
-            for i in vm_list:
-                csv_file.writerow((i.name, i.uuid, i.vcenter, i.power_state, i.qos_min_iops, i.qos_max_iops))
+    def _select(self, device, row):
+        if not self.with_uuid:
+            row = row[:1] + row[2:]
+        return (device if self.with_device else ()) + row
 
+    def write(self, device, row):
+        self.table.add_row(self._select((device,), row))
 
-    # TODO output JSON as option
-    #
-    # if args.json:
-    #     with open(args.json, "w") as f:
-    #         json_file = json.dumps()
+def main():
 
+    args = getargs()
+    username = args.username
 
+    if not username:
+        username = input("VMStore Username: ")
+
+    password = getpass.getpass("VMStore Password: ")
+
+    with_device = len(args.storage) > 1
+    files = []
+    sinks = []
+
+    snapshot = None
+    if args.snapshot:
+        snapshot = kvtintri.snapshot.SnapshotStore(args.snapshot, max_age=args.maxage, page_size=args.pagesize)
+
+    with kvtintri.VMStoreFleet.login(args.storage, username, password, snapshot=snapshot) as fleet:
+        try:
+            if args.csvout:
+                files.append(open(args.csvout, 'w'))
+                sinks.append(CsvSink(files[-1], with_device))
+            if args.json:
+                if args.json == '-':
+                    out = sys.stdout
+                else:
+                    out = open(args.json, 'w')
+                    files.append(out)
+                sinks.append(JsonLinesSink(out, with_device))
+
+            table = None
+            if args.table or not sinks:
+                table = TableSink(with_device, args.displayuuid)
+                sinks.append(table)
+
+            count = 0
+            for device, row in format_rows(hydrate(fetch(fleet, args))):
+                for sink in sinks:
+                    sink.write(device, row)
+                count += 1
+        finally:
+            for f in files:
+                f.close()
+
+        if table is not None:
+            print(table.table)
+
+        for device, error in sorted(fleet.errors.items()):
+            sys.stderr.write('%s failed: %s\n' % (device, error))
+
+    if args.json != '-':
+        print('%d virtual machines' % count)
 
 if __name__ == '__main__':
     main()
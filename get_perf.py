@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 """
 
+    Prints datastore performance. With --count greater than one the datastores are sampled every --interval seconds
+    and min/max/p95 of each metric over the run is printed at the end. --vms samples every virtual machine too, so
+    an --archive can feed recommend-tintri-qos.py.
 
 """
 
@@ -8,6 +11,12 @@ import argparse
 import getpass
 import kvtintri
 import json
+import time
+
+try:
+    input = raw_input
+except NameError:
+    pass
 
 def getargs():
     parser = argparse.ArgumentParser()
@@ -19,10 +28,44 @@ def getargs():
                         required=False,
                         action='store',
                         help='Username to access the VMStore')
+    parser.add_argument('--interval',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=30,
+                        help='Seconds between samples')
+    parser.add_argument('--count',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=1,
+                        help='Number of samples to take. The default of 1 prints the raw realtime stats.')
+    parser.add_argument('--archive',
+                        required=False,
+                        action='store',
+                        help='Also append every sample to this stats archive file')
+    parser.add_argument('--vms',
+                        required=False,
+                        action='store_true',
+                        help='Also sample every virtual machine, e.g. to archive history for recommend-tintri-qos.py')
     args = parser.parse_args()
 
     return args
 
+def summarize(session, interval, count, archive=None, vms=False):
+    collector = kvtintri.PerformanceCollector(session, interval=interval, capacity=count * 10, vms=vms,
+                                              archive=archive)
+
+    for i in range(count):
+        if i:
+            time.sleep(interval)
+        collector.poll()
+
+    print('%-10s %-60s %-22s %12s %12s %12s' % ('kind', 'uuid', 'metric', 'min', 'max', 'p95'))
+    for (kind, uuid, metric), series in sorted(collector.series.items()):
+        print('%-10s %-60s %-22s %12.2f %12.2f %12.2f' % (kind, uuid, metric, series.min(), series.max(),
+                                                          series.percentile(95)))
+
 def main():
 
     args = getargs()
@@ -31,16 +74,21 @@ def main():
 
 
     if not username:
-        username = raw_input("VMStore Username:")
+        username = input("VMStore Username:")
 
 
     password = getpass.getpass("VMStore Password:")
 
     session = kvtintri.VMStore.login(tintri, username, password)
 
-    output = session.get_realtime_datastore_performance(uuid='default')
-
-    print json.dumps(output, indent=4)
+    if args.archive:
+        with kvtintri.ArchiveWriter(args.archive) as archive:
+            summarize(session, args.interval, args.count, archive, vms=args.vms)
+    elif args.count > 1 or args.vms:
+        summarize(session, args.interval, args.count, vms=args.vms)
+    else:
+        output = session.get_realtime_datastore_performance(uuid='default')
+        print(json.dumps(output, indent=4))
 
 if __name__ == '__main__':
     main()
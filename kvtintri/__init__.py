@@ -1,2 +1,19 @@
+import sys
+
 from .classes import *
+from .archive import ArchiveReader, ArchiveWriter
+from .cache import ResponseCache
 from .exceptions import InvalidRequestMethod
+from .fleet import VMStoreFleet
+from .forecast import CapacityForecaster
+from .index import VMIndex
+from .inventory import Inventory
+from .metrics import RequestMetrics
+from .perf import PerformanceCollector
+from .query import Query
+from .recommend import QoSRecommender
+from .snapshot import SnapshotStore
+from .table import VMTable
+
+if sys.version_info >= (3, 6):
+    from .aio import AsyncVMStore
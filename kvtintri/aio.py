@@ -0,0 +1,315 @@
+"""
+
+    asyncio counterpart of kvtintri.VMStore for polling many VMstores from a single process.
+
+    Requires Python 3.6+ and aiohttp (pip install kvtintri[async]).
+
+    Sample usage:
+        import asyncio
+        import kvtintri
+
+        async def report(devices):
+            pool = kvtintri.AsyncVMStore.create_pool(pool_size=100)
+            semaphore = asyncio.Semaphore(50)
+
+            sessions = await asyncio.gather(*[kvtintri.AsyncVMStore.login(device, "admin", "secret!",
+                                                                           http_session=pool, semaphore=semaphore)
+                                              for device in devices])
+            try:
+                return await asyncio.gather(*[session.get_vms() for session in sessions])
+            finally:
+                await asyncio.gather(*[session.logout() for session in sessions])
+                await pool.close()
+
+"""
+
+import asyncio
+import json
+import kvtintri.bulk
+import kvtintri.exceptions
+from kvtintri.classes import VMStore, VirtualMachine, DEFAULT_PAGE_SIZE, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, \
+    _raise_for_tintri_error
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DEFAULT_CONCURRENCY = 20
+
+
+def _client_timeout(timeout):
+    """Converts a requests style timeout (a number or a (connect, read) tuple) into an aiohttp.ClientTimeout"""
+    if isinstance(timeout, aiohttp.ClientTimeout):
+        return timeout
+    if isinstance(timeout, tuple):
+        return aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+    return aiohttp.ClientTimeout(total=timeout)
+
+
+class AsyncVMStore(object):
+    """
+
+        Non-blocking session with a Tintri VMstore appliance. Exposes the same methods as VMStore as coroutines.
+
+        Any number of AsyncVMStore instances can share one connection pool (an aiohttp.ClientSession) and one
+        asyncio.Semaphore, which caps the number of requests in flight across every appliance using it.
+
+        This class should be instantiated via the login @classmethod.
+
+    """
+
+    _filter = VMStore._filter
+
+    def __init__(self, device, user, session, api_version, ssl_verify, http_session, semaphore,
+                 owns_http_session=False, scheme='https'):
+        """
+        AsyncVMStore class initializer. The class itself should only be instantiated via the login @classmethod.
+
+        :param device:
+        :param user:
+        :param session:
+        :param api_version:
+        :param ssl_verify:
+        :param http_session: The aiohttp.ClientSession used for every request
+        :param semaphore: An asyncio.Semaphore limiting the number of concurrent requests
+        :param owns_http_session: If True the connection pool is closed on logout
+        :param scheme: 'https', or 'http' for a plain HTTP endpoint such as kvtintri.mockserver
+        """
+        self.device = device
+        self.user = user
+        self.session = session
+        self.api_version = api_version
+        self.headers = {'Content-Type': 'application/json',
+                        'cookie': 'JSESSIONID=' + self.session}
+        self.ssl_verify = ssl_verify
+        self.http = http_session
+        self.semaphore = semaphore
+        self._owns_http_session = owns_http_session
+        self.scheme = scheme
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.logout()
+        return False
+
+    @staticmethod
+    def create_pool(pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+        """
+        Creates a connection pool that can be shared by many AsyncVMStore sessions. The caller is responsible for
+        closing it with "await pool.close()".
+
+        :param pool_size: Maximum number of open connections across all appliances using the pool
+        :param timeout: Timeout in seconds for every request. Either a single number or a (connect, read) tuple.
+        :return: An aiohttp.ClientSession
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncVMStore requires aiohttp. Install it with 'pip install aiohttp'")
+
+        # Session cookies are sent explicitly per appliance so the shared cookie jar is disabled
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size),
+                                     cookie_jar=aiohttp.DummyCookieJar(),
+                                     timeout=_client_timeout(timeout))
+
+    @classmethod
+    async def login(cls, device, user, password, ssl_verify=False, http_session=None, semaphore=None,
+                    concurrency=DEFAULT_CONCURRENCY, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                    scheme='https'):
+        """
+        Logs into a VMstore and returns an AsyncVMStore.
+
+        :param device: A string containing the FQDN or IP address of a Tintri VMstore appliance.
+        :param user: A string containing the username of an administrator on the VMstore appliance.
+        :param password: A string containing the password for the user supplied.
+        :param ssl_verify: A boolean that enables or disables SSL certificate validation. By default it is disabled.
+        :param http_session: A shared pool from AsyncVMStore.create_pool(). A private pool is created if not supplied.
+        :param semaphore: A shared asyncio.Semaphore. A private one allowing concurrency requests is created if not
+                          supplied.
+        :param concurrency: Maximum number of requests in flight when no semaphore is supplied.
+        :param pool_size: Size of the private connection pool when no http_session is supplied.
+        :param timeout: Timeout for the private connection pool when no http_session is supplied.
+        :param scheme: 'https', or 'http' for a plain HTTP endpoint such as kvtintri.mockserver.
+        :return: An instance of AsyncVMStore
+        """
+        api_version = 'v310'
+
+        owns_http_session = http_session is None
+        if owns_http_session:
+            http_session = cls.create_pool(pool_size=pool_size, timeout=timeout)
+
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(concurrency)
+
+        headers = {'Content-Type': 'application/json'}
+        payload = {'username': user,
+                   'password': password,
+                   'typeId': 'com.tintri.api.rest.vcommon.dto.rbac.RestApiCredentials'}
+
+        url = "{}://{}/api/{}/session/login".format(scheme, device, api_version)
+
+        try:
+            async with semaphore:
+                async with http_session.post(url,
+                                             data=json.dumps(payload),
+                                             headers=headers,
+                                             ssl=None if ssl_verify else False) as r:
+                    r.raise_for_status()
+                    session = r.cookies['JSESSIONID'].value
+        except Exception:
+            if owns_http_session:
+                await http_session.close()
+            raise
+
+        return cls(device, user, session, api_version, ssl_verify, http_session, semaphore,
+                   owns_http_session=owns_http_session, scheme=scheme)
+
+    async def logout(self):
+        """
+        Used to invalidate a session cookie. Closes the connection pool if this session created it.
+
+        :return: The HTTP status of the logout request
+        """
+        url = "{}://{}/api/{}/session/logout".format(self.scheme, self.device, self.api_version)
+
+        try:
+            async with self.semaphore:
+                async with self.http.get(url, headers=self.headers, ssl=self._ssl) as r:
+                    return r.status
+        except aiohttp.ClientError:
+            pass
+        finally:
+            if self._owns_http_session:
+                await self.http.close()
+
+    @property
+    def _ssl(self):
+        return None if self.ssl_verify else False
+
+    async def _request(self, uri, request_method='GET', payload=None):
+        """
+        Generic request coroutine to be awaited by other methods within this class.
+
+        :param uri: String - URI for the API call
+        :param request_method: String - Either 'PUT', 'POST', or 'GET'. This parameter will default to 'GET'
+        :param payload: - dict of data to be used in the 'PUT' or 'POST'
+        :return: dict of response from the webserver for a GET, otherwise the raw response body.
+        """
+        if request_method not in ('GET', 'PUT', 'POST'):
+            raise kvtintri.exceptions.InvalidRequestMethod(
+                "Invalid request method. It must be either 'PUT', 'POST' or 'GET'. Request method called was: ",
+                request_method)
+
+        url = "{}://{}/api/{}/{}".format(self.scheme, self.device, self.api_version, uri)
+        data = json.dumps(payload) if payload is not None else None
+
+        async with self.semaphore:
+            async with self.http.request(request_method, url, headers=self.headers, data=data, ssl=self._ssl) as r:
+                content = await r.read()
+
+                if request_method != 'GET':
+                    if r.status >= 400:
+                        try:
+                            _raise_for_tintri_error(json.loads(content))
+                        except ValueError:
+                            pass
+                        r.raise_for_status()
+                    return content
+
+        result = json.loads(content)
+        _raise_for_tintri_error(result)
+        return result
+
+    async def get_vms(self, **kwargs):
+        """Retrieves the first page of virtual machines. Supports the same filters as VMStore.get_vms()"""
+        return await self._request('vm' + self._filter(**kwargs))
+
+    async def iter_vms(self, page_size=DEFAULT_PAGE_SIZE, **kwargs):
+        """
+        Asynchronously walks every page of virtual machines, yielding VirtualMachine instances.
+
+        Sample usage:
+            async for vm in session.iter_vms(vcenterName="dev-vc1"):
+                print(vm.name)
+        """
+        offset = 0
+        while True:
+            page = await self._request('vm' + self._filter(offset=offset, limit=page_size, **kwargs))
+            items = page.get('items', [])
+            for vm in items:
+                yield VirtualMachine.from_dict(vm)
+
+            offset += len(items)
+            total = page.get('filteredTotal')
+            if not items or (total is not None and offset >= total) or (total is None and len(items) < page_size):
+                break
+
+    async def get_vm(self, vm_id):
+        """Retrives an individual VM based on passed in string for 'vm_id'"""
+        return await self._request('vm/' + vm_id)
+
+    async def get_virtualdisks(self, **kwargs):
+        """Retrieves the first page of virtual disks. Supports the same filters as VMStore.get_virtualdisks()"""
+        return await self._request('virtualDisk' + self._filter(**kwargs))
+
+    async def set_qos(self, payload):
+        """Updates QoS values with a vm/qosConfig payload. See VMStore.set_qos()"""
+        return await self._request('vm/qosConfig', request_method='PUT', payload=payload)
+
+    async def set_qos_bulk(self, vms, batch_size=kvtintri.bulk.DEFAULT_BATCH_SIZE):
+        """
+        Updates QoS on many virtual machines at once. VMs sharing the same qos_min_iops and qos_max_iops are sent in
+        batched requests which all run concurrently, bounded by this session's semaphore.
+
+        :param vms: An iterable of VirtualMachine instances
+        :param batch_size: Maximum number of VMs updated by a single request
+        :return: A list of kvtintri.bulk.QoSResult tuples, one per virtual machine
+        """
+        batches = []
+        for (min_iops, max_iops), group in kvtintri.bulk.group_by_qos(vms).items():
+            for batch in kvtintri.bulk.chunks(group, batch_size):
+                batches.append((min_iops, max_iops, batch))
+
+        responses = await asyncio.gather(*[self.set_qos(kvtintri.bulk.qos_payload([vm.uuid for vm in batch],
+                                                                                   min_iops, max_iops))
+                                           for min_iops, max_iops, batch in batches],
+                                         return_exceptions=True)
+
+        results = []
+        for (min_iops, max_iops, batch), response in zip(batches, responses):
+            error = response if isinstance(response, Exception) else None
+            for vm in batch:
+                results.append(kvtintri.bulk.QoSResult(vm.uuid, vm.name, min_iops, max_iops, error is None, error))
+        return results
+
+    async def get_datastores(self):
+        """Get all of the datastores on the Tintri VMStore"""
+        return await self._request('datastore')
+
+    async def get_datastore(self, datastore_uuid='default'):
+        """Returns a dictionary for the given datastore"""
+        return await self._request('datastore/' + str(datastore_uuid))
+
+    async def get_appliances(self):
+        """Returns a list containing information about the hardware appliances visible to the endpoint"""
+        return await self._request('appliance')
+
+    async def get_appliance(self):
+        return await self._request('appliance/')
+
+    async def get_service_groups(self):
+        """Get all of the service groups on the Tintri VMStore"""
+        return await self._request('servicegroup')
+
+    async def get_service_group(self, service_group_uuid):
+        """Returns a specific service group"""
+        return await self._request('servicegroup/' + service_group_uuid)
+
+    async def get_view(self, view, request_method='GET', payload=None):
+        """
+        Generic coroutine for REST calls that haven't been implemented in this library yet
+
+        :param view: A string containing the API resource you want to access
+        """
+        return await self._request(view, request_method, payload)
@@ -0,0 +1,449 @@
+"""
+
+    Compact append-only on-disk archive of datastore and VM performance samples.
+
+    File layout:
+
+        header  KVTA magic, format version and a JSON list of the metric names every block stores
+        block   fixed size header (entity key length, resolution, sample count, first and last timestamp,
+                payload length), the entity key ("vm/<uuid>" or "datastore/<uuid>") and a zlib compressed payload
+
+    A block payload is columnar: the sample times as offsets from the block's first timestamp, followed by one column
+    of float64 values per metric (NaN where a sample lacked the metric), all little endian. Constant poll intervals
+    make the time column compress to almost nothing.
+
+    Readers memory-map the file and index it by walking the block headers only, so finding the blocks of one VM in a
+    time range never reads or decompresses the payloads of any other block.
+
+    Sample usage:
+        import kvtintri
+
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!")
+        with kvtintri.ArchiveWriter('vmstore01.kva') as archive:
+            collector = kvtintri.PerformanceCollector(session, archive=archive)
+            collector.start()
+            ...
+            collector.stop()
+
+        with kvtintri.ArchiveReader('vmstore01.kva') as archive:
+            times, values = archive.read('vm', vm_uuid, start=since, end=until)
+            hourly = archive.rollup('vm', vm_uuid, 'latencyTotalMs', step=3600, how='max')
+
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+from kvtintri.perf import DEFAULT_METRICS, parse_time
+
+MAGIC = b'KVTA'
+VERSION = 1
+BLOCK_MAGIC = b'KVB1'
+
+# Block header: magic, entity key length, resolution in seconds (0 for raw samples), sample count, first and last
+# timestamp, compressed payload length
+_BLOCK = struct.Struct('<4sHIIddI')
+_FILE = struct.Struct('<4sHI')
+
+DEFAULT_BLOCK_SIZE = 120
+# Seconds buffered samples may wait before they're written, bounding what a crash loses
+DEFAULT_FLUSH_INTERVAL = 300
+DEFAULT_COMPRESSION = 6
+
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+_NAN = float('nan')
+
+
+def entity_key(kind, uuid):
+    return '{}/{}'.format(kind, uuid)
+
+
+def _pack(values):
+    column = array('d', values)
+    if not _LITTLE_ENDIAN:
+        column.byteswap()
+    return column.tobytes() if hasattr(column, 'tobytes') else column.tostring()
+
+
+def _unpack(data):
+    column = array('d')
+    if hasattr(column, 'frombytes'):
+        column.frombytes(data)
+    else:
+        column.fromstring(data)
+    if not _LITTLE_ENDIAN:
+        column.byteswap()
+    return column
+
+
+def downsample(times, values, step, how='mean'):
+    """
+    Aggregates samples into buckets of step seconds aligned to the epoch. NaN values are skipped.
+
+    :param times: Sample timestamps in ascending order
+    :param values: Sample values
+    :param step: Bucket width in seconds
+    :param how: 'mean', 'min', 'max', 'sum', 'last' or 'count'
+    :return: A tuple of two arrays, (bucket start times, aggregated values)
+    """
+    if how not in ('mean', 'min', 'max', 'sum', 'last', 'count'):
+        raise ValueError('Unknown aggregation: {}'.format(how))
+
+    out_times = array('d')
+    out_values = array('d')
+
+    bucket = None
+    total = 0.0
+    count = 0
+    result = None
+
+    for timestamp, value in zip(times, values):
+        start = timestamp - timestamp % step
+        if start != bucket:
+            if count:
+                out_times.append(bucket)
+                out_values.append(total / count if how == 'mean' else result)
+            bucket = start
+            total = 0.0
+            count = 0
+            result = None
+
+        if value != value:
+            continue
+
+        count += 1
+        total += value
+        if how == 'min':
+            result = value if result is None else min(result, value)
+        elif how == 'max':
+            result = value if result is None else max(result, value)
+        elif how == 'sum':
+            result = total
+        elif how == 'last':
+            result = value
+        elif how == 'count':
+            result = count
+
+    if count:
+        out_times.append(bucket)
+        out_values.append(total / count if how == 'mean' else result)
+
+    return out_times, out_values
+
+
+class ArchiveWriter(object):
+    """
+
+        Appends samples to an archive file. Samples are buffered per datastore/VM and written as one compressed block
+        once block_size of them have accumulated, on flush() and close(), and by the first write() after
+        flush_interval seconds without a flush, so a process that dies loses at most that much data. Samples that
+        aren't newer than the last one written for the same datastore/VM are dropped, so overlapping stats windows can
+        be written repeatedly.
+
+        Opening an existing archive appends to it using the metric list stored in its header.
+
+    """
+
+    def __init__(self, path, metrics=DEFAULT_METRICS, block_size=DEFAULT_BLOCK_SIZE, compression=DEFAULT_COMPRESSION,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        ArchiveWriter class initializer.
+
+        :param path: The archive file, created if it doesn't exist
+        :param metrics: Stat fields to store. Ignored when appending to an existing archive.
+        :param block_size: Samples per datastore/VM buffered before a block is written
+        :param compression: zlib compression level
+        :param flush_interval: Seconds after which buffered samples are written even if their blocks aren't full.
+                               Shorter intervals write smaller blocks. Only on flush() and close() if None.
+        """
+        self.path = path
+        self.block_size = block_size
+        self.compression = compression
+        self.flush_interval = flush_interval
+        self._flushed = time.time()
+        self._pending = {}
+        self._last = {}
+
+        if os.path.exists(path) and os.path.getsize(path):
+            with ArchiveReader(path) as reader:
+                self.metrics = reader.metrics
+                for key, blocks in reader.index.items():
+                    self._last[key] = blocks[-1][2]
+                end = reader.end
+            self._file = open(path, 'r+b')
+            # Drop a block left incomplete by an interrupted write so new blocks follow the last good one
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self.metrics = tuple(metrics)
+            self._file = open(path, 'wb')
+            header = json.dumps(list(self.metrics)).encode('utf-8')
+            self._file.write(_FILE.pack(MAGIC, VERSION, len(header)) + header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, kind, uuid, samples):
+        """
+        Buffers stat samples for a datastore or VM.
+
+        :param kind: Either 'datastore' or 'vm'
+        :param uuid: The datastore or VM UUID
+        :param samples: A list of stat dictionaries, oldest first, e.g. kvtintri.perf.sorted_stats(response)
+        :return: The number of samples accepted
+        """
+        key = entity_key(kind, uuid)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = [array('d') for _ in range(len(self.metrics) + 1)]
+        times = pending[0]
+
+        accepted = 0
+        for sample in samples:
+            timestamp = parse_time(sample.get('timeEnd'))
+            if timestamp is None:
+                continue
+            last = times[-1] if times else self._last.get(key)
+            if last is not None and timestamp <= last:
+                continue
+
+            times.append(timestamp)
+            for column, metric in zip(pending[1:], self.metrics):
+                value = sample.get(metric)
+                column.append(_NAN if value is None else value)
+            accepted += 1
+
+        if len(times) >= self.block_size:
+            self._write_block(key, 0, pending)
+        if self.flush_interval is not None and time.time() - self._flushed >= self.flush_interval:
+            self.flush()
+        return accepted
+
+    def write_series(self, kind, uuid, times, columns, resolution=0):
+        """
+        Writes already columnar samples straight to a block, e.g. downsampled data.
+
+        :param times: Sample timestamps in ascending order
+        :param columns: One sequence of values per metric, in the archive's metric order
+        :param resolution: Seconds per sample for downsampled data, 0 for raw samples
+        """
+        if len(times):
+            key = entity_key(kind, uuid)
+            self._write_block(key, resolution, [times] + list(columns))
+
+    def _write_block(self, key, resolution, columns):
+        times = columns[0]
+        first = times[0]
+        payload = _pack([t - first for t in times])
+        for column in columns[1:]:
+            payload += _pack(column)
+        payload = zlib.compress(payload, self.compression)
+
+        encoded_key = key.encode('utf-8')
+        self._file.write(_BLOCK.pack(BLOCK_MAGIC, len(encoded_key), resolution, len(times), first, times[-1],
+                                     len(payload)))
+        self._file.write(encoded_key)
+        self._file.write(payload)
+
+        self._last[key] = max(times[-1], self._last.get(key, times[-1]))
+        self._pending.pop(key, None)
+
+    def flush(self):
+        """Writes every buffered sample to disk"""
+        for key in list(self._pending):
+            pending = self._pending[key]
+            if len(pending[0]):
+                self._write_block(key, 0, pending)
+        self._file.flush()
+        self._flushed = time.time()
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+class ArchiveReader(object):
+    """
+
+        Reads an archive through a memory map.
+
+        On open only the block headers are walked to build index, a dictionary of entity key to a list of
+        (offset, first time, last time, count, resolution) tuples. Reads decompress just the blocks of the requested
+        datastore/VM that overlap the time range. A block cut short by an interrupted write ends the index, and end
+        is the offset just past the last complete block.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, length = _FILE.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a kvtintri archive'.format(path))
+        if version > VERSION:
+            raise ValueError('Unsupported archive version {}'.format(version))
+
+        offset = _FILE.size + length
+        self.metrics = tuple(json.loads(self._map[_FILE.size:offset].decode('utf-8')))
+        self.index = {}
+        self._build_index(offset)
+
+    def _build_index(self, offset):
+        size = len(self._map)
+        while offset + _BLOCK.size <= size:
+            magic, key_length, resolution, count, first, last, length = _BLOCK.unpack_from(self._map, offset)
+            end = offset + _BLOCK.size + key_length + length
+            if magic != BLOCK_MAGIC or end > size:
+                break
+
+            key = self._map[offset + _BLOCK.size:offset + _BLOCK.size + key_length].decode('utf-8')
+            self.index.setdefault(key, []).append((offset, first, last, count, resolution))
+            offset = end
+
+        self.end = offset
+
+        for blocks in self.index.values():
+            blocks.sort(key=lambda block: block[1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def entities(self, kind=None):
+        """Returns the (kind, uuid) pairs held in the archive"""
+        pairs = [tuple(key.split('/', 1)) for key in self.index]
+        return sorted(pair for pair in pairs if kind is None or pair[0] == kind)
+
+    def _decode(self, offset):
+        magic, key_length, resolution, count, first, last, length = _BLOCK.unpack_from(self._map, offset)
+        start = offset + _BLOCK.size + key_length
+        payload = zlib.decompress(self._map[start:start + length])
+
+        width = count * 8
+        times = _unpack(payload[:width])
+        for i in range(count):
+            times[i] += first
+        columns = [_unpack(payload[width * (i + 1):width * (i + 2)]) for i in range(len(self.metrics))]
+        return times, columns
+
+    def iter_blocks(self, kind, uuid, start=None, end=None):
+        """
+        Yields the decoded blocks of a datastore or VM that overlap a time range, oldest first.
+
+        :return: A generator of (times, columns, resolution) tuples where columns is a list of arrays in metric order
+        """
+        for offset, first, last, count, resolution in self.index.get(entity_key(kind, uuid), ()):
+            if (start is not None and last < start) or (end is not None and first > end):
+                continue
+            times, columns = self._decode(offset)
+            yield times, columns, resolution
+
+    def read(self, kind, uuid, start=None, end=None, metrics=None):
+        """
+        Reads the samples of a datastore or VM within a time range.
+
+        :param kind: Either 'datastore' or 'vm'
+        :param uuid: The datastore or VM UUID
+        :param start: Earliest timestamp (seconds since the epoch) to include. Unbounded if None.
+        :param end: Latest timestamp to include. Unbounded if None.
+        :param metrics: Metric names to return. All of them if None.
+        :return: A tuple (times, values) where times is an array and values a dictionary of metric name to array
+        """
+        metrics = self.metrics if metrics is None else metrics
+        wanted = [self.metrics.index(metric) for metric in metrics]
+
+        times = array('d')
+        values = dict((metric, array('d')) for metric in metrics)
+
+        for block_times, columns, resolution in self.iter_blocks(kind, uuid, start, end):
+            low = 0
+            high = len(block_times)
+            if start is not None:
+                while low < high and block_times[low] < start:
+                    low += 1
+            if end is not None:
+                while high > low and block_times[high - 1] > end:
+                    high -= 1
+
+            times.extend(block_times[low:high])
+            for metric, i in zip(metrics, wanted):
+                values[metric].extend(columns[i][low:high])
+
+        return times, values
+
+    def rollup(self, kind, uuid, metric, step, start=None, end=None, how='mean'):
+        """
+        Reads one metric of a datastore or VM aggregated into step second buckets.
+
+        :return: A tuple of two arrays, (bucket start times, aggregated values)
+        """
+        times, values = self.read(kind, uuid, start, end, metrics=[metric])
+        return downsample(times, values[metric], step, how)
+
+
+def compact(source, destination, before, step=3600, compression=DEFAULT_COMPRESSION):
+    """
+    Rewrites an archive with every sample older than a cutoff downsampled to the mean of step second buckets.
+    Newer samples are copied unchanged.
+
+    :param source: Path of the archive to read
+    :param destination: Path of the new archive, which must not exist yet
+    :param before: Cutoff timestamp in seconds since the epoch. Rounded down to a multiple of step so no bucket is
+                   split between downsampled and raw data.
+    :param step: Bucket width in seconds for the downsampled data
+    :return: A tuple of (samples read, samples written)
+    """
+    if os.path.exists(destination):
+        raise ValueError('{} already exists'.format(destination))
+
+    before -= before % step
+    read = 0
+    written = 0
+
+    with ArchiveReader(source) as reader:
+        with ArchiveWriter(destination, metrics=reader.metrics, compression=compression) as writer:
+            for kind, uuid in reader.entities():
+                times, values = reader.read(kind, uuid)
+                read += len(times)
+
+                split = 0
+                while split < len(times) and times[split] < before:
+                    split += 1
+
+                if split:
+                    columns = []
+                    for metric in reader.metrics:
+                        bucket_times, column = downsample(times[:split], values[metric][:split], step)
+                        columns.append(dict(zip(bucket_times, column)))
+                    bucket_times = sorted(set().union(*[c.keys() for c in columns]))
+                    columns = [[c.get(t, _NAN) for t in bucket_times] for c in columns]
+                    writer.write_series(kind, uuid, bucket_times, columns, resolution=step)
+                    written += len(bucket_times)
+
+                for offset in range(split, len(times), writer.block_size):
+                    chunk = slice(offset, min(offset + writer.block_size, len(times)))
+                    writer.write_series(kind, uuid, times[chunk], [values[m][chunk] for m in reader.metrics])
+                    written += chunk.stop - chunk.start
+
+    return read, written
@@ -0,0 +1,528 @@
+"""
+
+    Helpers used to apply changes to large numbers of virtual machines with as few REST calls as possible.
+
+    The VMstore accepts a list of VM UUIDs in a MultipleSelectionRequest, so VMs that share the same new values can
+    be updated together in a single request rather than one request per VM.
+
+    run_bulk() applies any BulkOperation to the VMs picked by a selector: targets are grouped and chunked into
+    batches as the operation allows, sent through a bounded pool of threads, and every completed batch can be
+    appended to a progress file so an interrupted run resumes where it stopped.
+
+    Sample usage:
+        import kvtintri
+        from kvtintri.bulk import SelectionOperation, ViewOperation
+        from kvtintri.query import Query
+
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!")
+
+        # Batched: one MultipleSelectionRequest per 200 VMs
+        operation = SelectionOperation('vm/qosConfig', {'typeId': kvtintri.bulk.QOS_CONFIG_TYPEID,
+                                                        'minNormalizedIops': 0, 'maxNormalizedIops': 5000})
+        report = session.bulk(Query('vm', vcenterName="dev-vc1"), operation, progress='qos-dev-vc1.progress')
+
+        # One request per VM, for endpoints that don't take a selection
+        operation = ViewOperation('vm/{uuid}/snapshot', request_method='POST', payload={'comment': 'nightly'})
+        report = session.bulk(lambda vm: vm.name.startswith('db-'), operation, max_workers=8)
+
+        print(report.summary())
+        for result in report.failures():
+            print(result.name, result.error)
+
+"""
+
+import collections
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import kvtintri.query
+from kvtintri.perf import percentile
+
+QOS_CONFIG_TYPEID = 'com.tintri.api.rest.v310.dto.domain.beans.vm.VirtualMachineQoSConfig'
+MULTIPLE_SELECTION_TYPEID = 'com.tintri.api.rest.v310.dto.MultipleSelectionRequest'
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_WORKERS = 4
+
+QoSResult = collections.namedtuple('QoSResult', ['uuid', 'name', 'min_iops', 'max_iops', 'success', 'error'])
+
+# Outcome of a BulkOperation on one virtual machine. key is the batch key the operation gave it.
+BulkResult = collections.namedtuple('BulkResult', ['uuid', 'name', 'key', 'success', 'error'])
+
+
+def qos_payload(uuids, min_iops, max_iops):
+    """
+    Builds the vm/qosConfig payload used to set the same QoS values on one or more virtual machines.
+
+    :param uuids: A list of virtual machine UUIDs
+    :param min_iops: Minimum normalized IOPS
+    :param max_iops: Maximum normalized IOPS
+    :return: A python dictionary ready to be passed to VMStore.set_qos()
+    """
+    mod_qos = {"typeId": QOS_CONFIG_TYPEID,
+               "minNormalizedIops": min_iops,
+               "maxNormalizedIops": max_iops}
+
+    return selection_payload(uuids, mod_qos, ["minNormalizedIops", "maxNormalizedIops"])
+
+
+def selection_payload(uuids, new_value, property_names=None):
+    """
+    Builds a MultipleSelectionRequest that sets the same values on one or more virtual machines.
+
+    :param uuids: A list of virtual machine UUIDs
+    :param new_value: A dictionary holding the typeId and the new values
+    :param property_names: The properties of new_value to change. Every key except typeId if None.
+    :return: A python dictionary ready to be sent with VMStore.get_view()
+    """
+    if property_names is None:
+        property_names = sorted(k for k in new_value if k != 'typeId')
+
+    return {"typeId": MULTIPLE_SELECTION_TYPEID,
+            "ids": list(uuids),
+            "newValue": new_value,
+            "propertyNames": list(property_names)}
+
+
+def group_by_qos(vms):
+    """
+    Groups virtual machines that share the same QoS values so they can be updated in a single request.
+
+    :param vms: An iterable of VirtualMachine instances
+    :return: An ordered dictionary keyed by (qos_min_iops, qos_max_iops) with a list of VirtualMachines as values
+    """
+    groups = collections.OrderedDict()
+    for vm in vms:
+        groups.setdefault((vm.qos_min_iops, vm.qos_max_iops), []).append(vm)
+    return groups
+
+
+def chunks(items, size):
+    """Splits a list into consecutive lists of at most size items"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class BulkOperation(object):
+    """
+
+        A change applied to many virtual machines by run_bulk(). Subclasses implement request(), which sends one
+        batch, and key() when targets need different values: only targets with equal keys share a batch.
+
+        describe() identifies the operation in progress files, so a file is never resumed by a different change.
+
+    """
+
+    name = 'operation'
+
+    def __init__(self, batch_size=1):
+        """
+        BulkOperation class initializer.
+
+        :param batch_size: Maximum number of VMs sent in one request. 1 for endpoints that take a single VM.
+        """
+        self.batch_size = max(int(batch_size), 1)
+
+    def key(self, target):
+        """Returns the batch key of a target. Targets with equal keys may share a request."""
+        return None
+
+    def request(self, session, key, targets):
+        """
+        Sends one batch.
+
+        :param session: An instance of the VMStore object
+        :param key: The key shared by every target in the batch
+        :param targets: A list of at most batch_size targets
+        :raises Exception: Any exception marks every target of the batch as failed
+        """
+        raise NotImplementedError
+
+    def describe(self):
+        """Returns a JSON serializable description of the operation"""
+        return {'operation': self.name}
+
+
+class QoSOperation(BulkOperation):
+    """
+
+        Sets QoS with batched vm/qosConfig requests. Fixed values apply to every target, otherwise each target's
+        qos_min_iops and qos_max_iops are used and targets sharing values are batched together.
+
+    """
+
+    name = 'qos'
+
+    def __init__(self, min_iops=None, max_iops=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        QoSOperation class initializer.
+
+        :param min_iops: Minimum normalized IOPS for every target, or None to use each target's qos_min_iops
+        :param max_iops: Maximum normalized IOPS for every target, or None to use each target's qos_max_iops
+        :param batch_size: Maximum number of VMs updated by a single request
+        """
+        super(QoSOperation, self).__init__(batch_size)
+        self.min_iops = min_iops
+        self.max_iops = max_iops
+
+    def key(self, target):
+        return (target.qos_min_iops if self.min_iops is None else self.min_iops,
+                target.qos_max_iops if self.max_iops is None else self.max_iops)
+
+    def request(self, session, key, targets):
+        return session.set_qos(qos_payload([target.uuid for target in targets], key[0], key[1]))
+
+    def describe(self):
+        return {'operation': self.name, 'min_iops': self.min_iops, 'max_iops': self.max_iops}
+
+
+class SelectionOperation(BulkOperation):
+    """
+
+        Sets the same values on batches of VMs through any endpoint that accepts a MultipleSelectionRequest.
+
+    """
+
+    name = 'selection'
+
+    def __init__(self, view, new_value, property_names=None, request_method='PUT', batch_size=DEFAULT_BATCH_SIZE):
+        """
+        SelectionOperation class initializer.
+
+        :param view: The API resource, e.g. 'vm/qosConfig'
+        :param new_value: A dictionary holding the typeId and the new values
+        :param property_names: The properties of new_value to change. Every key except typeId if None.
+        :param request_method: Either 'PUT' or 'POST'
+        :param batch_size: Maximum number of VMs updated by a single request
+        """
+        super(SelectionOperation, self).__init__(batch_size)
+        self.view = view
+        self.new_value = new_value
+        self.property_names = property_names
+        self.request_method = request_method
+
+    def request(self, session, key, targets):
+        payload = selection_payload([target.uuid for target in targets], self.new_value, self.property_names)
+        return session.get_view(self.view, self.request_method, payload)
+
+    def describe(self):
+        return {'operation': self.name, 'view': self.view, 'method': self.request_method,
+                'new_value': self.new_value, 'property_names': self.property_names}
+
+
+class ViewOperation(BulkOperation):
+    """
+
+        Sends one request per VM, for endpoints that don't take a selection. The view is formatted with the target's
+        uuid and name, e.g. 'vm/{uuid}/snapshot'.
+
+    """
+
+    name = 'view'
+
+    def __init__(self, view, request_method='POST', payload=None):
+        """
+        ViewOperation class initializer.
+
+        :param view: The API resource, with optional {uuid} and {name} fields
+        :param request_method: Either 'PUT' or 'POST'
+        :param payload: A dictionary sent with every request, a function of the target returning one, or None to
+                        send no body
+        """
+        if request_method not in ('PUT', 'POST'):
+            raise ValueError("ViewOperation sends changes, so request_method must be 'PUT' or 'POST', not "
+                             "{}".format(request_method))
+        super(ViewOperation, self).__init__(1)
+        self.view = view
+        self.request_method = request_method
+        self.payload = payload
+
+    def request(self, session, key, targets):
+        target = targets[0]
+        payload = self.payload(target) if callable(self.payload) else self.payload
+        return session.get_view(self.view.format(uuid=target.uuid, name=target.name), self.request_method, payload)
+
+    def describe(self):
+        payload = None if callable(self.payload) else self.payload
+        return {'operation': self.name, 'view': self.view, 'method': self.request_method, 'payload': payload}
+
+
+def select(session, selector=None, page_size=None):
+    """
+    Resolves a selector into the virtual machines it picks, lazily so paged listings stream.
+
+    :param selector: One of
+                     - None: every VM on the VMstore
+                     - a kvtintri.query.Query: the VMs it matches, filtered by the VMstore
+                     - a dictionary: filters passed to VMStore.iter_vms()
+                     - a function: the VMs for which it returns True
+                     - an iterable of VirtualMachines, or of VM dictionaries which are converted
+    :param page_size: Number of VMs requested per page when the selector walks the listing
+    :return: An iterable of targets
+    """
+    from kvtintri.classes import VirtualMachine, DEFAULT_PAGE_SIZE
+
+    page_size = page_size or DEFAULT_PAGE_SIZE
+    if selector is None:
+        return session.iter_vms(page_size=page_size)
+    if isinstance(selector, kvtintri.query.Query):
+        return (VirtualMachine.from_dict(item) for item in session.find(selector, page_size=page_size))
+    if type(selector) == dict:
+        return session.iter_vms(page_size=page_size, **selector)
+    if callable(selector):
+        return (vm for vm in session.iter_vms(page_size=page_size) if selector(vm))
+    return (VirtualMachine.from_dict(item) if type(item) == dict else item for item in selector)
+
+
+class BulkProgress(object):
+    """
+
+        Append-only progress file of a bulk run, so an interrupted run can be resumed without repeating work.
+
+        The first line describes the operation; each later line lists the UUIDs of one finished batch that succeeded
+        or failed, along with the batch key, i.e. the values the batch applied. Opening an existing file loads the
+        VMs already done, which run_bulk() skips only while their target key is still the one recorded, so a rerun
+        with new per-VM values (e.g. a different --maxiops or CSV) applies them. Failed VMs are tried again. Opening
+        a file written for a different operation raises ValueError.
+
+    """
+
+    def __init__(self, path, operation):
+        """
+        BulkProgress class initializer.
+
+        :param path: Path of the progress file. Created if it doesn't exist.
+        :param operation: The BulkOperation being run
+        """
+        self.path = os.path.expanduser(path)
+        self.description = json.loads(json.dumps(operation.describe(), sort_keys=True))
+        # VM UUID -> the JSON form of the key it was updated with
+        self.done = {}
+
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        if exists:
+            with open(self.path) as f:
+                header = json.loads(f.readline())
+                if header != self.description:
+                    raise ValueError('{} records a different operation: {}'.format(self.path, header))
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by the interruption
+                        continue
+                    self._apply(entry.get('key'), entry.get('done', []), entry.get('failed', []))
+
+        self._file = open(self.path, 'a')
+        if not exists:
+            self._write(self.description)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, sort_keys=True) + '\n')
+        self._file.flush()
+
+    @staticmethod
+    def _normalize(key):
+        # Tuples come back from JSON as lists, so keys are compared in their JSON form
+        return json.loads(json.dumps(key, sort_keys=True))
+
+    def _apply(self, key, done, failed):
+        for vm_uuid in done:
+            self.done[vm_uuid] = key
+        for vm_uuid in failed:
+            self.done.pop(vm_uuid, None)
+
+    def completed(self, vm_uuid, key=None):
+        """Returns True if an earlier run updated the VM with the values of this batch key"""
+        return vm_uuid in self.done and self.done[vm_uuid] == self._normalize(key)
+
+    def record(self, results):
+        """Appends the BulkResults of a finished batch. Every result of a batch shares its key."""
+        if not results:
+            return
+        key = self._normalize(results[0].key)
+        done = [r.uuid for r in results if r.success]
+        failed = [r.uuid for r in results if not r.success]
+        self._apply(key, done, failed)
+        self._write({'key': key, 'done': done, 'failed': failed})
+
+    def close(self):
+        self._file.close()
+
+
+class BulkReport(object):
+    """
+
+        Per-VM results and throughput of a bulk run. selected counts every VM the selector picked, skipped those
+        already done according to the progress file.
+
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.results = []
+        self.selected = 0
+        self.skipped = 0
+        self.requests = 0
+        self.failed_requests = 0
+        self.latencies = []
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def succeeded(self):
+        return sum(1 for r in self.results if r.success)
+
+    @property
+    def failed(self):
+        return len(self.results) - self.succeeded
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def throughput(self):
+        """VMs processed per second"""
+        return len(self.results) / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def requests_per_second(self):
+        return self.requests / self.elapsed if self.elapsed > 0 else 0.0
+
+    def failures(self):
+        """Returns the BulkResults of the VMs that failed"""
+        return [r for r in self.results if not r.success]
+
+    def add(self, results, latency, error):
+        self.results.extend(results)
+        self.requests += 1
+        self.latencies.append(latency)
+        if error is not None:
+            self.failed_requests += 1
+
+    def summary(self):
+        """Returns a one line summary of the run"""
+        text = '{}: {} of {} VMs succeeded, {} failed, {} skipped, {} requests in {:.1f}s ({:.1f} VMs/s'.format(
+            self.operation.name, self.succeeded, self.selected, self.failed, self.skipped, self.requests,
+            self.elapsed, self.throughput)
+        if self.latencies:
+            text += ', p95 request {:.0f}ms'.format(percentile(self.latencies, 95) * 1000)
+        return text + ')'
+
+
+def run_bulk(session, selector, operation, progress=None, max_workers=DEFAULT_WORKERS, page_size=None,
+             callback=None):
+    """
+    Applies a BulkOperation to every virtual machine a selector picks.
+
+    Targets are grouped by the operation's key and sent as soon as a group fills a batch, so a streaming selector
+    never holds more than a partial batch per key. At most max_workers requests run at once and at most twice that
+    many batches wait for a thread, which bounds memory however many VMs are selected.
+
+    Finished batches are recorded in the progress file as they complete. If the run is interrupted, batches already
+    sent are allowed to finish and are recorded before the exception propagates.
+
+    :param session: An instance of the VMStore object
+    :param selector: What to apply the operation to. See select().
+    :param operation: A BulkOperation
+    :param progress: A BulkProgress, or the path of a progress file, to skip VMs done by an earlier run and record
+                     this one. Not recorded if None.
+    :param max_workers: Maximum number of requests in flight at once
+    :param page_size: Number of VMs requested per page when the selector walks the listing
+    :param callback: Called with the report after every finished batch, e.g. to print progress
+    :return: A BulkReport
+    """
+    owns_progress = progress is not None and not isinstance(progress, BulkProgress)
+    if owns_progress:
+        progress = BulkProgress(progress, operation)
+
+    report = BulkReport(operation)
+    pending = {}
+
+    def send(key, batch):
+        start = time.time()
+        try:
+            operation.request(session, key, batch)
+            return time.time() - start, None
+        except Exception as e:
+            return time.time() - start, e
+
+    def collect(futures):
+        for future in futures:
+            key, batch = pending.pop(future)
+            latency, error = future.result()
+            results = [BulkResult(target.uuid, target.name, key, error is None, error) for target in batch]
+            report.add(results, latency, error)
+            if progress is not None:
+                progress.record(results)
+            if callback is not None:
+                callback(report)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            def submit(key, batch):
+                while len(pending) >= max_workers * 2:
+                    collect(wait(list(pending), return_when=FIRST_COMPLETED).done)
+                pending[executor.submit(send, key, batch)] = (key, batch)
+
+            try:
+                groups = collections.OrderedDict()
+                for target in select(session, selector, page_size):
+                    report.selected += 1
+                    key = operation.key(target)
+                    if progress is not None and progress.completed(target.uuid, key):
+                        report.skipped += 1
+                        continue
+
+                    group = groups.setdefault(key, [])
+                    group.append(target)
+                    if len(group) >= operation.batch_size:
+                        submit(key, groups.pop(key))
+
+                for key, group in groups.items():
+                    submit(key, group)
+            finally:
+                if pending:
+                    collect(wait(list(pending)).done)
+    finally:
+        report.finished = time.time()
+        if owns_progress:
+            progress.close()
+
+    return report
+
+
+def bulk_update_qos(session, vms, batch_size=DEFAULT_BATCH_SIZE, max_workers=DEFAULT_WORKERS, progress=None):
+    """
+    Updates QoS on many virtual machines at once, using the values stored in each VM's qos_min_iops and qos_max_iops.
+
+    VMs with identical values are grouped into batches of up to batch_size UUIDs and each batch is sent as one
+    vm/qosConfig request. Batches are dispatched concurrently by at most max_workers threads.
+
+    Sample usage:
+        for vm in vm_list:
+            vm.qos_min_iops = 100
+            vm.qos_max_iops = 5000
+
+        results = kvtintri.bulk.bulk_update_qos(session, vm_list)
+        failed = [r for r in results if not r.success]
+
+    :param session: An instance of the VMStore object
+    :param vms: An iterable of VirtualMachine instances
+    :param batch_size: Maximum number of VMs updated by a single request
+    :param max_workers: Maximum number of requests in flight at once
+    :param progress: A BulkProgress or progress file path, to resume an interrupted update. See run_bulk().
+    :return: A list of QoSResult tuples, one per virtual machine updated
+    """
+    report = run_bulk(session, vms, QoSOperation(batch_size=batch_size), progress=progress, max_workers=max_workers)
+    return [QoSResult(r.uuid, r.name, r.key[0], r.key[1], r.success, r.error) for r in report.results]
@@ -0,0 +1,132 @@
+"""
+
+    In-memory TTL cache for read-only VMstore GET responses.
+
+    Sample usage:
+        import kvtintri
+
+        cache = kvtintri.ResponseCache(max_entries=128, ttls={'vm': 60})
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!", cache=cache)
+
+        session.get_vms()     # fetched from the appliance
+        session.get_vms()     # served from the cache
+        print(cache.stats())
+
+"""
+
+import collections
+import threading
+import time
+
+MISSING = object()
+
+
+class ResponseCache(object):
+    """
+
+        A thread safe LRU cache of decoded GET responses keyed on the request URI, query string included.
+
+        Entries expire after a per-resource TTL, where the resource is the first path segment of the URI ('vm',
+        'datastore', 'appliance'...). Writes through VMStore invalidate every cached entry for the resource they
+        touch, e.g. a PUT to vm/qosConfig drops all cached 'vm' responses.
+
+        Cached responses are shared between callers and must not be modified.
+
+    """
+
+    DEFAULT_TTLS = {'vm': 30,
+                    'virtualDisk': 30,
+                    'datastore': 15,
+                    'appliance': 300,
+                    'servicegroup': 120}
+
+    def __init__(self, max_entries=256, default_ttl=30, ttls=None):
+        """
+        ResponseCache class initializer.
+
+        :param max_entries: Maximum number of responses held before the least recently used one is evicted
+        :param default_ttl: Seconds a response is kept when its resource has no TTL of its own
+        :param ttls: A dictionary of resource name to TTL in seconds, merged over DEFAULT_TTLS
+        """
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def resource_of(uri):
+        """Returns the resource a URI belongs to, e.g. 'vm' for 'vm/qosConfig' or 'vm?name=foo'"""
+        return uri.split('?', 1)[0].strip('/').split('/', 1)[0]
+
+    def ttl_for(self, uri):
+        return self.ttls.get(self.resource_of(uri), self.default_ttl)
+
+    def get(self, uri):
+        """
+        Looks up a cached response.
+
+        :param uri: The request URI, query string included
+        :return: The cached response, or MISSING if there's no fresh entry
+        """
+        with self._lock:
+            entry = self._entries.get(uri)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            expires, value = entry
+            if expires <= time.time():
+                del self._entries[uri]
+                self.misses += 1
+                return MISSING
+
+            # Re-insert to mark the entry as most recently used
+            del self._entries[uri]
+            self._entries[uri] = entry
+            self.hits += 1
+            return value
+
+    def set(self, uri, value):
+        """Stores a response, evicting the least recently used entries if the cache is full"""
+        ttl = self.ttl_for(uri)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries.pop(uri, None)
+            self._entries[uri] = (time.time() + ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, resource=None):
+        """
+        Drops cached responses.
+
+        :param resource: Drop only the entries for this resource (e.g. 'vm'). Everything is dropped if None.
+        """
+        with self._lock:
+            if resource is None:
+                self._entries.clear()
+                return
+
+            for uri in [uri for uri in self._entries if self.resource_of(uri) == resource]:
+                del self._entries[uri]
+
+    def stats(self):
+        """Returns a dictionary of hit, miss and eviction counters along with the current size"""
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries)}
@@ -9,16 +9,167 @@
 
 import requests
 import json
+import time
 import kvtintri.exceptions
+import kvtintri.bulk
+import kvtintri.cache
+import kvtintri.jsonstream
+import kvtintri.metrics
+import kvtintri.query
+import kvtintri.resilience
+import kvtintri.throttle
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from requests.packages.urllib3.exceptions import InsecureRequestWarning
 except ImportError:
     pass
 
+try:
+    from requests.packages.urllib3.util.retry import Retry
+except ImportError:
+    Retry = None
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_TIMEOUT = (10, 120)
+DEFAULT_PAGE_SIZE = 500
+# Filtered selections of up to this many VMs fetch their virtual disks per VM instead of walking the whole listing
+HYDRATE_PER_VM_LIMIT = 50
+
+TINTRI_ERROR_TYPEID = 'com.tintri.api.rest.v310.dto.domain.beans.TintriError'
+
+# Stats summed across the members of a service group
+GROUP_ADDITIVE_STATS = ('normalizedTotalIops', 'operationsTotalIops', 'operationsReadIops', 'operationsWriteIops',
+                        'throughputTotalMBps', 'throughputReadMBps', 'throughputWriteMBps', 'spaceUsedGiB',
+                        'spaceProvisionedGiB')
+
+# Stats averaged across the members of a service group, weighted by each member's operationsTotalIops
+GROUP_WEIGHTED_STATS = ('latencyTotalMs', 'latencyHostMs', 'latencyNetworkMs', 'latencyStorageMs', 'latencyDiskMs',
+                        'flashHitPercent')
+
+
+def _build_http_session(pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES, ssl_verify=False):
+    """
+    Builds a keep-alive requests.Session with a connection pool sized for a single VMstore.
+
+    Connections are reused across calls so only the first request to an appliance pays for the TCP and TLS
+    handshake. Failures to connect are retried with a short backoff. Read errors and error statuses are left to
+    VMStore's RetryPolicy, which only retries idempotent requests.
+
+    :param pool_size: Number of connections to keep open to the appliance.
+    :param retries: Number of times a failed connection attempt is retried.
+    :param ssl_verify: A boolean that enables or disables SSL certificate validation.
+    :return: A configured requests.Session
+    """
+    http = requests.Session()
+    http.verify = ssl_verify
+
+    if Retry is not None:
+        max_retries = Retry(total=retries,
+                            connect=retries,
+                            read=0,
+                            backoff_factor=0.5)
+    else:
+        max_retries = retries
+
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=pool_size,
+                                            max_retries=max_retries)
+    http.mount('https://', adapter)
+    http.mount('http://', adapter)
+
+    return http
+
+def _login_payload(user, password):
+    return json.dumps({'username': user,
+                       'password': password,
+                       'typeId': 'com.tintri.api.rest.vcommon.dto.rbac.RestApiCredentials'})
+
+def _open_session(http, url, device, data, ssl_verify, timeout, metrics=None):
+    """
+    Posts credentials to the login endpoint.
+
+    :return: The JSESSIONID cookie of the new session
+    :raises kvtintri.exceptions.LoginError: if the appliance can't be reached or rejects the credentials
+    """
+    started = kvtintri.metrics.timer()
+
+    try:
+        r = http.post(url,
+                      data=data,
+                      headers={'Content-Type': 'application/json'},
+                      verify=ssl_verify,
+                      timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        if metrics is not None:
+            metrics.observe(device, 'POST', 'session/login', kvtintri.metrics.timer() - started, bytes_sent=len(data),
+                            error=e)
+        raise kvtintri.exceptions.LoginError('Could not reach {}: {}'.format(device, e), device)
+
+    if metrics is not None:
+        metrics.observe(device, 'POST', 'session/login', kvtintri.metrics.timer() - started, response=r,
+                        bytes_sent=len(data))
+
+    session = r.cookies.get('JSESSIONID')
+    if r.status_code >= 400 or not session:
+        raise kvtintri.exceptions.LoginError('Login to {} failed with HTTP {}'.format(device, r.status_code), device)
+
+    return session
+
+def _raise_for_tintri_error(result):
+    """Raises TintriError if a decoded response, or any item of a list response, is a TintriError"""
+    if type(result) != list:
+        result = [result]
+
+    for i in result:
+        if type(i) == dict and i.get("typeId") == TINTRI_ERROR_TYPEID:
+            raise kvtintri.exceptions.TintriError(message=i.get("message"), code=i.get("code"))
+
+def _next_offset(page, offset, count, page_size):
+    """Returns the offset of the page following one that held count items, or None if it was the last page"""
+    offset += count
+    total = page.get('filteredTotal')
+    if count == 0 or (total is not None and offset >= total) or (total is None and count < page_size):
+        return None
+    return offset
+
+def _latest_stat(container):
+    """
+    Returns the newest stat sample of a datastore, VM item or stats response, whose samples may sit under 'stat',
+    'items' and 'sortedStats' in any combination. Returns {} if there are none.
+    """
+    if type(container) == list:
+        for item in reversed(container):
+            stat = _latest_stat(item)
+            if stat:
+                return stat
+        return {}
+    if not container:
+        return {}
+    if 'sortedStats' in container:
+        return (container['sortedStats'] or [{}])[-1]
+    if 'items' in container:
+        return _latest_stat(container['items'])
+    if 'stat' in container:
+        return _latest_stat(container['stat'])
+    return {}
+
+def _uuid(value):
+    """Returns the UUID string from either a plain string or a Tintri Uuid dictionary"""
+    if type(value) == dict:
+        return value.get('uuid')
+    return value
+
 class TintriBase(object):
-    """This is here because it might be a good idea to have a base class for everything to inherit from"""
-    pass
+    """
+    Base class for objects built from Tintri API dictionaries.
+
+    Subclasses declare every attribute in __slots__ so instances carry no per-object __dict__, which matters when
+    holding tens of thousands of virtual machines.
+    """
+    __slots__ = ()
 
 class VMStore(object):
     """
@@ -30,7 +181,9 @@ class VMStore(object):
     """
     # TODO could probably just ditch the classmethod entirely and do it all through instantiation
 
-    def __init__(self, device, user, session, api_version, ssl_verify):
+    def __init__(self, device, user, session, api_version, ssl_verify, http_session=None, timeout=DEFAULT_TIMEOUT,
+                 cache=None, metrics=None, scheme='https', password=None, retry_policy=None, circuit_breaker=None,
+                 throttle=None, snapshot=None):
         """
         VMStore class initializer. The class itself should only be instantiated via the login @classmethod.
 
@@ -38,6 +191,19 @@ class VMStore(object):
         :param user:
         :param session:
         :param api_version:
+        :param ssl_verify:
+        :param http_session: A requests.Session holding the pooled connections to the appliance. One is created if
+                             not supplied.
+        :param timeout: Timeout in seconds applied to every request. Either a single number or a (connect, read) tuple.
+        :param cache: An optional kvtintri.ResponseCache used for GET requests
+        :param metrics: An optional kvtintri.RequestMetrics that records every request
+        :param scheme: 'https', or 'http' for a plain HTTP endpoint such as kvtintri.mockserver
+        :param password: Kept privately so an expired session can be renewed. Without it a 401 is raised as is.
+        :param retry_policy: A kvtintri.resilience.RetryPolicy for GET requests. Defaults to RetryPolicy().
+        :param circuit_breaker: A kvtintri.resilience.CircuitBreaker. Defaults to the one shared by every session to
+                                this device.
+        :param throttle: An optional kvtintri.throttle.Throttle limiting the rate and concurrency of requests
+        :param snapshot: An optional kvtintri.snapshot.SnapshotStore that unfiltered listings are served from
         """
         self.device = device
         self.user = user
@@ -46,9 +212,32 @@ class VMStore(object):
         self.headers = {'Content-Type': 'application/json',
                         'cookie': 'JSESSIONID=' + self.session}
         self.ssl_verify = ssl_verify
+        self.timeout = timeout
+        self.cache = cache
+        self.metrics = metrics
+        self.scheme = scheme
+        self.retry_policy = retry_policy if retry_policy is not None else kvtintri.resilience.RetryPolicy()
+        self.circuit_breaker = circuit_breaker or kvtintri.resilience.breaker_for(device)
+        self.throttle = throttle
+        self.snapshot = snapshot
+        self._password = password
+        self._login_lock = threading.Lock()
+
+        if http_session is None:
+            http_session = _build_http_session(ssl_verify=ssl_verify)
+        self.http = http_session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.logout()
+        return False
 
     @classmethod
-    def login(cls, device, user, password, ssl_verify=False):
+    def login(cls, device, user, password, ssl_verify=False, pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES,
+              timeout=DEFAULT_TIMEOUT, cache=None, metrics=None, scheme='https', retry_policy=None,
+              circuit_breaker=None, throttle=None, snapshot=None):
         """
         Used to construct the VMstore class and create the necessary headers for additional requests.
 
@@ -59,11 +248,33 @@ class VMStore(object):
 
             session = kvtintri.VMStore.login(device="10.25.36.10", username="admin", password="secret!")
 
+            # Or use it as a context manager so the session is always logged out and its connections released
+
+            with kvtintri.VMStore.login(device="10.25.36.10", username="admin", password="secret!") as session:
+                session.get_vms()
+
         :param device: A string containing the FQDN or IP address of a Tintri VMstore appliance.
         :param user: A string containing the username of an administrator on the VMstore appliance.
         :param password: A string containing the password for the user supplied.
         :param ssl_verify: A boolean that enables or disables SSL certificate validation. By default it is disabled.
-        :return: Returns the session cookie to be used in subsequent requests.
+        :param pool_size: Number of keep-alive connections held open to the appliance.
+        :param retries: Number of connection level retries for failed requests.
+        :param timeout: Timeout in seconds for every request. Either a single number or a (connect, read) tuple.
+        :param cache: An optional kvtintri.ResponseCache. When supplied GET responses are served from it while fresh
+                      and writes invalidate the entries of the resource they modify.
+        :param metrics: An optional kvtintri.RequestMetrics that records the login and every later request.
+        :param scheme: 'https', or 'http' for a plain HTTP endpoint such as kvtintri.mockserver.
+        :param retry_policy: A kvtintri.resilience.RetryPolicy controlling how GET requests are retried with jittered
+                             exponential backoff. Defaults to RetryPolicy().
+        :param circuit_breaker: A kvtintri.resilience.CircuitBreaker. Defaults to the one shared by every session to
+                                the device.
+        :param throttle: An optional kvtintri.throttle.Throttle shared by every request this session sends, e.g.
+                         kvtintri.throttle.throttle_for(device, rate=20, max_concurrency=16).
+        :param snapshot: An optional kvtintri.snapshot.SnapshotStore. Unfiltered vm, virtualDisk, datastore and
+                         servicegroup listings are served from it while fresh and refreshed in the background.
+        :return: An instance of VMStore. The password is kept on it privately so an expired session is renewed
+                 automatically.
+        :raises kvtintri.exceptions.LoginError: if the appliance can't be reached or rejects the credentials
         """
 
         api_version = 'v310'
@@ -74,44 +285,55 @@ class VMStore(object):
             except AttributeError:
                 pass
 
-        headers = {'Content-Type': 'application/json'}
-        payload = {'username': user,
-                   'password': password,
-                   'typeId': 'com.tintri.api.rest.vcommon.dto.rbac.RestApiCredentials'}
+        url = "{}://{}/api/{}/session/login".format(scheme, device, api_version)
 
-        url = "https://{}/api/{}/session/login".format(device, api_version)
+        http = _build_http_session(pool_size=pool_size, retries=retries, ssl_verify=ssl_verify)
 
         try:
-            r = requests.post(url,
-                              data=json.dumps(payload),
-                              headers = headers,
-                              verify = ssl_verify)
+            session = _open_session(http, url, device, _login_payload(user, password), ssl_verify, timeout, metrics)
+        except kvtintri.exceptions.LoginError:
+            http.close()
+            raise
 
-            session = r.cookies['JSESSIONID']
+        return cls(device, user, session, api_version, ssl_verify, http_session=http, timeout=timeout, cache=cache,
+                   metrics=metrics, scheme=scheme, password=password, retry_policy=retry_policy,
+                   circuit_breaker=circuit_breaker, throttle=throttle, snapshot=snapshot)
 
-            return cls(device, user, session, api_version, ssl_verify)
+    def _relogin(self, stale_session):
+        """
+        Replaces an expired session cookie with a new one. Only the first of several threads that saw the same
+        session expire logs in again; the others find the cookie already renewed.
+        """
+        with self._login_lock:
+            if self.session != stale_session:
+                return
 
-        except requests.exceptions.RequestException as e:
-            #TODO add proper exception handling here
-            pass
+            url = "{}://{}/api/{}/session/login".format(self.scheme, self.device, self.api_version)
+            self.session = _open_session(self.http, url, self.device, _login_payload(self.user, self._password),
+                                         self.ssl_verify, self.timeout, self.metrics)
+            self.headers = {'Content-Type': 'application/json',
+                            'cookie': 'JSESSIONID=' + self.session}
 
     def logout(self):
         """
-        Used to invalidate a session cookie.
+        Used to invalidate a session cookie. Also closes the pooled connections held by this session.
 
         :return: The response from the webserver if needed.
         """
 
-        url = "https://{}/api/{}/session/logout".format(self.device, self.api_version)
+        url = "{}://{}/api/{}/session/logout".format(self.scheme, self.device, self.api_version)
 
         try:
-            r = requests.get(url,
-                             headers = self.headers,
-                             verify = self.ssl_verify)
+            r = self.http.get(url,
+                              headers = self.headers,
+                              verify = self.ssl_verify,
+                              timeout = self.timeout)
 
             return r
         except requests.exceptions.RequestException:
             pass
+        finally:
+            self.http.close()
 
     def _request(self, uri, request_method='GET', payload=None, **kwargs):
         """
@@ -125,61 +347,366 @@ class VMStore(object):
         :return: dict of response from the webserver.
         """
 
-        url = "https://{}/api/{}/{}".format(self.device, self.api_version, uri)
+        url = "{}://{}/api/{}/{}".format(self.scheme, self.device, self.api_version, uri)
 
-        if request_method == "PUT" or "POST" and payload:
-            payload = json.dumps(payload)
-            r = requests.request(request_method,
-                                 url=url,
-                                 headers=self.headers,
-                                 verify=self.ssl_verify,
-                                 data=payload)
-            # TODO Add exception handling here
+        if request_method in ("PUT", "POST"):
+            payload = json.dumps(payload) if payload is not None else ''
+            try:
+                r, elapsed = self._send(request_method, uri, url, data=payload or None)
+            finally:
+                if self.cache is not None:
+                    self.cache.invalidate(kvtintri.cache.ResponseCache.resource_of(uri))
+                if self.snapshot is not None:
+                    self.snapshot.expire(self.device, kvtintri.cache.ResponseCache.resource_of(uri))
 
+            try:
+                if r.status_code >= 400:
+                    try:
+                        _raise_for_tintri_error(json.loads(r.content))
+                    except ValueError:
+                        pass
+                    r.raise_for_status()
+            except Exception as e:
+                self._observe(request_method, uri, elapsed, response=r, bytes_sent=len(payload), error=e)
+                raise
+
+            self._observe(request_method, uri, elapsed, response=r, bytes_sent=len(payload))
             return r.content
 
         elif request_method == "GET":
-            r = requests.request(request_method,
-                                 url=url,
-                                 headers=self.headers,
-                                 verify=self.ssl_verify)
-            result = json.loads(r.content)
-
-            if type(result) == list:
-                for i in result:
-                    if i["typeId"] == "com.tintri.api.rest.v310.dto.domain.beans.TintriError":
-                        raise kvtintri.exceptions.TintriError(message=result["message"], code=result["code"])
-            else:
-                if result["typeId"] == "com.tintri.api.rest.v310.dto.domain.beans.TintriError":
-                    raise kvtintri.exceptions.TintriError(message=result["message"], code=result["code"])
+            if self.cache is not None:
+                cached = self.cache.get(uri)
+                if cached is not kvtintri.cache.MISSING:
+                    if self.metrics is not None:
+                        self.metrics.observe_cache_hit(self.device, request_method, uri)
+                    return cached
 
-            return json.loads(r.content)
+            r, elapsed = self._send(request_method, uri, url)
+
+            started = kvtintri.metrics.timer()
+            try:
+                result = json.loads(r.content)
+                _raise_for_tintri_error(result)
+            except Exception as e:
+                self._observe(request_method, uri, elapsed, kvtintri.metrics.timer() - started, response=r, error=e)
+                raise
+            self._observe(request_method, uri, elapsed, kvtintri.metrics.timer() - started, response=r)
+
+            if self.cache is not None:
+                self.cache.set(uri, result)
+
+            return result
         else:
             raise kvtintri.exceptions.InvalidRequestMethod(
                 "Invalid request method. It must be either 'PUT', 'POST' or 'GET'. Request method called was: ",
                 request_method)
 
+    def _send(self, request_method, uri, url, data=None, stream=False):
+        """
+        Sends a request over the pooled HTTP session.
+
+        - Requests are refused with CircuitOpenError while the appliance's circuit breaker is open.
+        - A 401 renews the session once, when the password is known, and the request is sent again.
+        - GETs that fail to connect, time out or get a status in retry_policy.statuses are retried with jittered
+          exponential backoff. PUT and POST are never retried on those errors since they may have been applied.
+        - Each attempt waits for self.throttle, if set, and reports its latency back to it. For streamed responses
+          the slot is returned once the headers arrive.
+
+        Attempts that don't produce the returned response are recorded in self.metrics.
+
+        :return: A tuple of the requests.Response and the seconds the final attempt took
+        """
+        policy = self.retry_policy
+        idempotent = request_method == 'GET'
+        attempt = 0
+        renewed = False
+
+        # Retries belong to one logical request: it's admitted once and counts as one success or failure
+        self.circuit_breaker.before_request()
+        failed = True
+        try:
+            while True:
+                failed = True
+                session = self.session
+                if self.throttle is not None:
+                    self.throttle.acquire()
+
+                started = kvtintri.metrics.timer()
+                try:
+                    r = self.http.request(request_method,
+                                          url=url,
+                                          headers=self.headers,
+                                          verify=self.ssl_verify,
+                                          timeout=self.timeout,
+                                          data=data,
+                                          stream=stream)
+                except requests.exceptions.RequestException as e:
+                    if self.throttle is not None:
+                        self.throttle.release(kvtintri.metrics.timer() - started, overloaded=True)
+                    retrying = idempotent and attempt < policy.retries
+                    self._observe(request_method, uri, kvtintri.metrics.timer() - started,
+                                  bytes_sent=len(data or ''), error=e, retries=int(retrying))
+                    if not retrying:
+                        raise
+                    time.sleep(policy.delay(attempt))
+                    attempt += 1
+                    continue
+                except BaseException:
+                    # Anything else (KeyboardInterrupt, a bad argument) must still hand the throttle slot back
+                    if self.throttle is not None:
+                        self.throttle.release(kvtintri.metrics.timer() - started, overloaded=False)
+                    raise
+
+                elapsed = kvtintri.metrics.timer() - started
+                if self.throttle is not None:
+                    self.throttle.release(elapsed, overloaded=r.status_code in policy.statuses)
+
+                if r.status_code in policy.statuses:
+                    if idempotent and attempt < policy.retries:
+                        self._observe(request_method, uri, elapsed, response=r, bytes_sent=len(data or ''),
+                                      error=requests.exceptions.HTTPError(response=r), retries=1)
+                        r.close()
+                        time.sleep(policy.delay(attempt, r))
+                        attempt += 1
+                        continue
+                    return r, elapsed
+
+                failed = False
+
+                if r.status_code == 401 and self._password is not None and not renewed:
+                    self._observe(request_method, uri, elapsed, response=r, bytes_sent=len(data or ''),
+                                  error=requests.exceptions.HTTPError(response=r))
+                    r.close()
+                    # A failed re-login fails the request as a whole
+                    failed = True
+                    self._relogin(session)
+                    renewed = True
+                    continue
+
+                return r, elapsed
+        finally:
+            if failed:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+    def _observe(self, request_method, uri, request_seconds, parse_seconds=None, **kwargs):
+        """Records a request in self.metrics, if set. See kvtintri.metrics.RequestMetrics.observe for arguments."""
+        if self.metrics is not None:
+            self.metrics.observe(self.device, request_method, uri, request_seconds, parse_seconds, **kwargs)
+
     def _filter(self, **kwargs):
-        """Generic filter function to allow you to filter on various REST API object properties"""
+        """
+        Builds the query string for filtering on various REST API object properties. Values are URL encoded, booleans
+        become true/false and lists become comma separated. See kvtintri.query.
 
-        filters = "?"
-        if len(kwargs) >= 2:
-            for i in kwargs.keys():
-                filters = filters + i + "=" + kwargs[i] + "&"
-            return filters
-        else:
-            for i in kwargs.keys():
-                filters = filters + i + "=" + kwargs[i]
-            return filters
+        :return: A string starting with '?', or '' if there are no filters
+        """
+        return kvtintri.query.encode(kwargs)
 
-    def get_virtualdisks(self, **kwargs):
+    def _stream(self, uri, key='items'):
+        """
+        Issues a GET and decodes the response body incrementally as it downloads instead of reading it whole.
+
+        :param uri: String - URI for the API call
+        :param key: The top level member of the response whose array is streamed
+        :return: A kvtintri.jsonstream.ItemStream yielding the items. Its fields attribute holds the other top level
+                 members of the response once iteration is complete.
+        """
+
+        url = "{}://{}/api/{}/{}".format(self.scheme, self.device, self.api_version, uri)
+
+        started = kvtintri.metrics.timer()
+        r, elapsed = self._send('GET', uri, url, stream=True)
+
+        if r.status_code >= 400:
+            try:
+                try:
+                    _raise_for_tintri_error(json.loads(r.content))
+                except ValueError:
+                    pass
+                finally:
+                    r.close()
+                r.raise_for_status()
+            except Exception as e:
+                self._observe('GET', uri, elapsed, response=r, error=e)
+                raise
+
+        def chunks():
+            # Decoding is interleaved with the download, so the whole stream counts as request time
+            received = 0
+            try:
+                for chunk in r.iter_content(chunk_size=kvtintri.jsonstream.DEFAULT_CHUNK_SIZE):
+                    received += len(chunk)
+                    yield chunk
+            finally:
+                r.close()
+                self._observe('GET', uri, kvtintri.metrics.timer() - started, response=r, bytes_received=received)
+
+        return kvtintri.jsonstream.ItemStream(chunks(), key=key)
 
-        if kwargs:
-            resource = self._filter(**kwargs)
-            url = 'virtualDisk' + resource
-            return self._request(url)
+    def _iter_pages(self, uri, page_size=DEFAULT_PAGE_SIZE, prefetch=False, stream=False, **kwargs):
+        """
+        Yields the items of a paged API listing. Unfiltered listings are served from self.snapshot while it's fresh
+        enough; otherwise, and for filtered listings, the appliance is walked with _walk_pages. A complete unfiltered
+        walk is saved as the new snapshot.
+
+        Arguments are the same as for _walk_pages.
+        """
+        if isinstance(uri, kvtintri.query.Query) and not uri.params:
+            uri = uri.resource
+        if self.snapshot is not None and not kwargs and uri in self.snapshot.LISTINGS:
+            if self.snapshot.fresh(self, uri):
+                return self.snapshot.items(self.device, uri)
+            return self.snapshot.record(self.device, uri, self._walk_pages(uri, page_size=page_size,
+                                                                           prefetch=prefetch, stream=stream))
+        return self._walk_pages(uri, page_size=page_size, prefetch=prefetch, stream=stream, **kwargs)
+
+    def _walk_pages(self, uri, page_size=DEFAULT_PAGE_SIZE, prefetch=False, stream=False, **kwargs):
+        """
+        Walks a paged API listing using offset and limit, yielding the items of each page as it arrives. Only one
+        page is held in memory at a time.
+
+        :param uri: The resource to list, e.g. 'vm' or 'virtualDisk', or a kvtintri.query.Query. A limit or offset in
+                    the filters caps the total number of items or sets where the walk starts.
+        :param page_size: Number of items requested per page.
+        :param prefetch: If True the next page is requested in a background thread while the current page is being
+                         consumed, so parsing overlaps network I/O.
+        :param stream: If True each page is decoded item by item as it downloads, so even a very large page_size
+                       keeps memory flat. Prefetch doesn't apply when streaming.
+        :param kwargs: Filters passed through to the API (see get_vms)
+        :return: A generator of python dictionaries, one per item.
+        """
+
+        if isinstance(uri, kvtintri.query.Query):
+            filters = dict(uri.params, **kwargs)
+            uri = uri.resource
         else:
-            return self._request('vm')
+            filters = kwargs
+        start = int(filters.pop('offset', None) or 0)
+        total = filters.pop('limit', None)
+        end = start + int(total) if total is not None else None
+
+        if end is not None and end - start < page_size:
+            page_size = max(end - start, 1)
+
+        def fetch(offset):
+            limit = page_size if end is None else max(min(page_size, end - offset), 1)
+            page_uri = uri + self._filter(offset=offset, limit=limit, **filters)
+            if stream:
+                return self._stream(page_uri)
+            return self._request(page_uri)
+
+        def advance(fields, offset, count):
+            offset = _next_offset(fields, offset, count, page_size)
+            if offset is not None and end is not None and offset >= end:
+                return None
+            return offset
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch and not stream else None
+        next_page = None
+
+        try:
+            offset = start
+            page = fetch(offset)
+
+            while True:
+                if stream:
+                    count = 0
+                    for item in page:
+                        count += 1
+                        yield item
+
+                    _raise_for_tintri_error(page.fields)
+                    offset = advance(page.fields, offset, count)
+                    if offset is None:
+                        break
+                    page = fetch(offset)
+                    continue
+
+                if type(page) == list:
+                    items = page
+                    offset = None
+                else:
+                    items = page.get('items', [])
+                    offset = advance(page, offset, len(items))
+
+                if offset is not None and executor:
+                    next_page = executor.submit(fetch, offset)
+
+                for item in items:
+                    yield item
+
+                if offset is None:
+                    break
+
+                if executor:
+                    page = next_page.result()
+                    next_page = None
+                else:
+                    page = fetch(offset)
+        finally:
+            if executor:
+                if next_page is not None:
+                    next_page.cancel()
+                executor.shutdown(wait=False)
+
+    def find(self, query, page_size=DEFAULT_PAGE_SIZE, prefetch=True, stream=False):
+        """
+        Lazily retrieves every item matching a kvtintri.query.Query, with filtering, sorting and paging done by the
+        appliance.
+
+        Sample usage:
+            from kvtintri.query import Query
+
+            for item in session.find(Query('vm', vcenterName="dev-vc1", isPowered=True).limit(50)):
+                print(item['vmware']['name'])
+
+        :param query: A kvtintri.query.Query
+        :param page_size: Number of items requested per page.
+        :param prefetch: Request the next page in the background while the current one is being processed.
+        :param stream: Decode each page incrementally as it downloads to keep memory flat with large page sizes.
+        :return: A generator of python dictionaries, one per item
+        """
+        return self._iter_pages(query, page_size=page_size, prefetch=prefetch, stream=stream)
+
+    def iter_vms(self, page_size=DEFAULT_PAGE_SIZE, prefetch=True, stream=False, query=None, **kwargs):
+        """
+        Lazily retrieves every virtual machine on the Tintri VMstore, walking the API pages as they're consumed.
+        Unlike get_vms() this isn't limited to the first page of results.
+
+        Sample usage:
+            for vm in session.iter_vms(vcenterName="dev-vc1", page_size=1000):
+                print(vm.name)
+
+        :param page_size: Number of virtual machines requested per page.
+        :param prefetch: Request the next page in the background while the current one is being processed.
+        :param stream: Decode each page incrementally as it downloads to keep memory flat with large page sizes.
+        :param query: An optional kvtintri.query.Query on 'vm' to walk instead of every VM
+        :param kwargs: The same filters supported by get_vms()
+        :return: A generator of VirtualMachine instances
+        """
+        for vm in self._iter_pages(query or 'vm', page_size=page_size, prefetch=prefetch, stream=stream, **kwargs):
+            yield VirtualMachine.from_dict(vm)
+
+    def iter_virtualdisks(self, page_size=DEFAULT_PAGE_SIZE, prefetch=True, stream=False, **kwargs):
+        """
+        Lazily retrieves every virtual disk on the Tintri VMstore, walking the API pages as they're consumed.
+
+        :param page_size: Number of virtual disks requested per page.
+        :param prefetch: Request the next page in the background while the current one is being processed.
+        :param stream: Decode each page incrementally as it downloads to keep memory flat with large page sizes.
+        :param kwargs: The same filters supported by get_virtualdisks()
+        :return: A generator of python dictionaries, one per virtual disk
+        """
+        return self._iter_pages('virtualDisk', page_size=page_size, prefetch=prefetch, stream=stream, **kwargs)
+
+    def get_virtualdisks(self, **kwargs):
+        """
+        Retrieves the first page of virtual disks. Supports the vmUuid, name, offset, limit, sortedBy and sortOrder
+        filters as keyword arguments.
+        """
+        return self._request('virtualDisk' + self._filter(**kwargs))
 
     def get_virtualdisk(self):
         """
@@ -219,9 +746,9 @@ class VMStore(object):
 
             session.get_vms(name="foo-") # returns all VMs with "foo-" in the name
 
-        isPowered - A string containing either True or False that will return matching virtual machines
+        isPowered - True or False, returns matching virtual machines
 
-            session.get_vms(isPowered="False") # returns all virtual machines where the power state is off
+            session.get_vms(isPowered=False) # returns all virtual machines where the power state is off
 
         vcenterName - A string containing all or part of the name of the vCenter housing the virtual machine
 
@@ -231,17 +758,21 @@ class VMStore(object):
 
             session.get_vms(host="dev-esxi12")
 
+        sortedBy, sortOrder, offset and limit - Server side sorting and paging
+
+            session.get_vms(sortedBy="name", sortOrder="DESC", limit=10)
+
+        Values are URL encoded, so names containing spaces, '&' or '#' are safe. kvtintri.query.Query builds the same
+        filters and can be passed to find() or iter_vms().
+
+        Only the first page of results is returned. Use iter_vms() to walk the full inventory.
+
         :parameter **kwargs: An optional parameter that allows filtering on any number of attributes.
         :return: A python dictionary containing the results of the query
 
         """
 
-        if kwargs:
-            resource = self._filter(**kwargs)
-            url = 'vm' + resource
-            return self._request(url)
-        else:
-            return self._request('vm')
+        return self._request('vm' + self._filter(**kwargs))
 
     def get_vm(self, vm_id):
         """Retrives an individual VM based on passed in string for 'vm_id'"""
@@ -263,14 +794,72 @@ class VMStore(object):
         uri = 'vm/qosConfig'
         return self._request(uri=uri, request_method='PUT', payload=payload)
 
+    def set_qos_bulk(self, vms, batch_size=kvtintri.bulk.DEFAULT_BATCH_SIZE, max_workers=kvtintri.bulk.DEFAULT_WORKERS,
+                     progress=None):
+        """
+        Updates QoS on many virtual machines at once using the qos_min_iops and qos_max_iops stored on each of them.
+        VMs sharing the same values are updated together in batched requests that run concurrently.
+
+        Sample usage:
+            vm_list = list(session.iter_vms(name="foo-"))
+            for vm in vm_list:
+                vm.qos_max_iops = 5000
+
+            for result in session.set_qos_bulk(vm_list):
+                if not result.success:
+                    print(result.name, result.error)
+
+        :param vms: An iterable of VirtualMachine instances
+        :param batch_size: Maximum number of VMs updated by a single request
+        :param max_workers: Maximum number of requests in flight at once
+        :param progress: A progress file path to resume an interrupted update from. See bulk().
+        :return: A list of kvtintri.bulk.QoSResult tuples, one per virtual machine
+        """
+        return kvtintri.bulk.bulk_update_qos(self, vms, batch_size=batch_size, max_workers=max_workers,
+                                             progress=progress)
+
+    def bulk(self, selector, operation, progress=None, max_workers=kvtintri.bulk.DEFAULT_WORKERS, page_size=None,
+             callback=None):
+        """
+        Applies a kvtintri.bulk.BulkOperation to many virtual machines, in batched requests where the operation
+        allows it, run concurrently by at most max_workers threads.
+
+        Sample usage:
+            from kvtintri.bulk import QoSOperation
+
+            report = session.bulk({'vcenterName': 'dev-vc1'}, QoSOperation(0, 5000), progress='dev-vc1.progress')
+            print(report.summary())
+
+        :param selector: The VMs to change: None for all of them, a Query, a dictionary of filters, a predicate
+                         function or an iterable of VirtualMachines. See kvtintri.bulk.select().
+        :param operation: A kvtintri.bulk.BulkOperation such as QoSOperation, SelectionOperation or ViewOperation
+        :param progress: Path of a progress file. VMs it records as done are skipped and this run is appended to it,
+                         so an interrupted run can be started again with the same arguments.
+        :param max_workers: Maximum number of requests in flight at once
+        :param page_size: Number of VMs requested per page when the selector walks the listing
+        :param callback: Called with the kvtintri.bulk.BulkReport after every finished batch
+        :return: A kvtintri.bulk.BulkReport with per-VM results and throughput
+        """
+        return kvtintri.bulk.run_bulk(self, selector, operation, progress=progress, max_workers=max_workers,
+                                      page_size=page_size, callback=callback)
+
+    def _document(self, resource):
+        """GETs a whole listing, serving it from self.snapshot while fresh enough and saving it otherwise"""
+        if self.snapshot is None:
+            return self._request(resource)
+        if self.snapshot.fresh(self, resource):
+            return self.snapshot.document(self.device, resource)
+        result = self._request(resource)
+        self.snapshot.save(self.device, resource, [result])
+        return result
+
     def get_datastores(self):
         """Get all of the datastores on the Tintri VMStore"""
-        return self._request('datastore')
+        return self._document('datastore')
 
     def get_datastore(self, datastore_uuid='default'):
         """Returns a dictionary for the given datastore passed as a string"""
-        # uri = 'datastore/' + str(datastore_uuid)
-        uri = 'datastore/'
+        uri = 'datastore/' + str(datastore_uuid)
         return self._request(uri=uri)
 
     def get_appliances(self):
@@ -284,15 +873,45 @@ class VMStore(object):
 
     def get_service_groups(self):
         """Get all of the service groups on the Tintri VMStore"""
-        return self._request('servicegroup')
+        return self._document('servicegroup')
 
     def get_service_group(self, service_group_uuid):
         """Returns a specific service group"""
         uri = 'servicegroup/' + service_group_uuid
         return self._request(uri=uri)
 
-    def get_realtime_datastore_performance(self, uuid):
-        uri = 'datastore/'
+    def get_realtime_datastore_performance(self, uuid='default'):
+        """Returns the realtime stats of a datastore given its UUID or a Datastore instance"""
+        return self.get_datastore_stats_realtime(getattr(uuid, 'uuid', uuid))
+
+    def get_datastore_stats_realtime(self, datastore_uuid='default'):
+        """Returns the realtime performance and capacity stats of a datastore"""
+        uri = 'datastore/{}/statsRealtime'.format(datastore_uuid)
+        return self._request(uri=uri)
+
+    def get_datastore_stats_historic(self, datastore_uuid='default', **kwargs):
+        """
+        Returns the historic performance and capacity stats of a datastore.
+
+        :param datastore_uuid: The UUID of the datastore
+        :param kwargs: Optional 'since' and 'until' timestamps, e.g. since="2016-03-01T00:00:00.000-08:00"
+        """
+        uri = 'datastore/{}/statsHistoric'.format(datastore_uuid) + self._filter(**kwargs)
+        return self._request(uri=uri)
+
+    def get_vm_stats_realtime(self, vm_uuid):
+        """Returns the realtime performance stats of a virtual machine"""
+        uri = 'vm/{}/statsRealtime'.format(vm_uuid)
+        return self._request(uri=uri)
+
+    def get_vm_stats_historic(self, vm_uuid, **kwargs):
+        """
+        Returns the historic performance stats of a virtual machine.
+
+        :param vm_uuid: The UUID of the virtual machine
+        :param kwargs: Optional 'since' and 'until' timestamps, e.g. since="2016-03-01T00:00:00.000-08:00"
+        """
+        uri = 'vm/{}/statsHistoric'.format(vm_uuid) + self._filter(**kwargs)
         return self._request(uri=uri)
 
     def get_failed_components(self):
@@ -315,7 +934,7 @@ class VMStore(object):
     def __test__request_exception(self):
         return self._request('bogusUri', request_method='BLARG')
 
-class Datastore(object):
+class Datastore(TintriBase):
     """
 
     Provides an interface to collect information about a given datastore. This can be used to determine capacity,
@@ -334,44 +953,89 @@ class Datastore(object):
             my_datastore = kvtintri.Datastore.get(session)
 
             # access attributes and properties
-            print my_datastore.total_space_gib
-            print my_datastore.space_free_percentage
-            print my_datastore.performance_reserve_remaining
+            print(my_datastore.total_space_gib)
+            print(my_datastore.space_free_percentage)
+            print(my_datastore.performance_reserve_remaining)
+
+            # every datastore, with realtime stats fetched in parallel
+            for datastore in kvtintri.Datastore.get_all(session):
+                print(datastore.uuid, datastore.space_used_percentage)
 
     """
-    ### CLASS NO LONGER APPEARS TO BE WORKING
-    ###
-
-    def __init__(self, datastore):
-        self.space_used_gib = datastore['stat']['spaceUsedGiB']
-        self.performance_reserve_remaining = datastore['stat']['performanceReserveRemaining']
-        self.performance_reserve_used = datastore['stat']['performanceReserveUsed']
-        self.total_space_gib = datastore['stat']['spaceTotalGiB']
-        self.space_used_gib = datastore['stat']['spaceUsedGiB']
-        self.flash_hit_percentage = datastore['stat']['flashHitPercent']
-        self.space_remaining_physical = datastore['stat']['spaceRemainingPhysicalGiB']
-        self.space_used_physical_gib = datastore['stat']['spaceUsedPhysicalGiB']
+
+    __slots__ = ('uuid', 'space_used_gib', 'performance_reserve_remaining', 'performance_reserve_used',
+                 'total_space_gib', 'flash_hit_percentage', 'space_remaining_physical', 'space_used_physical_gib',
+                 'storage_containers')
+
+    def __init__(self, datastore, stat=None):
+        """
+        Datastore class initializer.
+
+        :param datastore: A datastore dictionary as returned by the API
+        :param stat: A stat sample to use instead of the newest one embedded in the datastore, e.g. from
+                     statsRealtime
+        """
+        if stat is None:
+            stat = _latest_stat(datastore)
+
         self.uuid = datastore['uuid']['uuid']
-        self.storage_containers = datastore['storageContainers']
+        self.space_used_gib = stat.get('spaceUsedGiB')
+        self.performance_reserve_remaining = stat.get('performanceReserveRemaining')
+        self.performance_reserve_used = stat.get('performanceReserveUsed')
+        self.total_space_gib = stat.get('spaceTotalGiB')
+        self.flash_hit_percentage = stat.get('flashHitPercent')
+        self.space_remaining_physical = stat.get('spaceRemainingPhysicalGiB')
+        self.space_used_physical_gib = stat.get('spaceUsedPhysicalGiB')
+        self.storage_containers = datastore.get('storageContainers')
 
     @property
     def space_used_percentage(self):
-        return (self.space_used_gib / self.total_space_gib) * 100
+        """Percentage of the datastore's space in use, or None if its stats are missing"""
+        if self.space_used_gib is None or not self.total_space_gib:
+            return None
+        return (float(self.space_used_gib) / self.total_space_gib) * 100
 
     @property
     def space_free_percentage(self):
-        return 100 - ((self.space_used_gib / self.total_space_gib) * 100)
+        """Percentage of the datastore's space free, or None if its stats are missing"""
+        used = self.space_used_percentage
+        return None if used is None else 100 - used
 
     def get_realtime_performance(self, session):
         return session.get_realtime_datastore_performance(self)
 
-
     @classmethod
-    def get(cls, session, datastore_uuid=None):
-        datastore = session.get_datastore(datastore_uuid)
+    def get(cls, session, datastore_uuid='default'):
+        datastore = session.get_datastore(datastore_uuid or 'default')
         return cls(datastore)
 
-class VirtualMachine(object):
+    @classmethod
+    def get_all(cls, session, realtime=True, max_workers=kvtintri.bulk.DEFAULT_WORKERS):
+        """
+        Retrieves every datastore on the VMstore.
+
+        :param session: An instance of the VMStore object
+        :param realtime: Fetch each datastore's statsRealtime, max_workers at a time, rather than using the stats
+                         embedded in the listing
+        :param max_workers: Maximum number of statsRealtime requests in flight
+        :return: A list of Datastore instances
+        """
+        datastores = session.get_datastores()
+        if type(datastores) == dict:
+            datastores = datastores.get('items', [datastores])
+        if not realtime or not datastores:
+            return [cls(datastore) for datastore in datastores]
+
+        def fetch(datastore):
+            # Realtime values win, but fields missing from them keep the listing's values
+            stat = dict(_latest_stat(datastore))
+            stat.update(_latest_stat(session.get_datastore_stats_realtime(datastore['uuid']['uuid'])))
+            return cls(datastore, stat=stat)
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(datastores))) as executor:
+            return list(executor.map(fetch, datastores))
+
+class VirtualMachine(TintriBase):
     '''
 
         It may be handy in the future to store instances of virtual machines to retrieve other bits of data
@@ -381,28 +1045,29 @@ class VirtualMachine(object):
     # TODO learn more about @property to avoid getters/setters
     # TODO consider @property for QoS params
 
+    __slots__ = ('typeid', 'uuid', 'vcenter', 'host', 'name', 'power_state', 'is_template', 'hypervisor', 'moref',
+                 'storage_containers', 'qos_max_iops', 'qos_min_iops', 'qos_typeid', 'virtualdisks')
+
     def __init__(self, virtualmachine, virtual_disks=None):
+        vmware = virtualmachine['vmware']
+
         self.typeid = virtualmachine['typeId']
         self.uuid = virtualmachine['uuid']['uuid']
-        self.vcenter = virtualmachine['vmware']['vcenterName']
-        self.name = virtualmachine['vmware']['name']
-        self.power_state = virtualmachine['vmware']['isPowered']
-        self.is_template = virtualmachine['vmware']['isTemplate']
-        self.hypervisor = virtualmachine['vmware']['hypervisorType']
-
-        if 'vcenterName' in virtualmachine['vmware'].keys():
-            self.vcenter = virtualmachine['vmware']['vcenterName']
-
-        if 'mor' in virtualmachine['vmware'].keys():
-            self.moref = virtualmachine['vmware']['mor']
-
-        if 'storageContainers' in virtualmachine['vmware'].keys():
-            self.storage_containers = virtualmachine['vmware']['storageContainers']
-
-        if 'qosConfig' in virtualmachine.keys():
-            self.qos_max_iops = virtualmachine['qosConfig']['maxNormalizedIops']
-            self.qos_min_iops = virtualmachine['qosConfig']['minNormalizedIops']
-            self.qos_typeid = virtualmachine['qosConfig']['typeId']
+        self.name = vmware['name']
+        self.vcenter = vmware.get('vcenterName')
+        self.host = vmware.get('host')
+        self.power_state = vmware.get('isPowered')
+        self.is_template = vmware.get('isTemplate')
+        self.hypervisor = vmware.get('hypervisorType')
+        self.moref = vmware.get('mor')
+        self.storage_containers = vmware.get('storageContainers')
+
+        # QoS values are False rather than None when the VM has no qosConfig
+        qos = virtualmachine.get('qosConfig')
+        if qos:
+            self.qos_max_iops = qos['maxNormalizedIops']
+            self.qos_min_iops = qos['minNormalizedIops']
+            self.qos_typeid = qos['typeId']
         else:
             self.qos_max_iops = False
             self.qos_min_iops = False
@@ -411,24 +1076,32 @@ class VirtualMachine(object):
         self.virtualdisks = virtual_disks
 
     @classmethod
-    def from_name(cls, session, name):
+    def from_name(cls, session, name, index=None):
         """
         Creates an instance of a class from the specified name
 
+        The API's name filter matches substrings, so the listing is narrowed on the appliance and the exact name is
+        checked here. To look up many VMs by name load a kvtintri.VMIndex once and pass it as index.
+
         :param session:
         :param name:
-        :return:
+        :param index: An optional kvtintri.VMIndex to look the name up in instead of querying the appliance
+        :return: The VirtualMachine, or a list of the matching VirtualMachines if the name doesn't match exactly
+                 one VM.
 
         """
-        virtual_machine_list = session.get_vms(name=name)
+        if index is not None:
+            matches = index.by_name(name)
+            if len(matches) == 1:
+                return matches[0]
+            return matches
 
-        if virtual_machine_list['filteredTotal'] == 1:
-            for i in virtual_machine_list['items']:
-                virtual_machine = i['uuid']['uuid']
-                return cls(session.get_vm(vm_id=virtual_machine))
-        else:
-            return virtual_machine_list
+        matches = [cls(i) for i in session._iter_pages('vm', name=name) if i['vmware']['name'] == name]
 
+        if len(matches) == 1:
+            return matches[0]
+        else:
+            return matches
 
     @classmethod
     def from_dict(cls, vm):
@@ -464,11 +1137,63 @@ class VirtualMachine(object):
 
         return cls(vm)
 
+    @classmethod
+    def from_dicts(cls, virtualmachines, virtual_disks):
+        """
+        Creates instances of this class from lists of VM and virtual disk dictionaries retrieved previously, attaching
+        each VM's virtual disks to it. Disks are joined to their VMs through a dictionary keyed on the VM UUID, so
+        this is a single pass over each list.
+
+        :param virtualmachines: An iterable of VM dictionaries (for example from VMStore.iter_vms or get_vms()['items'])
+        :param virtual_disks: An iterable of virtual disk dictionaries (for example from VMStore.iter_virtualdisks)
+        :return: A list of VirtualMachine instances with virtualdisks populated
+        """
+        disks_by_vm = {}
+        for disk in virtual_disks:
+            disks_by_vm.setdefault(_uuid(disk.get('vmUuid')), []).append(disk)
+
+        return [cls(vm, disks_by_vm.get(vm['uuid']['uuid'], [])) for vm in virtualmachines]
+
+    @classmethod
+    def hydrate_all(cls, session, page_size=DEFAULT_PAGE_SIZE, max_workers=kvtintri.bulk.DEFAULT_WORKERS, **kwargs):
+        """
+        Creates fully populated instances of this class, virtual disks included, for every VM on the VMstore using a
+        fixed number of list calls instead of two REST calls per VM as .from_uuid() would need.
+
+        When kwargs narrow the selection to at most HYDRATE_PER_VM_LIMIT VMs, each VM's disks are fetched with a
+        vmUuid filtered request, max_workers at a time, rather than walking every disk on the appliance.
+
+        Sample usage:
+            vm_list = kvtintri.VirtualMachine.hydrate_all(session, vcenterName="dev-vc1")
+            for vm in vm_list:
+                print(vm.name, len(vm.virtualdisks))
+
+        :param session: An instance of the VMStore object
+        :param page_size: Number of items requested per page
+        :param max_workers: Maximum number of per-VM disk requests in flight at once
+        :param kwargs: The same filters supported by VMStore.get_vms()
+        :return: A list of VirtualMachine instances with virtualdisks populated
+        """
+        virtualmachines = list(session._iter_pages('vm', page_size=page_size, **kwargs))
+        if not virtualmachines:
+            return []
+
+        if kwargs and len(virtualmachines) <= HYDRATE_PER_VM_LIMIT:
+            def fetch(vm):
+                return list(session._iter_pages('virtualDisk', page_size=page_size, vmUuid=vm['uuid']['uuid']))
+
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(virtualmachines))) as executor:
+                virtual_disks = [disk for disks in executor.map(fetch, virtualmachines) for disk in disks]
+        else:
+            virtual_disks = session._iter_pages('virtualDisk', page_size=page_size, prefetch=True)
+        return cls.from_dicts(virtualmachines, virtual_disks)
+
     @classmethod
     def from_uuid(cls, session, vm_uuid):
         """
         Create an instance of this class by the UUID of a given virtual machine. This will use the REST API on the
-        Tintri VMStore and may be slower than using VirtualMachine.from_dict.
+        Tintri VMStore and may be slower than using VirtualMachine.from_dict. Use VirtualMachine.hydrate_all when
+        many virtual machines are needed.
 
         :param session: An instance of the VMStore object
         :param vm_uuid: The UUID of a virtual machine that is available in the instance of the VMStore object)
@@ -486,31 +1211,171 @@ class VirtualMachine(object):
         """
         # TODO retrieve keys and values from VM JSON to populate these vars
 
-        mod_qos = {"typeId": "com.tintri.api.rest.v310.dto.domain.beans.vm.VirtualMachineQoSConfig",
-                   "minNormalizedIops": self.qos_min_iops,
-                   "maxNormalizedIops": self.qos_max_iops}
-
-        payload = {"typeId": "com.tintri.api.rest.v310.dto.MultipleSelectionRequest",
-                    "ids": [self.uuid],
-                    "newValue": mod_qos,
-                    "propertyNames": ["minNormalizedIops", "maxNormalizedIops"]}
+        payload = kvtintri.bulk.qos_payload([self.uuid], self.qos_min_iops, self.qos_max_iops)
 
         return session.set_qos(payload)
 
 
 
 
-class ServiceGroup(object):
+class ServiceGroup(TintriBase):
     """
-    Coming soon!
+    A service group on the Tintri VMstore.
+
+    Members are found through the serviceGroupIds field of each VM in the vm listing. resolve() walks the listing once
+    for any number of groups and joins on that field, so resolving every group on an appliance costs one walk rather
+    than a request per group or per VM. The walk is served from the session's snapshot store when it has one, except
+    before set_qos(), which always reads the membership from the appliance so a stale snapshot can't misdirect a write.
+
+    Sample usage:
+            service_group = kvtintri.ServiceGroup.get(session, "0000000-SG-0000000000000000-0000000000000001",
+                                                      resolve=True)
+            print(service_group.name, len(service_group.members), service_group.stats['operationsTotalIops'])
+
+            for group in kvtintri.ServiceGroup.get_all(session):
+                group.set_qos(session, 0, 5000)     # one vm/qosConfig request per group
 
     """
-    def __init__(self):
-        pass
+    __slots__ = ('typeid', 'uuid', 'name', 'members', 'stats', 'live')
+
+    def __init__(self, service_group, members=None, stats=None):
+        """
+        ServiceGroup class initializer.
+
+        :param service_group: A service group dictionary as returned by the API
+        :param members: A list of VirtualMachine instances, or None until resolved
+        :param stats: A dictionary of aggregated member stats, or None until resolved
+        """
+        self.typeid = service_group.get('typeId')
+        self.uuid = service_group['uuid']['uuid']
+        self.name = service_group.get('name')
+        self.members = members
+        self.stats = stats
+        # True once members were read from the appliance rather than a snapshot
+        self.live = False
+
+    @classmethod
+    def get(cls, session, service_group_uuid, resolve=False):
+        """
+        Retrieves a service group.
 
+        :param resolve: Also find its members and aggregate their stats
+        """
+        service_group = cls(session.get_service_group(service_group_uuid))
+        if resolve:
+            cls.resolve(session, [service_group])
+        return service_group
 
     @classmethod
-    def get(cls, session, service_group_uuid):
-        service_group = session.get_service_group(service_group_uuid)
-        return cls(service_group)
+    def get_all(cls, session, resolve=True, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Retrieves every service group on the VMstore.
+
+        :param resolve: Also find the members of every group with a single walk of the vm listing
+        :param page_size: Page size of that walk
+        :return: A list of ServiceGroup instances
+        """
+        service_groups = session.get_service_groups()
+        if type(service_groups) == dict:
+            service_groups = service_groups.get('items', [])
 
+        groups = [cls(service_group) for service_group in service_groups]
+        if resolve:
+            cls.resolve(session, groups, page_size=page_size)
+        return groups
+
+    @staticmethod
+    def resolve(session, groups, page_size=DEFAULT_PAGE_SIZE, live=False):
+        """
+        Sets the members and stats of service groups from one walk of the vm listing.
+
+        Additive stats (GROUP_ADDITIVE_STATS) are summed over the members' latest samples and the others
+        (GROUP_WEIGHTED_STATS) are averaged weighted by each member's operationsTotalIops, so a busy VM's latency
+        counts for more than an idle one's.
+
+        :param session: An instance of the VMStore object
+        :param groups: An iterable of ServiceGroup instances
+        :param page_size: Number of VMs requested per page
+        :param live: Walk the appliance's listing even if the session's snapshot store could serve it
+        """
+        live = live or getattr(session, 'snapshot', None) is None
+        by_uuid = dict((group.uuid, group) for group in groups)
+        totals = {}
+        for group in by_uuid.values():
+            group.members = []
+            group.live = live
+            totals[group.uuid] = _GroupTotals()
+
+        walk = session._walk_pages if live else session._iter_pages
+        for item in walk('vm', page_size=page_size, prefetch=True):
+            vm = None
+            for service_group_uuid in item.get('serviceGroupIds') or ():
+                group = by_uuid.get(_uuid(service_group_uuid))
+                if group is None:
+                    continue
+                if vm is None:
+                    vm = VirtualMachine.from_dict(item)
+                    stat = _latest_stat(item)
+                group.members.append(vm)
+                if stat:
+                    totals[group.uuid].add(stat)
+
+        for group in by_uuid.values():
+            group.stats = totals[group.uuid].result()
+            group.stats['members'] = len(group.members)
+
+    def set_qos(self, session, min_iops, max_iops):
+        """
+        Sets the same QoS values on every member with a single vm/qosConfig request. Members read from a snapshot
+        are resolved again from the appliance first.
+
+        :param session: An instance of the VMStore object
+        :param min_iops: Minimum normalized IOPS
+        :param max_iops: Maximum normalized IOPS
+        :return: The number of VMs updated
+        """
+        if self.members is None or not self.live:
+            self.resolve(session, [self], live=True)
+        if not self.members:
+            return 0
+
+        session.set_qos(kvtintri.bulk.qos_payload([vm.uuid for vm in self.members], min_iops, max_iops))
+
+        for vm in self.members:
+            vm.qos_min_iops = min_iops
+            vm.qos_max_iops = max_iops
+        return len(self.members)
+
+
+class _GroupTotals(object):
+    """Accumulates member stat samples into service group stats"""
+
+    __slots__ = ('sums', 'weighted', 'weights', 'samples')
+
+    def __init__(self):
+        self.sums = dict((name, 0.0) for name in GROUP_ADDITIVE_STATS)
+        self.weighted = dict((name, 0.0) for name in GROUP_WEIGHTED_STATS)
+        self.weights = dict((name, 0.0) for name in GROUP_WEIGHTED_STATS)
+        self.samples = 0
+
+    def add(self, stat):
+        self.samples += 1
+        for name in GROUP_ADDITIVE_STATS:
+            value = stat.get(name)
+            if value is not None:
+                self.sums[name] += value
+
+        weight = stat.get('operationsTotalIops') or 0.0
+        for name in GROUP_WEIGHTED_STATS:
+            value = stat.get(name)
+            if value is not None and weight > 0:
+                self.weighted[name] += value * weight
+                self.weights[name] += weight
+
+    def result(self):
+        stats = dict(self.sums)
+        for name in GROUP_WEIGHTED_STATS:
+            stats[name] = self.weighted[name] / self.weights[name] if self.weights[name] else None
+        # Members without stats are left out of the sums, so this can be lower than the member count
+        stats['samples'] = self.samples
+        return stats
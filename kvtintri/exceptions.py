@@ -14,4 +14,20 @@ class TintriError(Exception):
         super(TintriError, self).__init__(message, code)
 
         self.message = message
-        self.code = code
\ No newline at end of file
+        self.code = code
+
+class LoginError(Exception):
+    """Raise when a VMstore login fails"""
+    def __init__(self, message, device):
+        super(LoginError, self).__init__(message, device)
+
+        self.message = message
+        self.device = device
+
+class CircuitOpenError(Exception):
+    """Raise when requests to a VMstore are suspended after repeated failures"""
+    def __init__(self, message, device):
+        super(CircuitOpenError, self).__init__(message, device)
+
+        self.message = message
+        self.device = device
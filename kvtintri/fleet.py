@@ -0,0 +1,282 @@
+"""
+
+    Runs VMStore calls against many Tintri VMstores in parallel.
+
+    Sample usage:
+        import kvtintri
+
+        with kvtintri.VMStoreFleet.login(["vmstore01", "vmstore02", "vmstore03"], "admin", "secret!") as fleet:
+            for result in fleet.call('get_appliance'):
+                if result.error:
+                    print(result.device, "failed:", result.error)
+
+            for device, vm in fleet.iter_vms(isPowered="True"):
+                print(device, vm.name)
+
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from kvtintri.classes import VMStore, DEFAULT_PAGE_SIZE
+
+DEFAULT_FLEET_TIMEOUT = 300
+
+FleetResult = collections.namedtuple('FleetResult', ['device', 'result', 'error'])
+
+_DONE = object()
+
+
+def _logout_late(future):
+    """Logs out of a session whose login finished after the fleet stopped waiting for it"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        future.result().logout()
+    except Exception:
+        pass
+
+
+class VMStoreFleet(object):
+    """
+
+        A group of VMStore sessions that are queried in parallel. Every result is tagged with the device it came from
+        and each appliance gets the same time budget, so one slow VMstore only drops its own results instead of
+        stalling the whole report.
+
+        A fleet timeout stops waiting for an appliance; it doesn't stop the call, which runs on until the session's
+        own request timeout (and retries) end it. Until then the appliance is reported as busy by later call()s
+        rather than queueing more work behind it, so the pool always has a thread for every other appliance.
+        Streaming methods such as iter_vms() run their producers on their own threads and never compete with call()
+        for the pool.
+
+        This class should be instantiated via the login @classmethod.
+
+    """
+
+    def __init__(self, sessions, timeout=DEFAULT_FLEET_TIMEOUT, max_workers=None, errors=None):
+        """
+        VMStoreFleet class initializer.
+
+        :param sessions: An iterable of logged in VMStore instances
+        :param timeout: Seconds to wait for each appliance before giving up on it
+        :param max_workers: Size of the thread pool. Defaults to one thread per appliance.
+        :param errors: A dictionary of device to exception for appliances that failed to log in
+        """
+        self.sessions = collections.OrderedDict((session.device, session) for session in sessions)
+        self.timeout = timeout
+        self.errors = errors or {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or max(len(self.sessions), 1))
+        # device -> the future of a call() that timed out and may still be running
+        self._busy = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.logout()
+        return False
+
+    def __len__(self):
+        return len(self.sessions)
+
+    @classmethod
+    def login(cls, devices, user, password, ssl_verify=False, timeout=DEFAULT_FLEET_TIMEOUT, max_workers=None,
+              request_timeout=None, **kwargs):
+        """
+        Logs into every VMstore concurrently. Appliances that fail to log in are left out of the fleet and recorded
+        in the errors attribute.
+
+        :param devices: A list of FQDNs or IP addresses of Tintri VMstore appliances.
+        :param user: A string containing the username of an administrator on the VMstore appliances.
+        :param password: A string containing the password for the user supplied.
+        :param ssl_verify: A boolean that enables or disables SSL certificate validation. By default it is disabled.
+        :param timeout: Seconds to wait for each appliance before giving up on it
+        :param max_workers: Size of the thread pool. Defaults to one thread per appliance.
+        :param request_timeout: Seconds to wait for each individual request, passed to VMStore.login as its timeout.
+                                The VMStore default if None.
+        :param kwargs: Passed through to VMStore.login (pool_size, retries, retry_policy...)
+        :return: An instance of VMStoreFleet
+        """
+        devices = list(devices)
+        if request_timeout is not None:
+            kwargs['timeout'] = request_timeout
+        sessions = []
+        errors = {}
+
+        executor = ThreadPoolExecutor(max_workers=max_workers or max(len(devices), 1))
+        try:
+            futures = dict((executor.submit(VMStore.login, device, user, password, ssl_verify, **kwargs), device)
+                           for device in devices)
+            done, not_done = wait(futures, timeout=timeout)
+
+            for future in futures:
+                device = futures[future]
+                if future in not_done:
+                    errors[device] = TimeoutError('Login to {} timed out'.format(device))
+                    # Nobody will use a session that logs in after we gave up on it, so don't leave it open
+                    future.add_done_callback(_logout_late)
+                elif future.exception() is not None:
+                    errors[device] = future.exception()
+                else:
+                    sessions.append(future.result())
+        finally:
+            executor.shutdown(wait=False)
+
+        sessions.sort(key=lambda session: devices.index(session.device))
+        return cls(sessions, timeout=timeout, max_workers=max_workers, errors=errors)
+
+    def logout(self):
+        """Logs out of every appliance in parallel and releases the thread pool"""
+        try:
+            self.call('logout')
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def call(self, method, *args, **kwargs):
+        """
+        Runs a VMStore method on every appliance in parallel.
+
+        Sample usage:
+            for result in fleet.call('get_datastores'):
+                print(result.device, result.result)
+
+        :param method: The name of the VMStore method to run
+        :param args: Positional arguments for the method
+        :param kwargs: Keyword arguments for the method
+        :return: A list of FleetResult tuples in the same order as the fleet's devices. If the call failed or timed
+                 out, result is None and error holds the exception. Appliances still running a call that timed out
+                 earlier aren't called again and get a TimeoutError.
+        """
+        futures = collections.OrderedDict()
+        for device, session in self.sessions.items():
+            busy = self._busy.get(device)
+            if busy is not None and not busy.done():
+                futures[device] = None
+                continue
+            self._busy.pop(device, None)
+            futures[device] = self._executor.submit(getattr(session, method), *args, **kwargs)
+
+        done, not_done = wait([f for f in futures.values() if f is not None], timeout=self.timeout)
+
+        results = []
+        for device, future in futures.items():
+            if future is None:
+                results.append(FleetResult(device, None, TimeoutError(
+                    '{} is still running a call that timed out, {} not sent'.format(device, method))))
+            elif future in not_done:
+                # Only a call that hasn't started can be cancelled; a running one keeps its thread until it returns
+                if not future.cancel():
+                    self._busy[device] = future
+                results.append(FleetResult(device, None, TimeoutError('{} timed out on {}'.format(method, device))))
+            elif future.exception() is not None:
+                results.append(FleetResult(device, None, future.exception()))
+            else:
+                results.append(FleetResult(device, future.result(), None))
+        return results
+
+    def _merge(self, method, *args, **kwargs):
+        """
+        Runs a generator method on every appliance in parallel and merges the items into one stream of
+        (device, item) tuples in the order they arrive. Appliances that fail or run past the timeout are recorded
+        in self.errors and skipped.
+        """
+        items = queue.Queue(maxsize=10000)
+        stop = threading.Event()
+
+        def put(entry):
+            # Gives up once the consumer has stopped so abandoned producers don't block forever on a full queue
+            while not stop.is_set():
+                try:
+                    items.put(entry, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce(device, session):
+            try:
+                for item in getattr(session, method)(*args, **kwargs):
+                    if not put((device, item)):
+                        return
+                put((device, _DONE))
+            except Exception as e:
+                put((device, e))
+
+        # Producers get their own daemon threads: a walk can outlive the timeout, and shouldn't hold a pool thread
+        for device, session in self.sessions.items():
+            self.errors.pop(device, None)
+            thread = threading.Thread(target=produce, args=(device, session), name='kvtintri-fleet-' + device)
+            thread.daemon = True
+            thread.start()
+
+        pending = set(self.sessions)
+        deadline = time.time() + self.timeout
+        try:
+            while pending:
+                remaining = deadline - time.time()
+                try:
+                    if remaining <= 0:
+                        raise queue.Empty
+                    device, item = items.get(timeout=remaining)
+                except queue.Empty:
+                    for device in pending:
+                        self.errors[device] = TimeoutError('{} timed out on {}'.format(method, device))
+                    break
+
+                if item is _DONE:
+                    pending.discard(device)
+                elif isinstance(item, Exception):
+                    self.errors[device] = item
+                    pending.discard(device)
+                else:
+                    yield device, item
+        finally:
+            stop.set()
+
+    def iter_vms(self, page_size=DEFAULT_PAGE_SIZE, **kwargs):
+        """
+        Streams the virtual machines of every appliance as their pages arrive.
+
+        :param page_size: Number of virtual machines requested per page
+        :param kwargs: The same filters supported by VMStore.get_vms()
+        :return: A generator of (device, VirtualMachine) tuples
+        """
+        return self._merge('iter_vms', page_size=page_size, **kwargs)
+
+    def find(self, query, page_size=DEFAULT_PAGE_SIZE, **kwargs):
+        """
+        Streams the items matching a kvtintri.query.Query from every appliance as their pages arrive.
+
+        :param query: A kvtintri.query.Query, run unchanged on every appliance
+        :param page_size: Number of items requested per page
+        :param kwargs: Passed through to VMStore.find (prefetch, stream)
+        :return: A generator of (device, dictionary) tuples
+        """
+        return self._merge('find', query, page_size=page_size, **kwargs)
+
+    def get_vms(self, **kwargs):
+        """Returns a list of (device, VirtualMachine) tuples for every virtual machine across the fleet"""
+        return list(self.iter_vms(**kwargs))
+
+    def get_datastores(self):
+        """Returns a list of (device, datastore) tuples for every datastore across the fleet"""
+        datastores = []
+        for result in self.call('get_datastores'):
+            if result.error is not None:
+                self.errors[result.device] = result.error
+                continue
+            items = result.result
+            if type(items) == dict:
+                items = items.get('items', [items])
+            for datastore in items:
+                datastores.append((result.device, datastore))
+        return datastores
+
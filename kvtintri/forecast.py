@@ -0,0 +1,287 @@
+"""
+
+    Capacity and performance reserve forecasting for datastores.
+
+    Requires numpy (pip install kvtintri[table]).
+
+    A straight line is fitted by least squares to each datastore's space used and performance reserve used history
+    and projected forward to the datastore's capacity, giving the days left until it's full. Every datastore of a
+    fleet is fitted together on a NaN padded matrix, so a capacity report is one pass over the history rather than a
+    spreadsheet per appliance.
+
+    Sample usage:
+        import kvtintri
+        from kvtintri.forecast import CapacityForecaster, fetch_fleet_history
+
+        with kvtintri.VMStoreFleet.login(["vmstore01", "vmstore02"], "admin", "secret!") as fleet:
+            history = fetch_fleet_history(fleet, since="2016-03-01T00:00:00.000-08:00")
+
+        for forecast in CapacityForecaster(threshold=90).forecast(history):
+            print(forecast.device, forecast.uuid, forecast.metric, forecast.days_to_full)
+
+"""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import kvtintri.bulk
+from kvtintri.perf import parse_time, sorted_stats
+
+SPACE_METRIC = 'spaceUsedGiB'
+RESERVE_METRIC = 'performanceReserveUsed'
+
+# Metric forecast -> the stat holding its capacity, or a fixed capacity for percentages
+CAPACITIES = collections.OrderedDict([(SPACE_METRIC, 'spaceTotalGiB'), (RESERVE_METRIC, 100.0)])
+
+HISTORY_METRICS = (SPACE_METRIC, RESERVE_METRIC, 'spaceTotalGiB')
+
+SECONDS_PER_DAY = 86400.0
+
+# One projection per datastore and metric. current is the newest sample, slope_per_day the fitted growth and r2 how
+# well the line fits (1 is a perfect fit). days_to_full and full_at (seconds since the epoch) are None when the
+# metric isn't growing or the datastore has too little history.
+Forecast = collections.namedtuple('Forecast', ['device', 'uuid', 'metric', 'current', 'capacity', 'slope_per_day',
+                                               'days_to_full', 'full_at', 'r2', 'samples'])
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("Capacity forecasts require numpy. Install it with 'pip install numpy'")
+
+
+def history_from_stats(response, metrics=HISTORY_METRICS):
+    """
+    Converts a statsHistoric response into columns of samples.
+
+    :return: A dictionary with a 'time' list (seconds since the epoch) and a list per metric, None where a sample
+             lacks the metric
+    """
+    columns = dict((metric, []) for metric in metrics)
+    columns['time'] = []
+    for sample in sorted_stats(response):
+        stamp = parse_time(sample.get('timeEnd'))
+        if stamp is None:
+            continue
+        columns['time'].append(stamp)
+        for metric in metrics:
+            columns[metric].append(sample.get(metric))
+    return columns
+
+
+def history_from_archive(reader, device, start=None, end=None):
+    """
+    Collects per-datastore history from an ArchiveReader. Only metrics the archive was written with are returned, so
+    write spaceUsedGiB, spaceTotalGiB and performanceReserveUsed to archives meant for forecasting.
+
+    :param device: The appliance the archive was recorded from, used in the history keys
+    :return: A dictionary of (device, datastore UUID) to columns as returned by history_from_stats()
+    """
+    metrics = [metric for metric in HISTORY_METRICS if metric in reader.metrics]
+    history = {}
+    for kind, uuid in reader.entities('datastore'):
+        times, values = reader.read(kind, uuid, start, end, metrics=metrics)
+        columns = dict((metric, list(values[metric])) for metric in metrics)
+        columns['time'] = list(times)
+        history[(device, uuid)] = columns
+    return history
+
+
+def fetch_history(session, max_workers=kvtintri.bulk.DEFAULT_WORKERS, **kwargs):
+    """
+    Fetches the statsHistoric of every datastore on a VMstore, max_workers datastores at a time.
+
+    :param kwargs: Optional 'since' and 'until' timestamps passed to each statsHistoric call
+    :return: A dictionary of (device, datastore UUID) to columns as returned by history_from_stats()
+    """
+    datastores = session.get_datastores()
+    if type(datastores) == dict:
+        datastores = datastores.get('items', [datastores])
+    uuids = [datastore['uuid']['uuid'] for datastore in datastores]
+    if not uuids:
+        return {}
+
+    def fetch(datastore_uuid):
+        response = session.get_datastore_stats_historic(datastore_uuid, **kwargs)
+        return (session.device, datastore_uuid), history_from_stats(response)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(uuids))) as executor:
+        return dict(executor.map(fetch, uuids))
+
+
+def fetch_fleet_history(fleet, max_workers=kvtintri.bulk.DEFAULT_WORKERS, **kwargs):
+    """
+    Fetches the datastore history of every appliance in a VMStoreFleet in parallel. Appliances that fail are recorded
+    in fleet.errors and left out.
+
+    :param max_workers: Maximum number of statsHistoric requests in flight per appliance
+    :param kwargs: Optional 'since' and 'until' timestamps passed to each statsHistoric call
+    :return: A dictionary of (device, datastore UUID) to columns as returned by history_from_stats()
+    """
+    history = {}
+    if not fleet.sessions:
+        return history
+
+    # Every appliance shares one deadline, and appliances past it are left running rather than waited for
+    executor = ThreadPoolExecutor(max_workers=len(fleet.sessions))
+    try:
+        futures = [(device, executor.submit(fetch_history, session, max_workers=max_workers, **kwargs))
+                   for device, session in fleet.sessions.items()]
+        done, not_done = wait([future for device, future in futures], timeout=fleet.timeout)
+        for device, future in futures:
+            fleet.errors.pop(device, None)
+            if future in not_done:
+                future.cancel()
+                fleet.errors[device] = TimeoutError('Fetching datastore history from {} timed out'.format(device))
+            elif future.exception() is not None:
+                fleet.errors[device] = future.exception()
+            else:
+                history.update(future.result())
+    finally:
+        executor.shutdown(wait=False)
+    return history
+
+
+def fit_lines(times, values):
+    """
+    Fits y = intercept + slope * t by least squares to every row of two NaN padded matrices at once. Cells where
+    either matrix is NaN are ignored.
+
+    :return: A tuple of numpy arrays (slope, intercept, r2, samples), one entry per row. slope, intercept and r2 are
+             NaN for rows with fewer than two distinct times.
+    """
+    _require_numpy()
+
+    mask = ~(numpy.isnan(times) | numpy.isnan(values))
+    samples = mask.sum(axis=1)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        count = samples.astype(numpy.float64)
+        t_mean = numpy.where(mask, times, 0.0).sum(axis=1) / count
+        y_mean = numpy.where(mask, values, 0.0).sum(axis=1) / count
+
+        dt = numpy.where(mask, times - t_mean[:, None], 0.0)
+        dy = numpy.where(mask, values - y_mean[:, None], 0.0)
+        sxx = (dt * dt).sum(axis=1)
+        sxy = (dt * dy).sum(axis=1)
+        syy = (dy * dy).sum(axis=1)
+
+        sxx[sxx == 0] = numpy.nan
+        slope = sxy / sxx
+        intercept = y_mean - slope * t_mean
+        # A flat line through flat data is a perfect fit
+        r2 = numpy.where(syy == 0, 1.0, sxy * sxy / (sxx * numpy.where(syy == 0, 1.0, syy)))
+        r2[numpy.isnan(slope)] = numpy.nan
+
+    return slope, intercept, r2, samples
+
+
+class CapacityForecaster(object):
+    """
+
+        Projects when datastores will run out of space and performance reserve. Each metric is fitted for every
+        datastore with a single fit_lines() call; times are measured in days back from each datastore's newest
+        sample, so the fitted intercept is the trend's current value.
+
+    """
+
+    def __init__(self, metrics=tuple(CAPACITIES), threshold=100, min_samples=10, window=None):
+        """
+        CapacityForecaster class initializer.
+
+        :param metrics: Metrics to forecast, keys of CAPACITIES
+        :param threshold: Percentage of capacity counted as full, e.g. 90 to forecast reaching 90%
+        :param min_samples: Datastores with fewer samples than this get no projection
+        :param window: Only fit the newest window seconds of each datastore's history. All of it if None.
+        """
+        self.metrics = tuple(metrics)
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.window = window
+
+    def _matrices(self, rows, metric):
+        width = max(max(len(columns['time']) for columns in rows), 1)
+        times = numpy.full((len(rows), width), numpy.nan)
+        values = numpy.full((len(rows), width), numpy.nan)
+        latest = numpy.full(len(rows), numpy.nan)
+
+        for i, columns in enumerate(rows):
+            count = len(columns['time'])
+            if not count:
+                continue
+            row_times = numpy.asarray(columns['time'], dtype=numpy.float64)
+            row_values = numpy.array([numpy.nan if v is None else v for v in columns[metric]], dtype=numpy.float64)
+            latest[i] = row_times.max()
+            times[i, :count] = (row_times - latest[i]) / SECONDS_PER_DAY
+            values[i, :count] = row_values
+
+        if self.window is not None:
+            times[times < -self.window / SECONDS_PER_DAY] = numpy.nan
+        return times, values, latest
+
+    @staticmethod
+    def _capacity(columns, metric):
+        capacity = CAPACITIES[metric]
+        if not isinstance(capacity, str):
+            return capacity
+        for value in reversed(columns.get(capacity) or []):
+            if value is not None and value == value:
+                return value
+        return None
+
+    def forecast(self, history):
+        """
+        Builds a forecast per datastore and metric.
+
+        :param history: A dictionary of (device, datastore UUID) to columns as returned by fetch_history()
+        :return: A list of Forecast tuples, the soonest to fill first and those that aren't filling last
+        """
+        _require_numpy()
+
+        keys = sorted(history)
+        rows = [history[key] for key in keys]
+        forecasts = []
+
+        for metric in self.metrics:
+            usable = [i for i, columns in enumerate(rows) if metric in columns]
+            if not usable:
+                continue
+            times, values, latest = self._matrices([rows[i] for i in usable], metric)
+            slope, intercept, r2, samples = fit_lines(times, values)
+
+            for row, i in enumerate(usable):
+                device, uuid = keys[i]
+                observed = values[row][~numpy.isnan(values[row]) & ~numpy.isnan(times[row])]
+                current = float(observed[-1]) if len(observed) else None
+                capacity = self._capacity(rows[i], metric)
+
+                days = None
+                full_at = None
+                fitted = samples[row] >= max(self.min_samples, 2) and not numpy.isnan(slope[row])
+                if fitted and capacity is not None:
+                    remaining = capacity * self.threshold / 100.0 - intercept[row]
+                    if remaining <= 0:
+                        days = 0.0
+                    elif slope[row] > 0:
+                        days = float(remaining / slope[row])
+                    if days is not None:
+                        full_at = float(latest[row] + days * SECONDS_PER_DAY)
+
+                forecasts.append(Forecast(device, uuid, metric, current, capacity,
+                                          float(slope[row]) if fitted else None, days, full_at,
+                                          float(r2[row]) if fitted else None, int(samples[row])))
+
+        forecasts.sort(key=lambda f: (f.days_to_full is None, f.days_to_full, f.device, f.uuid, f.metric))
+        return forecasts
+
+    def forecast_session(self, session, **kwargs):
+        """Fetches a VMstore's datastore history and forecasts it. kwargs are passed to fetch_history()"""
+        return self.forecast(fetch_history(session, **kwargs))
+
+    def forecast_fleet(self, fleet, **kwargs):
+        """Fetches the datastore history of a fleet and forecasts it. kwargs are passed to fetch_fleet_history()"""
+        return self.forecast(fetch_fleet_history(fleet, **kwargs))
@@ -0,0 +1,215 @@
+"""
+
+    In-memory index of a VMstore's virtual machines for fast lookups by name, UUID and moref.
+
+    The index is built on an Inventory, so it's loaded with one walk of the vm listing and each refresh only touches
+    the entries of VMs that were added, removed or changed.
+
+    Sample usage:
+        import kvtintri
+
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!")
+        index = kvtintri.VMIndex(session)
+        index.refresh()
+
+        vm = index.lookup("web01")                      # exact name, O(1)
+        vm = index.by_moref("vm-1042", vcenter="dev-vc1")
+        for vm in index.startswith("web"):
+            print(vm.name)
+        for vm in index.glob("db-??-prod"):
+            print(vm.name)
+        for host, vms in index.group_by('host').items():
+            print(host, len(vms))
+
+"""
+
+import bisect
+import fnmatch
+import re
+
+from kvtintri.inventory import Inventory, VOLATILE_FIELDS
+from kvtintri.classes import DEFAULT_PAGE_SIZE
+
+GROUPS = ('vcenter', 'host')
+
+_GLOB_SPECIAL = re.compile(r'[*?\[]')
+
+
+class VMIndex(Inventory):
+    """
+
+        An Inventory with secondary indexes on name, moref, vCenter and host.
+
+        Names and morefs are only unique within a vCenter, so by_name() and by_moref() return lists and lookup()
+        raises ValueError when a name is ambiguous. VMs whose listing has no host field are grouped under None.
+
+        Prefix and glob searches use a sorted list of names that is rebuilt on the first search after a refresh that
+        added, removed or renamed VMs.
+
+    """
+
+    def __init__(self, session, page_size=DEFAULT_PAGE_SIZE, ignore=VOLATILE_FIELDS, **kwargs):
+        """
+        VMIndex class initializer.
+
+        :param session: An instance of the VMStore object
+        :param page_size: Number of VMs requested per page
+        :param ignore: Top level VM fields that don't count as a change
+        :param kwargs: Filters passed to the vm listing (see VMStore.get_vms)
+        """
+        super(VMIndex, self).__init__(session, page_size=page_size, ignore=ignore, **kwargs)
+        self._names = {}
+        self._morefs = {}
+        self._groups = dict((attribute, {}) for attribute in GROUPS)
+        self._keys = {}
+        self._sorted_names = None
+
+    def apply(self, items):
+        """
+        Updates the snapshot and the indexes from an iterable of VM dictionaries that make up the complete current
+        inventory.
+
+        :param items: An iterable of VM dictionaries
+        :return: An InventoryDiff
+        """
+        diff = super(VMIndex, self).apply(items)
+
+        for vm in diff.removed:
+            self._remove(vm.uuid)
+        for vm in diff.changed:
+            self._remove(vm.uuid)
+            self._add(vm)
+        for vm in diff.added:
+            self._add(vm)
+
+        return diff
+
+    def _add(self, vm):
+        keys = (vm.name, vm.moref, tuple(getattr(vm, attribute) for attribute in GROUPS))
+        self._keys[vm.uuid] = keys
+
+        names = self._names.get(vm.name)
+        if names is None:
+            self._names[vm.name] = names = set()
+            self._sorted_names = None
+        names.add(vm.uuid)
+
+        if vm.moref is not None:
+            self._morefs.setdefault(vm.moref, set()).add(vm.uuid)
+
+        for attribute, value in zip(GROUPS, keys[2]):
+            self._groups[attribute].setdefault(value, set()).add(vm.uuid)
+
+    def _remove(self, vm_uuid):
+        name, moref, groups = self._keys.pop(vm_uuid)
+
+        _discard(self._names, name, vm_uuid)
+        if name not in self._names:
+            self._sorted_names = None
+        if moref is not None:
+            _discard(self._morefs, moref, vm_uuid)
+        for attribute, value in zip(GROUPS, groups):
+            _discard(self._groups[attribute], value, vm_uuid)
+
+    def _vms(self, uuids):
+        return [self.vms[vm_uuid] for vm_uuid in uuids]
+
+    def by_uuid(self, vm_uuid):
+        """Returns the VirtualMachine with this UUID, or None"""
+        return self.vms.get(vm_uuid)
+
+    def by_name(self, name, vcenter=None):
+        """
+        Returns every VirtualMachine with exactly this name.
+
+        :param vcenter: Only return VMs in this vCenter
+        """
+        vms = self._vms(self._names.get(name, ()))
+        if vcenter is not None:
+            vms = [vm for vm in vms if vm.vcenter == vcenter]
+        return vms
+
+    def by_moref(self, moref, vcenter=None):
+        """
+        Returns the VirtualMachines with this managed object reference, e.g. 'vm-1042'. Morefs are only unique within
+        a vCenter, so pass vcenter to narrow the result to one VM.
+        """
+        vms = self._vms(self._morefs.get(moref, ()))
+        if vcenter is not None:
+            vms = [vm for vm in vms if vm.vcenter == vcenter]
+        return vms
+
+    def lookup(self, name, vcenter=None):
+        """
+        Returns the one VirtualMachine with exactly this name, or None if there isn't one.
+
+        :param vcenter: Only consider VMs in this vCenter
+        :raises ValueError: If more than one VM has the name
+        """
+        vms = self.by_name(name, vcenter)
+        if len(vms) > 1:
+            raise ValueError('{} virtual machines are named {}, pass vcenter to choose one'.format(len(vms), name))
+        return vms[0] if vms else None
+
+    def names(self):
+        """Returns the distinct VM names in sorted order"""
+        if self._sorted_names is None:
+            self._sorted_names = sorted(self._names)
+        return self._sorted_names
+
+    def _names_with_prefix(self, prefix):
+        names = self.names()
+        start = bisect.bisect_left(names, prefix)
+        for i in range(start, len(names)):
+            if not names[i].startswith(prefix):
+                break
+            yield names[i]
+
+    def startswith(self, prefix):
+        """Returns every VirtualMachine whose name starts with prefix, in name order"""
+        return [vm for name in self._names_with_prefix(prefix) for vm in self._vms(self._names[name])]
+
+    def glob(self, pattern):
+        """
+        Returns every VirtualMachine whose name matches a shell style pattern such as 'web-*' or 'db-??', in name
+        order. The literal part before the first wildcard narrows the search with the sorted name list.
+        """
+        special = _GLOB_SPECIAL.search(pattern)
+        if special is None:
+            return self.by_name(pattern)
+        return [vm for name in self._names_with_prefix(pattern[:special.start()])
+                if fnmatch.fnmatchcase(name, pattern) for vm in self._vms(self._names[name])]
+
+    def search(self, pattern):
+        """
+        Returns every VirtualMachine whose name contains a match for a regular expression, in name order.
+
+        :param pattern: A string or compiled regular expression
+        """
+        if not hasattr(pattern, 'search'):
+            pattern = re.compile(pattern)
+        return [vm for name in self.names() if pattern.search(name) for vm in self._vms(self._names[name])]
+
+    def members(self, attribute, value):
+        """
+        Returns the VirtualMachines in a group, e.g. members('vcenter', 'dev-vc1') or members('host', 'esx01').
+
+        :param attribute: One of GROUPS
+        """
+        return self._vms(self._groups[attribute].get(value, ()))
+
+    def group_by(self, attribute):
+        """
+        Returns a dictionary of group value to the list of VirtualMachines in it.
+
+        :param attribute: One of GROUPS
+        """
+        return dict((value, self._vms(uuids)) for value, uuids in self._groups[attribute].items())
+
+
+def _discard(index, key, vm_uuid):
+    uuids = index.get(key)
+    if uuids is not None:
+        uuids.discard(vm_uuid)
+        if not uuids:
+            del index[key]
@@ -0,0 +1,133 @@
+"""
+
+    Incrementally refreshed virtual machine inventory.
+
+    Sample usage:
+        import kvtintri
+
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!")
+        inventory = kvtintri.Inventory(session)
+
+        inventory.refresh()                 # first refresh reports every VM as added
+
+        while True:
+            diff = inventory.refresh()
+            for vm in diff.added + diff.changed:
+                print("updated", vm.name)
+            for vm in diff.removed:
+                print("gone", vm.name)
+            time.sleep(60)
+
+"""
+
+import collections
+import hashlib
+import json
+import time
+
+from kvtintri.classes import VirtualMachine, DEFAULT_PAGE_SIZE
+
+# Fields that change on every poll without the VM itself changing. They're left out of the fingerprint so a VM is
+# only reported as changed when its configuration does.
+VOLATILE_FIELDS = ('stat', 'lastUpdatedTime')
+
+InventoryDiff = collections.namedtuple('InventoryDiff', ['added', 'removed', 'changed'])
+
+
+def fingerprint(item, ignore=VOLATILE_FIELDS):
+    """
+    Returns a digest of a VM dictionary that changes only when one of its non-volatile fields does.
+
+    :param item: A VM dictionary as returned by the API
+    :param ignore: Top level keys left out of the digest
+    :return: A string digest
+    """
+    if ignore:
+        item = dict((k, v) for k, v in item.items() if k not in ignore)
+    return hashlib.sha1(json.dumps(item, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class Inventory(object):
+    """
+
+        Keeps the last snapshot of a VMstore's virtual machines indexed by UUID and reports what changed on each
+        refresh, so consumers can process deltas instead of the whole list.
+
+        The v310 vm listing has no modified-since filter, so every refresh still walks the listing, but only new or
+        modified VMs are rebuilt as VirtualMachine objects. Changes are detected by hashing each VM's payload with
+        the volatile stat fields left out.
+
+    """
+
+    def __init__(self, session, page_size=DEFAULT_PAGE_SIZE, ignore=VOLATILE_FIELDS, **kwargs):
+        """
+        Inventory class initializer.
+
+        :param session: An instance of the VMStore object
+        :param page_size: Number of VMs requested per page
+        :param ignore: Top level VM fields that don't count as a change
+        :param kwargs: Filters passed to the vm listing (see VMStore.get_vms)
+        """
+        self.session = session
+        self.page_size = page_size
+        self.ignore = ignore
+        self.filters = kwargs
+        self.vms = {}
+        self.last_refresh = None
+        self._fingerprints = {}
+
+    def __len__(self):
+        return len(self.vms)
+
+    def __iter__(self):
+        return iter(self.vms.values())
+
+    def __contains__(self, vm_uuid):
+        return vm_uuid in self.vms
+
+    def get(self, vm_uuid, default=None):
+        """Returns the VirtualMachine with the given UUID from the last snapshot"""
+        return self.vms.get(vm_uuid, default)
+
+    def refresh(self):
+        """
+        Fetches the current VM listing and updates the snapshot.
+
+        :return: An InventoryDiff of lists of VirtualMachine instances that were added, removed or changed since the
+                 previous refresh.
+        """
+        return self.apply(self.session._iter_pages('vm', page_size=self.page_size, prefetch=True, **self.filters))
+
+    def apply(self, items):
+        """
+        Updates the snapshot from an iterable of VM dictionaries that make up the complete current inventory.
+
+        :param items: An iterable of VM dictionaries
+        :return: An InventoryDiff
+        """
+        added = []
+        changed = []
+        seen = {}
+
+        for item in items:
+            vm_uuid = item['uuid']['uuid']
+            digest = fingerprint(item, self.ignore)
+            seen[vm_uuid] = digest
+
+            previous = self._fingerprints.get(vm_uuid)
+            if previous == digest:
+                continue
+
+            vm = VirtualMachine.from_dict(item)
+            self.vms[vm_uuid] = vm
+            if previous is None:
+                added.append(vm)
+            else:
+                changed.append(vm)
+
+        removed = [self.vms.pop(vm_uuid) for vm_uuid in self._fingerprints if vm_uuid not in seen]
+
+        self._fingerprints = seen
+        self.last_refresh = time.time()
+
+        return InventoryDiff(added, removed, changed)
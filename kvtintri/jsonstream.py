@@ -0,0 +1,136 @@
+"""
+
+    Incremental decoding of large VMstore JSON responses.
+
+    The VMstore returns listings as a Page object whose 'items' array holds every VM or disk. ItemStream decodes that
+    array one element at a time from the response body as it's downloaded, so peak memory is one chunk of the body
+    plus one item regardless of how many items the page holds. Only the standard library json decoder is used.
+
+"""
+
+import codecs
+import json
+
+DEFAULT_CHUNK_SIZE = 65536
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class ItemStream(object):
+    """
+
+        Iterates over the elements of one array in a JSON document read from a sequence of byte chunks.
+
+        If the document is an object, the array stored under key is streamed and every other top level member is
+        decoded into the fields dictionary (complete once iteration finishes). If the document is itself an array
+        its elements are streamed.
+
+        Sample usage:
+            stream = ItemStream(response.iter_content(65536))
+            for vm in stream:
+                print(vm['vmware']['name'])
+            print(stream.fields['filteredTotal'])
+
+    """
+
+    def __init__(self, chunks, key='items', encoding='utf-8'):
+        """
+        ItemStream class initializer.
+
+        :param chunks: An iterable of bytes making up the JSON document
+        :param key: The top level member whose array is streamed
+        :param encoding: Encoding of the document
+        """
+        self.key = key
+        self.fields = {}
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder(encoding)()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Appends the next chunk to the buffer, discarding what's been consumed. Returns False at end of input."""
+        if self._eof:
+            return False
+
+        try:
+            text = self._text.decode(next(self._chunks))
+        except StopIteration:
+            self._eof = True
+            text = self._text.decode(b'', True)
+
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Skips whitespace and returns the next character without consuming it"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON document')
+
+    def _expect(self, allowed):
+        char = self._peek()
+        if char not in allowed:
+            raise ValueError('Expected one of {!r} at offset {} but found {!r}'.format(allowed, self._pos, char))
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decodes the next complete JSON value, reading more input until it's available"""
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+
+            # A value ending exactly at the end of the buffer may be a number cut off mid-way
+            if end < len(self._buf) or self._eof:
+                self._pos = end
+                return value
+            self._fill()
+
+    def _array(self):
+        if self._peek() == ']':
+            self._pos += 1
+            return
+
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def __iter__(self):
+        first = self._expect('[{')
+
+        if first == '[':
+            for item in self._array():
+                yield item
+            return
+
+        if self._peek() == '}':
+            self._pos += 1
+            return
+
+        while True:
+            name = self._value()
+            self._expect(':')
+
+            if name == self.key and self._peek() == '[':
+                self._pos += 1
+                for item in self._array():
+                    yield item
+            else:
+                self.fields[name] = self._value()
+
+            if self._expect(',}') == '}':
+                return
@@ -0,0 +1,298 @@
+"""
+
+    Request instrumentation for VMStore.
+
+    Sample usage:
+        import kvtintri
+
+        metrics = kvtintri.RequestMetrics()
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!", metrics=metrics)
+
+        session.get_vms()
+
+        stats = metrics.snapshot()[('10.25.36.10', 'GET', 'vm')]
+        print(stats['calls'], stats['request_seconds']['sum'], stats['parse_seconds']['sum'])
+
+        # Expose everything to a Prometheus scraper
+        kvtintri.metrics.start_http_server(metrics, port=9410)
+
+        # Or react to individual requests
+        metrics.add_hook(lambda event: event.request_seconds > 5 and log.warning("slow call %s", event.uri))
+
+"""
+
+import collections
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Upper bounds in seconds, in the style of the Prometheus client defaults with a longer tail for large listings
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+RequestEvent = collections.namedtuple('RequestEvent', ['device', 'method', 'endpoint', 'uri', 'status',
+                                                       'request_seconds', 'parse_seconds', 'bytes_sent',
+                                                       'bytes_received', 'retries', 'error'])
+
+_WORD = re.compile(r'^[A-Za-z]+$')
+
+
+def endpoint_of(uri):
+    """
+    Reduces a request URI to its endpoint so calls for different objects are counted together. The query string is
+    dropped and every path segment that isn't a plain word, such as a UUID, becomes '{id}'.
+
+    e.g. 'vm/64f2e4bd-...-VIM-00001/statsRealtime?since=...' -> 'vm/{id}/statsRealtime'
+    """
+    path = uri.split('?', 1)[0].strip('/')
+    return '/'.join(segment if _WORD.match(segment) else '{id}' for segment in path.split('/'))
+
+
+def error_kind(error):
+    """Returns a short label for an error: 'http_<status>' for HTTP errors, otherwise the exception class name"""
+    response = getattr(error, 'response', None)
+    if response is not None and getattr(response, 'status_code', None):
+        return 'http_{}'.format(response.status_code)
+    return type(error).__name__
+
+
+class Histogram(object):
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def snapshot(self):
+        return {'buckets': list(zip(self.buckets, self.counts)), 'sum': self.sum, 'count': self.count}
+
+
+class EndpointStats(object):
+    """Counters and latency histograms of one (device, method, endpoint)"""
+
+    __slots__ = ('calls', 'errors', 'bytes_sent', 'bytes_received', 'retries', 'cache_hits', 'request_seconds',
+                 'parse_seconds')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.calls = 0
+        self.errors = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.request_seconds = Histogram(buckets)
+        self.parse_seconds = Histogram(buckets)
+
+    def snapshot(self):
+        return {'calls': self.calls,
+                'errors': dict(self.errors),
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'retries': self.retries,
+                'cache_hits': self.cache_hits,
+                'request_seconds': self.request_seconds.snapshot(),
+                'parse_seconds': self.parse_seconds.snapshot()}
+
+
+class RequestMetrics(object):
+    """
+
+        Thread safe collector of per-endpoint request statistics. One instance can be shared by any number of
+        VMStore sessions; statistics are kept per device.
+
+        request_seconds covers sending the request and receiving the response headers and body. parse_seconds covers
+        JSON decoding and error checking, so the two together separate appliance and network time from client time.
+
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        RequestMetrics class initializer.
+
+        :param buckets: Upper bounds in seconds of the latency histogram buckets
+        """
+        self.buckets = tuple(buckets)
+        self.endpoints = {}
+        self.hooks = []
+        self.hook_errors = 0
+        self._lock = threading.Lock()
+
+    def add_hook(self, callback):
+        """
+        Registers a callable invoked with a RequestEvent after every request. Exceptions raised by hooks are counted
+        in hook_errors and otherwise ignored so monitoring can never break a request.
+        """
+        self.hooks.append(callback)
+
+    def remove_hook(self, callback):
+        self.hooks.remove(callback)
+
+    def _stats(self, key):
+        stats = self.endpoints.get(key)
+        if stats is None:
+            stats = self.endpoints.setdefault(key, EndpointStats(self.buckets))
+        return stats
+
+    def observe(self, device, method, uri, request_seconds, parse_seconds=None, response=None, bytes_sent=0,
+                bytes_received=None, error=None, retries=0):
+        """
+        Records one request.
+
+        :param device: The appliance the request was sent to
+        :param method: The HTTP method
+        :param uri: The request URI relative to the API root
+        :param request_seconds: Time spent on the request
+        :param parse_seconds: Time spent decoding the response, if it was decoded
+        :param response: The requests.Response, if one was received
+        :param bytes_sent: Size of the request body
+        :param bytes_received: Size of the response body. Taken from response when None.
+        :param error: The exception the request failed with, if any
+        :param retries: Number of times the request is retried after this attempt, e.g. 1 when a RetryPolicy sends
+                        it again. urllib3 connection level retries are taken from response and added.
+        """
+        status = None
+        retries = retries or 0
+        if response is not None:
+            status = response.status_code
+            if bytes_received is None:
+                bytes_received = len(response.content or b'')
+            history = getattr(getattr(getattr(response, 'raw', None), 'retries', None), 'history', None)
+            if history:
+                retries += len(history)
+
+        endpoint = endpoint_of(uri)
+        with self._lock:
+            stats = self._stats((device, method, endpoint))
+            stats.calls += 1
+            stats.bytes_sent += bytes_sent or 0
+            stats.bytes_received += bytes_received or 0
+            stats.retries += retries
+            stats.request_seconds.observe(request_seconds)
+            if parse_seconds is not None:
+                stats.parse_seconds.observe(parse_seconds)
+            if error is not None:
+                stats.errors[error_kind(error)] += 1
+
+        if self.hooks:
+            event = RequestEvent(device, method, endpoint, uri, status, request_seconds, parse_seconds,
+                                 bytes_sent or 0, bytes_received or 0, retries, error)
+            for hook in list(self.hooks):
+                try:
+                    hook(event)
+                except Exception:
+                    self.hook_errors += 1
+
+    def observe_cache_hit(self, device, method, uri):
+        """Records a request answered from the response cache without contacting the appliance"""
+        with self._lock:
+            self._stats((device, method, endpoint_of(uri))).cache_hits += 1
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+
+    def snapshot(self):
+        """
+        Returns a copy of every statistic.
+
+        :return: A dictionary of (device, method, endpoint) to a dictionary of statistics
+        """
+        with self._lock:
+            return dict((key, stats.snapshot()) for key, stats in self.endpoints.items())
+
+    def prometheus(self, prefix='kvtintri'):
+        """
+        Renders every statistic in the Prometheus text exposition format.
+
+        :param prefix: Prefix of every metric name
+        :return: A string
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def labels(key, **extra):
+            pairs = list(zip(('device', 'method', 'endpoint'), key)) + sorted(extra.items())
+            return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+        def counter(name, help_text, field):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} counter'.format(prefix, name))
+            for key in sorted(snapshot):
+                lines.append('{}_{}{} {}'.format(prefix, name, labels(key), snapshot[key][field]))
+
+        def histogram(name, help_text, field):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} histogram'.format(prefix, name))
+            for key in sorted(snapshot):
+                values = snapshot[key][field]
+                for bound, count in values['buckets']:
+                    lines.append('{}_{}_bucket{} {}'.format(prefix, name, labels(key, le=repr(float(bound))), count))
+                lines.append('{}_{}_bucket{} {}'.format(prefix, name, labels(key, le='+Inf'), values['count']))
+                lines.append('{}_{}_sum{} {!r}'.format(prefix, name, labels(key), values['sum']))
+                lines.append('{}_{}_count{} {}'.format(prefix, name, labels(key), values['count']))
+
+        counter('requests_total', 'Requests sent to the VMstore.', 'calls')
+        counter('request_bytes_sent_total', 'Bytes of request bodies sent.', 'bytes_sent')
+        counter('request_bytes_received_total', 'Bytes of response bodies received.', 'bytes_received')
+        counter('request_retries_total', 'Retries, RetryPolicy and connection level.', 'retries')
+        counter('cache_hits_total', 'Requests answered from the response cache.', 'cache_hits')
+
+        lines.append('# HELP {}_request_errors_total Failed requests by error.'.format(prefix))
+        lines.append('# TYPE {}_request_errors_total counter'.format(prefix))
+        for key in sorted(snapshot):
+            for kind, count in sorted(snapshot[key]['errors'].items()):
+                lines.append('{}_request_errors_total{} {}'.format(prefix, labels(key, error=kind), count))
+
+        histogram('request_duration_seconds', 'Time spent on the HTTP request.', 'request_seconds')
+        histogram('parse_duration_seconds', 'Time spent decoding responses.', 'parse_seconds')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def start_http_server(metrics, port, address=''):
+    """
+    Serves metrics.prometheus() on every path of a background HTTP server.
+
+    :param metrics: A RequestMetrics instance
+    :param port: The port to listen on
+    :param address: The address to bind, all interfaces by default
+    :return: The HTTPServer. Call shutdown() on it to stop serving.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='kvtintri-metrics')
+    thread.daemon = True
+    thread.start()
+    return server
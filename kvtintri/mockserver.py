@@ -0,0 +1,462 @@
+"""
+
+    A local stand-in for a VMstore's v310 REST API, for benchmarks and for trying the library without an appliance.
+
+    The server speaks plain HTTP, so sessions connect to it with scheme='http'. VMs are generated from their index on
+    demand rather than stored, so an inventory of 100k VMs costs almost no memory; only QoS changes are kept.
+
+    Endpoints:
+        POST session/login, GET session/logout
+        GET  vm (offset, limit, name, vmUuid, vcenterName, host, isPowered filters), vm/<uuid>, vm/<uuid>/statsRealtime,
+             vm/<uuid>/statsHistoric
+        PUT  vm/qosConfig
+        POST vm/<uuid>/snapshot (body optional)
+        GET  virtualDisk (offset, limit, vmUuid filters)
+        GET  datastore, datastore/<uuid>, datastore/<uuid>/statsRealtime, datastore/<uuid>/statsHistoric
+        GET  appliance, appliance/<uuid>, servicegroup, servicegroup/<uuid>
+
+    Sample usage:
+        import kvtintri
+        from kvtintri.mockserver import MockVMStore
+
+        with MockVMStore(vm_count=10000, latency=0.005) as server:
+            session = kvtintri.VMStore.login(server.device, "admin", "secret!", scheme='http')
+            vms = list(session.iter_vms())
+
+"""
+
+import calendar
+import json
+import random
+import threading
+import time
+import uuid as uuidlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+from kvtintri.bulk import QOS_CONFIG_TYPEID
+from kvtintri.classes import TINTRI_ERROR_TYPEID
+
+API_ROOT = '/api/v310/'
+PAGE_TYPEID = 'com.tintri.api.rest.v310.dto.Page'
+VM_TYPEID = 'com.tintri.api.rest.v310.dto.domain.beans.vm.VirtualMachine'
+DISK_TYPEID = 'com.tintri.api.rest.v310.dto.domain.beans.vm.VirtualDisk'
+UUID_TYPEID = 'com.tintri.api.rest.vcommon.dto.Uuid'
+
+STAT_INTERVAL = 10
+SERVICE_GROUPS = 4
+
+
+def vm_uuid(i):
+    return '64f2e4bd-0f53-4f1c-9d5e-%012d-VIM-0000000%05d' % (i, i % 100000)
+
+
+def vm_index(value):
+    """Returns the index of a synthetic VM from its UUID, or None if it isn't one"""
+    try:
+        return int(value.split('-')[4])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _stamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + '.000Z'
+
+
+def _parse_stamp(value):
+    return calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+def synthetic_stat(i, seconds):
+    """Returns a stat sample for synthetic VM i at a point in time"""
+    phase = (int(seconds) // STAT_INTERVAL + i) % 97
+    return {'timeEnd': _stamp(seconds),
+            'normalizedTotalIops': float((i % 2000) + phase * 3),
+            'operationsTotalIops': float((i % 1500) + phase * 2),
+            'latencyTotalMs': 0.5 + (i % 40) / 10.0 + phase / 100.0,
+            'throughputTotalMBps': float(i % 300) + phase / 10.0,
+            'flashHitPercent': 90.0 + (i + phase) % 10,
+            'spaceUsedGiB': 40.0 + i % 500}
+
+
+def synthetic_datastore_stat(n, seconds, started):
+    """
+    Returns a capacity and performance reserve sample for datastore n. Space used and reserve used grow linearly from
+    the time the server started, at a rate that depends on n, so forecasts have a known answer.
+    """
+    days = (seconds - started) / 86400.0
+    used = 10000.0 + 2500.0 * n + (50.0 + 25.0 * n) * days
+    reserve = min(100.0, 35.0 + 5.0 * n + (0.5 + 0.25 * n) * days)
+    return {'timeEnd': _stamp(seconds),
+            'spaceUsedGiB': used,
+            'spaceTotalGiB': 50000.0,
+            'spaceUsedPhysicalGiB': used / 2,
+            'spaceRemainingPhysicalGiB': 25000.0 - used / 2,
+            'performanceReserveUsed': reserve,
+            'performanceReserveRemaining': 100.0 - reserve,
+            'flashHitPercent': 98.5}
+
+
+def synthetic_vm(i, qos=None):
+    """
+    Returns a dictionary shaped like an item of the v310 vm listing.
+
+    :param i: Index of the VM. The same index always produces the same VM.
+    :param qos: An optional (minNormalizedIops, maxNormalizedIops) tuple overriding the generated QoS
+    """
+    min_iops, max_iops = qos if qos is not None else (0, 1000 * (i % 10))
+    return {'typeId': VM_TYPEID,
+            'uuid': {'typeId': UUID_TYPEID, 'uuid': vm_uuid(i)},
+            'vmware': {'typeId': 'com.tintri.api.rest.v310.dto.domain.beans.vm.VirtualMachineVMware',
+                       'name': 'vm-%06d' % i,
+                       'vcenterName': 'vcenter%02d.example.com' % (i % 8),
+                       'mor': 'vm-%d' % (1000 + i),
+                       'host': 'esx%02d.example.com' % (i % 32),
+                       'isPowered': i % 5 != 0,
+                       'isTemplate': False,
+                       'hypervisorType': 'VMWARE',
+                       'storageContainers': ['datastore%02d' % (i % 16)]},
+            'qosConfig': {'typeId': QOS_CONFIG_TYPEID,
+                          'minNormalizedIops': min_iops,
+                          'maxNormalizedIops': max_iops},
+            'serviceGroupIds': ['servicegroup-%02d' % (i % SERVICE_GROUPS)],
+            'stat': {'sortedStats': [synthetic_stat(i, 1458000000)]},
+            'isLive': True}
+
+
+def synthetic_disk(i, n):
+    """Returns virtual disk n of synthetic VM i"""
+    return {'typeId': DISK_TYPEID,
+            'uuid': {'typeId': UUID_TYPEID, 'uuid': '%s-disk%d' % (vm_uuid(i), n)},
+            'vmUuid': {'typeId': UUID_TYPEID, 'uuid': vm_uuid(i)},
+            'name': 'vm-%06d_%d.vmdk' % (i, n),
+            'spaceUsedGiB': 20.0 + (i + n) % 200}
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status=200, cookie=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if cookie:
+            self.send_header('Set-Cookie', 'JSESSIONID={}; Path=/'.format(cookie))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message):
+        self._send({'typeId': TINTRI_ERROR_TYPEID, 'code': 'ERR-API-%d' % status, 'message': message}, status)
+
+    def _route(self, method):
+        store = self.server.store
+        store.count_request()
+        store.delay()
+
+        url = urlparse(self.path)
+        if not url.path.startswith(API_ROOT):
+            return self._error(404, 'Not found')
+        path = url.path[len(API_ROOT):].strip('/')
+        query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+
+        body = None
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = json.loads(self.rfile.read(length).decode('utf-8'))
+
+        if path == 'session/login' and method == 'POST':
+            return self._send({'typeId': 'com.tintri.api.rest.v310.dto.domain.beans.auth.LoginResponse'},
+                              cookie=store.open_session(body))
+
+        if not store.valid_session(self.headers.get('Cookie') or ''):
+            return self._error(401, 'Authentication required')
+
+        if path == 'session/logout':
+            return self._send({'typeId': 'ok'})
+
+        result = store.handle(method, path.split('/'), query, body)
+        if result is None:
+            return self._error(404, 'No such resource: {}'.format(path))
+        status, response = result
+        if status >= 400:
+            return self._error(status, response)
+        self._send(response, status)
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_PUT(self):
+        self._route('PUT')
+
+    def do_POST(self):
+        self._route('POST')
+
+
+class MockVMStore(object):
+    """
+
+        An in-process HTTP server emulating the VMstore endpoints kvtintri uses, backed by a synthetic inventory.
+
+    """
+
+    def __init__(self, vm_count=1000, disks_per_vm=2, datastores=1, latency=0.0, jitter=0.0, page_limit=None,
+                 port=0, address='127.0.0.1'):
+        """
+        MockVMStore class initializer.
+
+        :param vm_count: Number of virtual machines in the inventory
+        :param disks_per_vm: Number of virtual disks per VM
+        :param datastores: Number of datastores. The first one is named 'default'.
+        :param latency: Seconds added to every response
+        :param jitter: Up to this many extra seconds are added at random to every response
+        :param page_limit: Number of items returned when a listing request has no limit. All of them if None.
+        :param port: Port to listen on. A free port is chosen if 0.
+        :param address: Address to bind
+        """
+        self.vm_count = vm_count
+        self.disks_per_vm = disks_per_vm
+        self.datastore_uuids = ['default'] + ['datastore-%02d' % i for i in range(1, datastores)]
+        self.latency = latency
+        self.jitter = jitter
+        self.page_limit = page_limit
+        self.qos = {}
+        self.snapshots = {}
+        self.sessions = set()
+        self.requests = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+        self._server = _Server((address, port), _Handler)
+        self._server.store = self
+        self._thread = None
+
+    @property
+    def device(self):
+        """The host:port to pass to VMStore.login"""
+        return '{}:{}'.format(*self._server.server_address[:2])
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        """Serves requests on a background thread and returns the server"""
+        self._thread = threading.Thread(target=self._server.serve_forever, name='kvtintri-mockserver')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.random() * self.jitter)
+
+    def open_session(self, credentials):
+        token = uuidlib.uuid4().hex
+        self.sessions.add(token)
+        return token
+
+    def expire_sessions(self):
+        """Invalidates every session cookie, as an appliance restart would"""
+        self.sessions.clear()
+
+    def valid_session(self, cookie):
+        for part in cookie.split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == 'JSESSIONID' and value in self.sessions:
+                return True
+        return False
+
+    def vm(self, i):
+        return synthetic_vm(i, self.qos.get(i))
+
+    def _page(self, indexes, query, build):
+        offset = int(query.get('offset', 0))
+        limit = query.get('limit')
+        limit = int(limit) if limit is not None else self.page_limit
+        total = len(indexes)
+        stop = total if limit is None else min(offset + limit, total)
+        return {'typeId': PAGE_TYPEID,
+                'absoluteTotal': total,
+                'filteredTotal': total,
+                'offset': offset,
+                'limit': limit if limit is not None else total,
+                'items': [build(i) for i in indexes[offset:stop]]}
+
+    def _vm_indexes(self, query):
+        if 'vmUuid' in query:
+            i = vm_index(query['vmUuid'])
+            return [i] if i is not None and 0 <= i < self.vm_count else []
+        indexes = range(self.vm_count)
+        if 'name' in query:
+            indexes = [i for i in indexes if query['name'] in 'vm-%06d' % i]
+        if 'vcenterName' in query:
+            indexes = [i for i in indexes if query['vcenterName'] in 'vcenter%02d.example.com' % (i % 8)]
+        if 'host' in query:
+            indexes = [i for i in indexes if query['host'] == 'esx%02d.example.com' % (i % 32)]
+        if 'isPowered' in query:
+            powered = query['isPowered'].lower() == 'true'
+            indexes = [i for i in indexes if (i % 5 != 0) == powered]
+        return indexes
+
+    def _stats(self, seed, historic):
+        now = int(time.time()) // STAT_INTERVAL * STAT_INTERVAL
+        count = 60 if historic else 1
+        return {'typeId': PAGE_TYPEID,
+                'items': [{'sortedStats': [synthetic_stat(seed, now - n * STAT_INTERVAL)
+                                           for n in reversed(range(count))]}]}
+
+    def _datastore(self, n):
+        return {'typeId': 'com.tintri.api.rest.v310.dto.domain.beans.datastore.Datastore',
+                'uuid': {'typeId': UUID_TYPEID, 'uuid': self.datastore_uuids[n]},
+                'stat': {'sortedStats': [synthetic_datastore_stat(n, time.time(), self.started)]}}
+
+    def _datastore_stats(self, n, historic):
+        stats = self._stats(100000 + n, historic)
+        for stat in stats['items'][0]['sortedStats']:
+            stat.update(synthetic_datastore_stat(n, _parse_stamp(stat['timeEnd']), self.started))
+        return stats
+
+    def _appliance(self):
+        return {'typeId': 'com.tintri.api.rest.v310.dto.domain.beans.hardware.Appliance',
+                'uuid': {'typeId': UUID_TYPEID, 'uuid': 'local'},
+                'info': {'modelName': 'MockVMStore', 'osVersion': '4.2.0'}}
+
+    def _service_group(self, n):
+        return {'typeId': 'com.tintri.api.rest.v310.dto.domain.beans.sg.ServiceGroup',
+                'uuid': {'typeId': UUID_TYPEID, 'uuid': 'servicegroup-%02d' % n},
+                'name': 'Service group %d' % n}
+
+    def handle(self, method, segments, query, body):
+        """
+        Answers an API request.
+
+        :return: A tuple of (HTTP status, response body or error message), or None for an unknown resource
+        """
+        resource = segments[0]
+        rest = segments[1:]
+
+        if resource == 'vm':
+            if method == 'PUT' and rest == ['qosConfig']:
+                return self._set_qos(body)
+            if method == 'POST' and len(rest) == 2 and rest[1] == 'snapshot':
+                return self._snapshot_vm(rest[0], body)
+            if method != 'GET':
+                return None
+            if not rest:
+                return 200, self._page(self._vm_indexes(query), query, self.vm)
+            i = vm_index(rest[0])
+            if i is None or not 0 <= i < self.vm_count:
+                return 404, 'No such virtual machine: {}'.format(rest[0])
+            if len(rest) == 1:
+                return 200, self.vm(i)
+            if rest[1] in ('statsRealtime', 'statsHistoric'):
+                return 200, self._stats(i, rest[1] == 'statsHistoric')
+            return None
+
+        if method != 'GET':
+            return None
+
+        if resource == 'virtualDisk':
+            indexes = [(i, n) for i in self._vm_indexes(query) for n in range(self.disks_per_vm)]
+            return 200, self._page(indexes, query, lambda i: synthetic_disk(*i))
+
+        if resource == 'datastore':
+            if not rest:
+                return 200, [self._datastore(n) for n in range(len(self.datastore_uuids))]
+            if rest[0] not in self.datastore_uuids:
+                return 404, 'No such datastore: {}'.format(rest[0])
+            n = self.datastore_uuids.index(rest[0])
+            if len(rest) == 1:
+                return 200, self._datastore(n)
+            if rest[1] in ('statsRealtime', 'statsHistoric'):
+                return 200, self._datastore_stats(n, rest[1] == 'statsHistoric')
+            return None
+
+        if resource == 'appliance':
+            return 200, [self._appliance()] if not rest else self._appliance()
+
+        if resource == 'servicegroup':
+            groups = [self._service_group(n) for n in range(SERVICE_GROUPS)]
+            if not rest:
+                return 200, groups
+            for group in groups:
+                if group['uuid']['uuid'] == rest[0]:
+                    return 200, group
+            return 404, 'No such service group: {}'.format(rest[0])
+
+        return None
+
+    def _snapshot_vm(self, vm_uuid, body):
+        i = vm_index(vm_uuid)
+        if i is None or not 0 <= i < self.vm_count:
+            return 404, 'No such virtual machine: {}'.format(vm_uuid)
+        with self._lock:
+            self.snapshots.setdefault(i, []).append(body)
+        return 200, {'typeId': 'ok'}
+
+    def _set_qos(self, body):
+        try:
+            new_value = body['newValue']
+            qos = (new_value['minNormalizedIops'], new_value['maxNormalizedIops'])
+            indexes = [vm_index(i) for i in body['ids']]
+        except (KeyError, TypeError):
+            return 400, 'Malformed qosConfig request'
+
+        if qos[1] and qos[0] > qos[1]:
+            return 400, 'minNormalizedIops is greater than maxNormalizedIops'
+        if any(i is None or not 0 <= i < self.vm_count for i in indexes):
+            return 404, 'Unknown virtual machine in request'
+
+        for i in indexes:
+            self.qos[i] = qos
+        return 200, {'typeId': 'com.tintri.api.rest.v310.dto.domain.beans.vm.VirtualMachineQoSConfig'}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Runs a mock VMstore API server')
+    parser.add_argument('--vms', type=int, default=1000, help='Number of virtual machines')
+    parser.add_argument('--disks', type=int, default=2, help='Virtual disks per virtual machine')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    args = parser.parse_args()
+
+    server = MockVMStore(vm_count=args.vms, disks_per_vm=args.disks, latency=args.latency, port=args.port)
+    print('Serving {} virtual machines on http://{}'.format(args.vms, server.device))
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+"""
+
+    Polling collector for datastore and VM performance with fixed-size in-memory history.
+
+    Samples are kept in per-metric ring buffers backed by two array('d') columns (timestamps and values), so memory
+    is fixed at 16 bytes per sample slot no matter how long the collector runs.
+
+    Sample usage:
+        import kvtintri
+
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!")
+        collector = kvtintri.PerformanceCollector(session, interval=30, capacity=2880)
+        collector.start()
+
+        ...
+
+        for vm_uuid, latency in collector.top('vm', 'latencyTotalMs', n=10, window=600, stat='p95'):
+            print(collector.names.get(vm_uuid), latency)
+
+        collector.stop()
+
+"""
+
+import calendar
+import re
+import threading
+import time
+from array import array
+
+DEFAULT_METRICS = ('normalizedTotalIops', 'operationsTotalIops', 'latencyTotalMs', 'throughputTotalMBps',
+                   'flashHitPercent')
+
+DEFAULT_INTERVAL = 30
+DEFAULT_CAPACITY = 2880
+
+_TIMESTAMP = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?(Z|[+-]\d\d:?\d\d)?$')
+
+
+def parse_time(value):
+    """
+    Converts a VMstore timestamp such as "2016-03-14T11:30:00.000-07:00" to seconds since the epoch. Numbers are
+    treated as milliseconds since the epoch.
+
+    :return: A float, or None if the value can't be parsed
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value / 1000.0
+
+    match = _TIMESTAMP.match(value)
+    if not match:
+        return None
+
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    seconds = calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second)))
+    if fraction:
+        seconds += float(fraction)
+
+    if zone and zone != 'Z':
+        sign = -1 if zone[0] == '-' else 1
+        digits = zone[1:].replace(':', '')
+        seconds -= sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+
+    return float(seconds)
+
+
+def sorted_stats(response):
+    """
+    Pulls the list of stat samples out of a statsRealtime/statsHistoric response, a VM listing item or a datastore.
+    Handles Page objects, lists and bare stat containers.
+
+    :return: A list of stat dictionaries, oldest first
+    """
+    if response is None:
+        return []
+
+    if type(response) == list:
+        samples = []
+        for i in response:
+            samples.extend(sorted_stats(i))
+        return samples
+
+    if 'items' in response:
+        return sorted_stats(response['items'])
+    if 'sortedStats' in response:
+        return response['sortedStats'] or []
+    if 'stat' in response:
+        return sorted_stats(response['stat'])
+    return []
+
+
+def percentile(values, p):
+    """Returns the p-th percentile (0-100) of a list of numbers using linear interpolation"""
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class RingBuffer(object):
+    """
+
+        Fixed capacity series of (timestamp, value) samples. Once full, each new sample overwrites the oldest.
+        Samples must arrive in time order; a sample that isn't newer than the latest one is ignored, so overlapping
+        realtime windows can be appended repeatedly without creating duplicates.
+
+        Appends and reads take a lock, so a collector thread can append while other threads read.
+
+    """
+
+    __slots__ = ('capacity', '_times', '_values', '_start', '_count', '_lock')
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._times = array('d', [0.0]) * capacity
+        self._values = array('d', [0.0]) * capacity
+        self._start = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def _last_time(self):
+        if not self._count:
+            return None
+        return self._times[(self._start + self._count - 1) % self.capacity]
+
+    @property
+    def last_time(self):
+        with self._lock:
+            return self._last_time()
+
+    def append(self, timestamp, value):
+        """
+        Adds a sample.
+
+        :return: True if the sample was stored, False if it was older than the latest sample
+        """
+        with self._lock:
+            if self._count and timestamp <= self._last_time():
+                return False
+
+            if self._count < self.capacity:
+                index = (self._start + self._count) % self.capacity
+                self._times[index] = timestamp
+                self._values[index] = value
+                self._count += 1
+            else:
+                index = self._start
+                self._times[index] = timestamp
+                self._values[index] = value
+                self._start = (self._start + 1) % self.capacity
+            return True
+
+    def samples(self, window=None):
+        """
+        Returns the samples in time order.
+
+        :param window: Only return samples within this many seconds of the latest sample
+        :return: A tuple of two lists, (timestamps, values)
+        """
+        with self._lock:
+            if not self._count:
+                return [], []
+
+            end = self._start + self._count
+            if end <= self.capacity:
+                times = self._times[self._start:end].tolist()
+                values = self._values[self._start:end].tolist()
+            else:
+                end -= self.capacity
+                times = self._times[self._start:].tolist() + self._times[:end].tolist()
+                values = self._values[self._start:].tolist() + self._values[:end].tolist()
+
+        if window is not None:
+            cutoff = times[-1] - window
+            first = 0
+            while first < len(times) and times[first] < cutoff:
+                first += 1
+            times = times[first:]
+            values = values[first:]
+
+        return times, values
+
+    def latest(self):
+        """Returns the most recent value, or None if the buffer is empty"""
+        with self._lock:
+            if not self._count:
+                return None
+            return self._values[(self._start + self._count - 1) % self.capacity]
+
+    def min(self, window=None):
+        values = self.samples(window)[1]
+        return min(values) if values else None
+
+    def max(self, window=None):
+        values = self.samples(window)[1]
+        return max(values) if values else None
+
+    def mean(self, window=None):
+        values = self.samples(window)[1]
+        return sum(values) / len(values) if values else None
+
+    def percentile(self, p, window=None):
+        return percentile(self.samples(window)[1], p)
+
+    def rate(self, window=None):
+        """Returns the average change in value per second across the window"""
+        times, values = self.samples(window)
+        if len(times) < 2 or times[-1] == times[0]:
+            return None
+        return (values[-1] - values[0]) / (times[-1] - times[0])
+
+    def summarize(self, stat, window=None):
+        """
+        Computes a statistic by name: 'min', 'max', 'mean', 'latest', 'rate' or 'pNN' for a percentile, e.g. 'p95'.
+        """
+        if stat == 'latest':
+            return self.latest()
+        if stat in ('min', 'max', 'mean', 'rate'):
+            return getattr(self, stat)(window)
+        if stat.startswith('p'):
+            return self.percentile(float(stat[1:]), window)
+        raise ValueError('Unknown statistic: {}'.format(stat))
+
+
+class PerformanceCollector(object):
+    """
+
+        Periodically samples datastore and VM performance from one VMstore into RingBuffers.
+
+        Each poll costs one statsRealtime call per datastore plus one walk of the vm listing, whose items already
+        carry each VM's latest stats, rather than one call per VM. Use backfill() to load a datastore's or VM's
+        historic stats into the same buffers.
+
+    """
+
+    def __init__(self, session, interval=DEFAULT_INTERVAL, capacity=DEFAULT_CAPACITY, metrics=DEFAULT_METRICS,
+                 datastores=True, vms=True, archive=None, **kwargs):
+        """
+        PerformanceCollector class initializer.
+
+        :param session: An instance of the VMStore object
+        :param interval: Seconds between polls when running in the background
+        :param capacity: Number of samples kept per metric per datastore/VM
+        :param metrics: Names of the stat fields to record
+        :param datastores: Collect datastore stats
+        :param vms: Collect VM stats. Either True for every VM or a list of VM UUIDs to watch.
+        :param archive: An optional kvtintri.ArchiveWriter that every sample is also written to
+        :param kwargs: Filters passed to the vm listing (see VMStore.get_vms)
+        """
+        self.session = session
+        self.interval = interval
+        self.capacity = capacity
+        self.metrics = tuple(metrics)
+        self.datastores = datastores
+        self.vms = set(vms) if isinstance(vms, (list, tuple, set)) else vms
+        self.archive = archive
+        self.filters = kwargs
+
+        self.series = {}
+        self.names = {}
+        self.errors = 0
+        self.last_error = None
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def buffer(self, kind, uuid, metric):
+        """
+        Returns the RingBuffer for a metric, creating it if needed.
+
+        :param kind: Either 'datastore' or 'vm'
+        :param uuid: The datastore or VM UUID
+        :param metric: The stat field name, e.g. 'latencyTotalMs'
+        """
+        key = (kind, uuid, metric)
+        series = self.series.get(key)
+        if series is None:
+            with self._lock:
+                series = self.series.setdefault(key, RingBuffer(self.capacity))
+        return series
+
+    def record(self, kind, uuid, samples):
+        """
+        Stores stat samples for a datastore or VM.
+
+        :param kind: Either 'datastore' or 'vm'
+        :param uuid: The datastore or VM UUID
+        :param samples: A list of stat dictionaries, oldest first
+        :return: The number of new samples stored
+        """
+        if self.archive is not None:
+            self.archive.write(kind, uuid, samples)
+
+        stored = 0
+        for sample in samples:
+            timestamp = parse_time(sample.get('timeEnd'))
+            if timestamp is None:
+                continue
+            for metric in self.metrics:
+                value = sample.get(metric)
+                if value is not None and self.buffer(kind, uuid, metric).append(timestamp, value):
+                    stored += 1
+        return stored
+
+    def _datastore_uuids(self):
+        datastores = self.session.get_datastores()
+        if type(datastores) == dict:
+            datastores = datastores.get('items', [datastores])
+        return [datastore['uuid']['uuid'] for datastore in datastores]
+
+    def poll(self):
+        """
+        Takes one sample of every datastore and VM.
+
+        :return: The number of new samples stored
+        """
+        stored = 0
+
+        if self.datastores:
+            for datastore_uuid in self._datastore_uuids():
+                response = self.session.get_datastore_stats_realtime(datastore_uuid)
+                stored += self.record('datastore', datastore_uuid, sorted_stats(response))
+
+        if self.vms:
+            for item in self.session._iter_pages('vm', prefetch=True, **self.filters):
+                vm_uuid = item['uuid']['uuid']
+                if self.vms is not True and vm_uuid not in self.vms:
+                    continue
+                self.names[vm_uuid] = (item.get('vmware') or {}).get('name')
+                stored += self.record('vm', vm_uuid, sorted_stats(item))
+
+        return stored
+
+    def backfill(self, kind, uuid, **kwargs):
+        """
+        Loads historic stats for a datastore or VM. Call before polling starts, since samples older than the latest
+        one already held are ignored.
+
+        :param kind: Either 'datastore' or 'vm'
+        :param uuid: The datastore or VM UUID
+        :param kwargs: Optional 'since' and 'until' timestamps passed to the statsHistoric call
+        :return: The number of samples stored
+        """
+        if kind == 'datastore':
+            response = self.session.get_datastore_stats_historic(uuid, **kwargs)
+        else:
+            response = self.session.get_vm_stats_historic(uuid, **kwargs)
+        return self.record(kind, uuid, sorted_stats(response))
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.poll()
+            except Exception as e:
+                # Keep collecting through transient appliance or network errors
+                self.errors += 1
+                self.last_error = e
+            self._stop.wait(max(0, self.interval - (time.time() - started)))
+
+    def start(self):
+        """Starts polling in a background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='kvtintri-perf-{}'.format(self.session.device))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the background thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def query(self, kind, uuid, metric, stat='latest', window=None):
+        """
+        Computes a statistic over one metric.
+
+        Sample usage:
+            collector.query('datastore', ds_uuid, 'latencyTotalMs', stat='p99', window=3600)
+
+        :param kind: Either 'datastore' or 'vm'
+        :param uuid: The datastore or VM UUID
+        :param metric: The stat field name
+        :param stat: 'min', 'max', 'mean', 'latest', 'rate' or a percentile such as 'p95'
+        :param window: Seconds of history to consider, counted back from the latest sample. Everything if None.
+        :return: The value, or None if there are no samples
+        """
+        series = self.series.get((kind, uuid, metric))
+        if series is None:
+            return None
+        return series.summarize(stat, window)
+
+    def top(self, kind, metric, n=10, stat='mean', window=None):
+        """
+        Ranks datastores or VMs on a statistic of one metric, e.g. the VMs with the highest p95 latency.
+
+        :return: A list of (uuid, value) tuples, highest first
+        """
+        ranked = []
+        for (series_kind, uuid, series_metric), series in list(self.series.items()):
+            if series_kind == kind and series_metric == metric:
+                value = series.summarize(stat, window)
+                if value is not None:
+                    ranked.append((uuid, value))
+        ranked.sort(key=lambda i: i[1], reverse=True)
+        return ranked[:n]
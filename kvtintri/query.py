@@ -0,0 +1,149 @@
+"""
+
+    Builds encoded query strings for the v310 listing endpoints so selection happens on the appliance.
+
+    Sample usage:
+        import kvtintri
+        from kvtintri.query import Query
+
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!")
+
+        query = (Query('vm')
+                 .filter(vcenterName='dev-vc1', isPowered=True, name='web & db')
+                 .sort('name')
+                 .fields('uuid', 'vmware', 'qosConfig'))
+
+        for item in session.find(query):
+            print(item['vmware']['name'])
+
+        print(query.uri())      # vm?includeFields=uuid%2Cvmware%2CqosConfig&isPowered=true&name=web+%26+db&...
+
+"""
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+# Query parameters documented for the v310 listing endpoints. Others are passed through unchecked.
+VM_FILTERS = ('name', 'uuid', 'vmUuid', 'host', 'vcenterName', 'isPowered', 'live', 'hypervisorType',
+              'provisionedType', 'serviceGroupIds', 'since', 'until', 'queryType', 'includeFields', 'offset',
+              'limit', 'sortedBy', 'sortOrder')
+
+VIRTUAL_DISK_FILTERS = ('name', 'uuid', 'vmUuid', 'includeFields', 'offset', 'limit', 'sortedBy', 'sortOrder')
+
+FILTERS = {'vm': VM_FILTERS,
+           'virtualDisk': VIRTUAL_DISK_FILTERS}
+
+SORT_ORDERS = ('ASC', 'DESC')
+
+
+def encode_value(value):
+    """Converts a python value to its query string form: booleans to true/false, sequences to comma lists"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, dict) and 'uuid' in value:
+        return value['uuid']
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return ','.join(encode_value(i) for i in value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return u'{}'.format(value)
+
+
+def encode(params):
+    """
+    Encodes a dictionary of query parameters. Keys are sorted so the same filters always produce the same URI, which
+    keeps ResponseCache keys stable. None values are left out.
+
+    :return: A query string starting with '?', or '' if there are no parameters
+    """
+    pairs = [(key, encode_value(value).encode('utf-8')) for key, value in sorted(params.items())
+             if value is not None]
+    if not pairs:
+        return ''
+    return '?' + urlencode(pairs)
+
+
+class Query(object):
+    """
+
+        An immutable description of a listing request. Each method returns a new Query, so a base query can be shared
+        and refined.
+
+    """
+
+    def __init__(self, resource, strict=False, **filters):
+        """
+        Query class initializer.
+
+        :param resource: The endpoint to list, e.g. 'vm' or 'virtualDisk'
+        :param strict: Raise ValueError for parameters the endpoint isn't documented to accept
+        :param filters: Initial filters, as for filter()
+        """
+        self.resource = resource
+        self.strict = strict
+        self.params = {}
+        self._update(filters)
+
+    def _update(self, params):
+        allowed = FILTERS.get(self.resource)
+        for key, value in params.items():
+            if self.strict and allowed is not None and key not in allowed:
+                raise ValueError('{} does not accept the {} filter'.format(self.resource, key))
+            if value is None:
+                self.params.pop(key, None)
+            else:
+                self.params[key] = value
+
+    def _copy(self, **params):
+        query = Query(self.resource, strict=self.strict)
+        query.params = dict(self.params)
+        query._update(params)
+        return query
+
+    def filter(self, **filters):
+        """
+        Adds filters, e.g. filter(vcenterName='dev-vc1', isPowered=True). A filter set to None is removed.
+        Values are encoded with encode_value().
+        """
+        return self._copy(**filters)
+
+    def fields(self, *names):
+        """Requests only these top level fields of each item, where the appliance supports includeFields"""
+        return self._copy(includeFields=list(names) if names else None)
+
+    def sort(self, field, descending=False):
+        """Orders results on the appliance by a field"""
+        return self._copy(sortedBy=field, sortOrder=SORT_ORDERS[1] if descending else SORT_ORDERS[0])
+
+    def limit(self, count):
+        """Caps the total number of items returned"""
+        return self._copy(limit=count)
+
+    def offset(self, count):
+        """Skips this many items"""
+        return self._copy(offset=count)
+
+    def encode(self):
+        """Returns the encoded query string, starting with '?', or '' if there are no parameters"""
+        return encode(self.params)
+
+    def uri(self):
+        """Returns the URI of the request relative to the API root"""
+        return self.resource + self.encode()
+
+    def __str__(self):
+        return self.uri()
+
+    def __repr__(self):
+        return 'Query({!r})'.format(self.uri())
+
+    def __eq__(self, other):
+        return isinstance(other, Query) and self.uri() == other.uri()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.uri())
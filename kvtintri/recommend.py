@@ -0,0 +1,297 @@
+"""
+
+    QoS recommendations from per-VM normalized IOPS history.
+
+    Requires numpy (pip install kvtintri[table]).
+
+    Every VM gets a minimum at a low percentile of its observed normalized IOPS and a maximum at a high percentile plus
+    headroom. The minimums are reservations against the datastore's performance reserve, so when their total would
+    overrun the reserve that's left they're scaled down together to fit.
+
+    Sample usage:
+        import kvtintri
+        from kvtintri.recommend import QoSRecommender, history_from_archive
+
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!")
+        with kvtintri.ArchiveReader('vmstore01.kva') as archive:
+            history = history_from_archive(archive, start=time.time() - 7 * 86400)
+
+        plan = QoSRecommender(max_percentile=99).recommend_for_session(session, history, capacity_iops=100000)
+        for row in plan.diff():
+            print(row['name'], row['current_max_iops'], '->', row['max_iops'])
+
+        results = plan.apply(session)
+
+"""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import kvtintri.bulk
+from kvtintri.classes import Datastore
+from kvtintri.perf import sorted_stats
+from kvtintri.table import VMTable, COLUMN_NAMES
+
+HISTORY_METRIC = 'normalizedTotalIops'
+
+# Upper bound on the cells of the padded history matrix built at once, to cap memory on very large fleets
+MAX_MATRIX_CELLS = 4000000
+
+# Row passed to the bulk QoS update. Carries the attributes bulk_update_qos reads from a VirtualMachine.
+QoSTarget = collections.namedtuple('QoSTarget', ['uuid', 'name', 'qos_min_iops', 'qos_max_iops'])
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("QoS recommendations require numpy. Install it with 'pip install numpy'")
+
+
+def history_from_collector(collector, metric=HISTORY_METRIC, window=None):
+    """
+    Collects per-VM history from a PerformanceCollector.
+
+    :return: A dictionary of VM UUID to a sequence of samples
+    """
+    history = {}
+    for (kind, uuid, series_metric), series in list(collector.series.items()):
+        if kind == 'vm' and series_metric == metric:
+            history[uuid] = series.samples(window)[1]
+    return history
+
+
+def history_from_archive(reader, start=None, end=None, metric=HISTORY_METRIC):
+    """
+    Collects per-VM history from an ArchiveReader.
+
+    :return: A dictionary of VM UUID to a sequence of samples
+    """
+    history = {}
+    for kind, uuid in reader.entities('vm'):
+        history[uuid] = reader.read(kind, uuid, start, end, metrics=[metric])[1][metric]
+    return history
+
+
+def fetch_history(session, vm_uuids, metric=HISTORY_METRIC, max_workers=kvtintri.bulk.DEFAULT_WORKERS, **kwargs):
+    """
+    Fetches per-VM history from the VMstore's statsHistoric endpoint, max_workers VMs at a time. This is one request
+    per VM, so prefer a collector or archive for large fleets.
+
+    :param kwargs: Optional 'since' and 'until' timestamps passed to each statsHistoric call
+    :return: A dictionary of VM UUID to a list of samples
+    """
+    def fetch(vm_uuid):
+        samples = sorted_stats(session.get_vm_stats_historic(vm_uuid, **kwargs))
+        return vm_uuid, [i[metric] for i in samples if i.get(metric) is not None]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(fetch, list(vm_uuids)))
+
+
+def reserve_iops(datastore, capacity_iops):
+    """
+    Converts a datastore's remaining performance reserve, a percentage, into normalized IOPS.
+
+    :param datastore: A kvtintri.Datastore
+    :param capacity_iops: The normalized IOPS the whole appliance can deliver
+    """
+    return capacity_iops * (datastore.performance_reserve_remaining or 0) / 100.0
+
+
+class QoSPlan(object):
+    """
+
+        Current and recommended QoS values, one row per VM, held in numpy columns alongside those of VMTable
+        ('samples' counts the history each recommendation is based on). Rows without enough history keep their
+        current values.
+
+    """
+
+    def __init__(self, columns, budget_iops=None, scale=1.0):
+        self.columns = columns
+        self.budget_iops = budget_iops
+        self.scale = scale
+
+    def __len__(self):
+        return len(self.columns['uuid'])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def changes(self):
+        """Returns a plan holding only the rows whose QoS would change"""
+        mask = ((self.columns['min_iops'] != self.columns['qos_min_iops']) |
+                (self.columns['max_iops'] != self.columns['qos_max_iops']))
+        return QoSPlan(dict((name, values[mask]) for name, values in self.columns.items()), self.budget_iops,
+                       self.scale)
+
+    def diff(self):
+        """
+        Lists what applying the plan would change, as a dry run.
+
+        :return: A list of dictionaries with name, uuid, samples, current_min_iops, min_iops, current_max_iops and
+                 max_iops keys
+        """
+        changes = self.changes()
+        rows = zip(changes['name'].tolist(), changes['uuid'].tolist(), changes['samples'].tolist(),
+                   changes['qos_min_iops'].tolist(), changes['min_iops'].tolist(),
+                   changes['qos_max_iops'].tolist(), changes['max_iops'].tolist())
+        keys = ('name', 'uuid', 'samples', 'current_min_iops', 'min_iops', 'current_max_iops', 'max_iops')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def targets(self):
+        """Returns a QoSTarget per changed VM, ready for VMStore.set_qos_bulk()"""
+        changes = self.changes()
+        return [QoSTarget(*row) for row in zip(changes['uuid'].tolist(), changes['name'].tolist(),
+                                                changes['min_iops'].tolist(), changes['max_iops'].tolist())]
+
+    def apply(self, session, batch_size=kvtintri.bulk.DEFAULT_BATCH_SIZE, max_workers=kvtintri.bulk.DEFAULT_WORKERS):
+        """
+        Applies the changed rows with batched qosConfig requests.
+
+        :return: A list of kvtintri.bulk.QoSResult tuples, one per changed VM
+        """
+        return session.set_qos_bulk(self.targets(), batch_size=batch_size, max_workers=max_workers)
+
+
+class QoSRecommender(object):
+    """
+
+        Computes QoS plans from per-VM normalized IOPS history. Percentiles for every VM are computed together on a
+        NaN padded matrix, a slice of rows at a time, so the work is a handful of numpy calls per slice rather than a
+        Python loop over VMs.
+
+    """
+
+    def __init__(self, min_percentile=50, max_percentile=99, headroom=1.25, round_to=100, min_max_iops=500,
+                 min_samples=10):
+        """
+        QoSRecommender class initializer.
+
+        :param min_percentile: Percentile of observed IOPS used as the minimum
+        :param max_percentile: Percentile of observed IOPS used as the maximum, before headroom
+        :param headroom: Multiplier applied to the maximum
+        :param round_to: Minimums are rounded down and maximums up to a multiple of this
+        :param min_max_iops: Lowest maximum ever recommended, so idle VMs aren't throttled to nothing
+        :param min_samples: VMs with fewer samples than this keep their current values
+        """
+        self.min_percentile = min_percentile
+        self.max_percentile = max_percentile
+        self.headroom = headroom
+        self.round_to = round_to
+        self.min_max_iops = min_max_iops
+        self.min_samples = min_samples
+
+    @staticmethod
+    def _interpolate(matrix, rows, counts, percentile):
+        rank = (counts - 1) * (percentile / 100.0)
+        below = numpy.floor(rank).astype(numpy.int64)
+        above = numpy.minimum(below + 1, counts - 1)
+        low = matrix[rows, below]
+        return low + (matrix[rows, above] - low) * (rank - below)
+
+    def percentiles(self, series):
+        """
+        Computes the minimum and maximum percentile of every VM's history.
+
+        :param series: A list of sequences of samples, one per VM
+        :return: A tuple of three numpy arrays, (low percentile, high percentile, sample count). Percentiles are NaN
+                 for VMs without samples.
+        """
+        _require_numpy()
+
+        count = len(series)
+        low = numpy.full(count, numpy.nan)
+        high = numpy.full(count, numpy.nan)
+        samples = numpy.array([len(values) for values in series], dtype=numpy.int64)
+
+        width = max(int(samples.max()) if count else 0, 1)
+        rows = max(MAX_MATRIX_CELLS // width, 1)
+
+        for start in range(0, count, rows):
+            stop = min(start + rows, count)
+            matrix = numpy.full((stop - start, width), numpy.nan)
+            for i in range(start, stop):
+                if samples[i]:
+                    matrix[i - start, :samples[i]] = series[i]
+
+            # One sort per slice serves both percentiles. NaN padding sorts to the end of each row, so a row's
+            # percentile is interpolated between positions of its own sample count (numpy's 'linear' method).
+            matrix.sort(axis=1)
+            counts = samples[start:stop]
+            populated = numpy.nonzero(counts)[0]
+            if len(populated):
+                low[start + populated] = self._interpolate(matrix, populated, counts[populated], self.min_percentile)
+                high[start + populated] = self._interpolate(matrix, populated, counts[populated], self.max_percentile)
+
+        return low, high, samples
+
+    def recommend(self, table, history, reserve_iops=None):
+        """
+        Builds a QoS plan.
+
+        :param table: A VMTable of the VMs to plan for, carrying their current QoS values
+        :param history: A dictionary of VM UUID to a sequence of normalized IOPS samples
+        :param reserve_iops: Normalized IOPS left in the datastore's performance reserve (see reserve_iops()). The
+                             planned VMs' current minimums are added back since the plan replaces them. Unbounded if
+                             None.
+        :return: A QoSPlan
+        """
+        _require_numpy()
+
+        uuids = table['uuid'].tolist()
+        series = [numpy.asarray(history.get(uuid, ()), dtype=float) for uuid in uuids]
+        series = [values[~numpy.isnan(values)] for values in series]
+        low, high, samples = self.percentiles(series)
+
+        current_min = table['qos_min_iops']
+        current_max = table['qos_max_iops']
+        planned = samples >= self.min_samples
+
+        step = self.round_to
+        min_iops = numpy.where(planned, numpy.floor(numpy.nan_to_num(low) / step) * step, current_min)
+        max_iops = numpy.ceil(numpy.nan_to_num(high) * self.headroom / step) * step
+        max_iops = numpy.maximum(max_iops, self.min_max_iops)
+
+        budget = None
+        scale = 1.0
+        if reserve_iops is not None:
+            budget = reserve_iops + current_min[planned].sum()
+            reserved = min_iops[planned].sum()
+            if reserved > budget:
+                scale = max(budget, 0) / float(reserved)
+                min_iops = numpy.where(planned, numpy.floor(min_iops * scale / step) * step, min_iops)
+
+        max_iops = numpy.where(planned, numpy.maximum(max_iops, min_iops + step), current_max)
+
+        columns = dict((name, table[name]) for name in COLUMN_NAMES)
+        columns['samples'] = samples
+        columns['min_iops'] = min_iops.astype(numpy.int64)
+        columns['max_iops'] = max_iops.astype(numpy.int64)
+        return QoSPlan(columns, budget, scale)
+
+    def recommend_for_session(self, session, history, capacity_iops=None, **kwargs):
+        """
+        Builds a QoS plan for the VMs on a VMstore, budgeting minimums against its default datastore's remaining
+        performance reserve when capacity_iops is given.
+
+        :param session: An instance of the VMStore object
+        :param history: A dictionary of VM UUID to a sequence of normalized IOPS samples
+        :param capacity_iops: The normalized IOPS the appliance can deliver, used to convert the reserve percentage
+        :param kwargs: Filters passed to the vm listing (see VMStore.get_vms)
+        :return: A QoSPlan
+        """
+        table = VMTable.from_session(session, **kwargs)
+
+        reserve = None
+        if capacity_iops is not None:
+            datastores = session.get_datastores()
+            if type(datastores) == dict:
+                datastores = datastores.get('items', [datastores])
+            reserve = reserve_iops(Datastore(datastores[0]), capacity_iops)
+
+        return self.recommend(table, history, reserve)
@@ -0,0 +1,152 @@
+"""
+
+    Retry and circuit breaker policies used by VMStore to ride out appliance hiccups.
+
+    Sample usage:
+        import kvtintri
+        from kvtintri.resilience import RetryPolicy
+
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!",
+                                         retry_policy=RetryPolicy(retries=5, backoff=1, max_backoff=60))
+
+"""
+
+import random
+import threading
+import time
+
+import kvtintri.exceptions
+
+DEFAULT_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class RetryPolicy(object):
+    """
+
+        How often and how long to wait before retrying an idempotent request.
+
+        Delays grow exponentially from backoff up to max_backoff and use "full jitter": each delay is a random value
+        between zero and the exponential bound, so many clients retrying at once spread out instead of arriving
+        together. A Retry-After header on the response takes precedence when it's longer.
+
+    """
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30, statuses=DEFAULT_RETRY_STATUSES, jitter=True):
+        """
+        RetryPolicy class initializer.
+
+        :param retries: Number of retries after the first attempt. 0 disables retrying.
+        :param backoff: Upper bound in seconds of the first delay
+        :param max_backoff: Largest delay in seconds
+        :param statuses: HTTP status codes that are retried
+        :param jitter: Randomize delays. If False every delay is the full exponential bound.
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.jitter = jitter
+
+    def delay(self, attempt, response=None):
+        """
+        Returns the seconds to wait before retry number attempt (starting at 0).
+
+        :param response: The response being retried, checked for a Retry-After header
+        """
+        bound = min(self.max_backoff, self.backoff * (2 ** attempt))
+        delay = random.uniform(0, bound) if self.jitter else bound
+
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), self.max_backoff))
+            except ValueError:
+                pass
+
+        return delay
+
+
+class CircuitBreaker(object):
+    """
+
+        Stops requests to an appliance that keeps failing so a struggling VMstore gets room to recover.
+
+        After failure_threshold consecutive failures the circuit opens and requests fail immediately with
+        CircuitOpenError. Once reset_timeout seconds have passed a single probe request is let through (half-open);
+        its success closes the circuit, its failure opens it again.
+
+        Failures are connection errors and retryable server statuses. Other error responses show the appliance is
+        answering and count as successes.
+
+    """
+
+    def __init__(self, device=None, failure_threshold=5, reset_timeout=30):
+        """
+        CircuitBreaker class initializer.
+
+        :param device: The appliance, used in error messages
+        :param failure_threshold: Consecutive failures that open the circuit
+        :param reset_timeout: Seconds the circuit stays open before a probe is allowed
+        """
+        self.device = device
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Raises CircuitOpenError if a request may not be sent now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+
+            if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+
+            retry_in = max(0, self.reset_timeout - (time.time() - self.opened_at))
+            raise kvtintri.exceptions.CircuitOpenError(
+                'Requests to {} are suspended after {} consecutive failures, retry in {:.0f}s'.format(
+                    self.device, self.failures, retry_in), self.device)
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(device, **kwargs):
+    """
+    Returns the CircuitBreaker shared by every session to an appliance in this process, creating it if needed.
+
+    :param kwargs: CircuitBreaker settings, used only when the breaker is created
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(device)
+        if breaker is None:
+            breaker = _breakers[device] = CircuitBreaker(device, **kwargs)
+        return breaker
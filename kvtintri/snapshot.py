@@ -0,0 +1,319 @@
+"""
+
+    On-disk inventory snapshots, so tools can start from the last known inventory instead of walking every listing.
+
+    A SnapshotStore is a SQLite file holding the last complete vm, virtualDisk, datastore and servicegroup listings of
+    any number of appliances, each with the time it was taken. A VMStore given a store serves unfiltered listings from
+    it:
+
+        - younger than max_age:     served from the snapshot
+        - younger than max_stale:   served from the snapshot while a background thread takes a new one
+        - older, expired or absent: fetched from the appliance, and saved as the new snapshot once complete
+
+    Writes through the session (e.g. a QoS change) expire the snapshot of the resource they touch, so the next read
+    goes to the appliance.
+
+    Sample usage:
+        import kvtintri
+        from kvtintri.snapshot import SnapshotStore
+
+        store = SnapshotStore('~/.kvtintri/inventory.db', max_age=300, max_stale=86400)
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!", snapshot=store)
+
+        for vm in session.iter_vms():       # instant when a snapshot less than a day old exists
+            print(vm.name)
+
+        print(store.age(session.device, 'vm'))
+
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from kvtintri.classes import DEFAULT_PAGE_SIZE
+
+DEFAULT_MAX_AGE = 300
+DEFAULT_MAX_STALE = 86400
+
+# Rows inserted per executemany call while saving a listing
+WRITE_BATCH = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    device TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    taken REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (device, resource)
+);
+CREATE TABLE IF NOT EXISTS items (
+    device TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (device, resource, generation, seq)
+);
+"""
+
+
+class SnapshotStore(object):
+    """
+
+        Persists complete inventory listings per appliance in a SQLite database.
+
+        Each save writes the items under a new generation number and only switches the snapshot to it once the walk
+        is complete, so readers never see a half written listing and an interrupted save leaves the previous snapshot
+        in place. The database uses write-ahead logging so reads aren't blocked by a save in progress.
+
+        Connections are per thread, so one store can be shared by every session and thread in a process. Only one
+        process should save to a file at a time.
+
+    """
+
+    # Paged listings, stored one row per item
+    LISTINGS = ('vm', 'virtualDisk')
+
+    # Listings returned whole, stored as a single document
+    DOCUMENTS = ('datastore', 'servicegroup')
+
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE, max_stale=DEFAULT_MAX_STALE, page_size=DEFAULT_PAGE_SIZE):
+        """
+        SnapshotStore class initializer.
+
+        :param path: Path of the SQLite database. Created, along with its directory, if needed.
+        :param max_age: Seconds a snapshot is served without refreshing it
+        :param max_stale: Seconds a snapshot is served at all. Older snapshots are read from the appliance instead.
+        :param page_size: Page size of the walks that take new snapshots
+        """
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.page_size = page_size
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._writing = set()
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+
+        db = self._db()
+        db.executescript(SCHEMA)
+        db.commit()
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def close(self):
+        """Closes the calling thread's connection"""
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def _snapshot(self, device, resource):
+        return self._db().execute('SELECT generation, taken, count FROM snapshots WHERE device = ? AND resource = ?',
+                                  (device, resource)).fetchone()
+
+    def age(self, device, resource):
+        """Returns the age in seconds of an appliance's snapshot of a resource, or None if there is none"""
+        row = self._snapshot(device, resource)
+        if row is None or not row[1]:
+            return None
+        return max(0.0, time.time() - row[1])
+
+    def count(self, device, resource):
+        """Returns the number of items in a snapshot, or None if there is none"""
+        row = self._snapshot(device, resource)
+        return row[2] if row is not None else None
+
+    def items(self, device, resource):
+        """
+        Yields the decoded items of a snapshot in listing order. Items are read in batches, so memory stays flat.
+        """
+        row = self._snapshot(device, resource)
+        if row is None:
+            return
+
+        cursor = self._db().execute('SELECT data FROM items WHERE device = ? AND resource = ? AND generation = ? '
+                                    'ORDER BY seq', (device, resource, row[0]))
+        while True:
+            rows = cursor.fetchmany(WRITE_BATCH)
+            if not rows:
+                break
+            for data, in rows:
+                yield json.loads(data)
+
+    def document(self, device, resource):
+        """Returns a saved document such as a datastore listing, or None"""
+        for item in self.items(device, resource):
+            return item
+        return None
+
+    def record(self, device, resource, items):
+        """
+        Yields the items of an iterable while saving them as a new snapshot. The snapshot replaces the previous one
+        only once the iterable is exhausted; if it raises or the generator is abandoned, the previous one is kept.
+        """
+        key = (device, resource)
+        with self._write_lock:
+            row = self._db().execute('SELECT MAX(generation) FROM items WHERE device = ? AND resource = ?',
+                                     key).fetchone()
+            current = self._snapshot(device, resource)
+            generation = max([row[0] or 0, current[0] if current else 0] +
+                             [g for k, g in self._writing if k == key]) + 1
+            self._writing.add((key, generation))
+
+        count = 0
+        complete = False
+        try:
+            batch = []
+            for item in items:
+                batch.append((device, resource, generation, count, json.dumps(item, separators=(',', ':'))))
+                count += 1
+                if len(batch) >= WRITE_BATCH:
+                    self._insert(batch)
+                    batch = []
+                yield item
+            if batch:
+                self._insert(batch)
+            self._commit(key, generation, count)
+            complete = True
+        finally:
+            with self._write_lock:
+                self._writing.discard((key, generation))
+                if not complete:
+                    db = self._db()
+                    with db:
+                        db.execute('DELETE FROM items WHERE device = ? AND resource = ? AND generation = ?',
+                                   key + (generation,))
+
+    def save(self, device, resource, items):
+        """
+        Replaces a snapshot with the items of an iterable, writing them as they're produced.
+
+        :return: The number of items saved
+        """
+        count = 0
+        for _ in self.record(device, resource, items):
+            count += 1
+        return count
+
+    def _insert(self, batch):
+        with self._write_lock:
+            db = self._db()
+            with db:
+                db.executemany('INSERT INTO items (device, resource, generation, seq, data) VALUES (?, ?, ?, ?, ?)',
+                               batch)
+
+    def _commit(self, key, generation, count):
+        with self._write_lock:
+            # Generations still being written by other walks in this process are left alone
+            keep = [generation] + [g for k, g in self._writing if k == key]
+            db = self._db()
+            with db:
+                db.execute('INSERT OR REPLACE INTO snapshots (device, resource, generation, taken, count) '
+                           'VALUES (?, ?, ?, ?, ?)', key + (generation, time.time(), count))
+                db.execute('DELETE FROM items WHERE device = ? AND resource = ? AND generation NOT IN ({})'.format(
+                    ','.join('?' * len(keep))), key + tuple(keep))
+
+    def expire(self, device, resource=None):
+        """
+        Marks snapshots as out of date so the next read goes to the appliance. The rows are kept until a new
+        snapshot replaces them.
+
+        :param resource: Expire only this resource. Every resource of the device is expired if None.
+        """
+        with self._write_lock:
+            db = self._db()
+            with db:
+                if resource is None:
+                    db.execute('UPDATE snapshots SET taken = 0 WHERE device = ?', (device,))
+                else:
+                    db.execute('UPDATE snapshots SET taken = 0 WHERE device = ? AND resource = ?', (device, resource))
+
+    def clear(self, device=None):
+        """Deletes every snapshot of a device, or of every device if None"""
+        with self._write_lock:
+            db = self._db()
+            with db:
+                if device is None:
+                    db.execute('DELETE FROM snapshots')
+                    db.execute('DELETE FROM items')
+                else:
+                    db.execute('DELETE FROM snapshots WHERE device = ?', (device,))
+                    db.execute('DELETE FROM items WHERE device = ?', (device,))
+
+    def take(self, session, resource):
+        """
+        Reads a resource from the appliance and saves it as the new snapshot.
+
+        :param session: A VMStore logged into the appliance
+        :param resource: One of SnapshotStore.LISTINGS or SnapshotStore.DOCUMENTS
+        :return: The number of items saved
+        """
+        if resource in self.LISTINGS:
+            items = session._walk_pages(resource, page_size=self.page_size, prefetch=True)
+        else:
+            items = [session._request(resource)]
+        return self.save(session.device, resource, items)
+
+    def take_all(self, session):
+        """Takes a new snapshot of every resource of an appliance"""
+        for resource in self.LISTINGS + self.DOCUMENTS:
+            self.take(session, resource)
+
+    def refresh_in_background(self, session, resource):
+        """
+        Takes a new snapshot in a daemon thread, unless one of this resource is already being taken.
+
+        :return: The thread, or None if a refresh was already running
+        """
+        key = (session.device, resource)
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return None
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.take(session, resource)
+            except Exception:
+                # The stale snapshot stays in place and the next read tries again
+                pass
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+                self.close()
+
+        thread = threading.Thread(target=refresh, name='kvtintri-snapshot-{}-{}'.format(*key))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def fresh(self, session, resource):
+        """
+        Decides whether a read may be served from the snapshot, starting a background refresh if it's getting old.
+
+        :return: True if the snapshot should be served, False if the appliance should be read instead
+        """
+        age = self.age(session.device, resource)
+        if age is None or (self.max_stale is not None and age > self.max_stale):
+            return False
+        if age > self.max_age:
+            self.refresh_in_background(session, resource)
+        return True
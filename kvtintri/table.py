@@ -0,0 +1,256 @@
+"""
+
+    Columnar VM inventory for fast fleet-wide filtering, sorting and aggregation.
+
+    Requires numpy (pip install kvtintri[table]).
+
+    Sample usage:
+        import kvtintri
+
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!")
+        table = kvtintri.VMTable.from_session(session)
+
+        # Powered on VMs without a QoS ceiling, largest minimum first
+        unlimited = table.filter(table['power_state'] & (table['qos_max_iops'] == 0))
+        unlimited = unlimited.sort('qos_min_iops', reverse=True)
+
+        print(table.count_by('vcenter'))
+        on_host = table.where(host='esx01.example.com')
+        unlimited.to_csv('unlimited.csv')
+
+"""
+
+import csv
+import json
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from kvtintri.classes import DEFAULT_PAGE_SIZE
+
+# Column name -> numpy dtype. Missing QoS values are stored as 0, which the VMstore also uses for "no limit".
+COLUMNS = (('name', 'U'),
+           ('uuid', 'U'),
+           ('vcenter', 'U'),
+           ('host', 'U'),
+           ('power_state', bool),
+           ('qos_min_iops', numpy.int64 if numpy else int),
+           ('qos_max_iops', numpy.int64 if numpy else int))
+
+COLUMN_NAMES = tuple(name for name, dtype in COLUMNS)
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("VMTable requires numpy. Install it with 'pip install numpy'")
+
+
+def _row_from_item(vm):
+    vmware = vm.get('vmware') or {}
+    qos = vm.get('qosConfig') or {}
+    return (vmware.get('name') or '',
+            vm['uuid']['uuid'],
+            vmware.get('vcenterName') or '',
+            vmware.get('host') or '',
+            bool(vmware.get('isPowered')),
+            int(qos.get('minNormalizedIops') or 0),
+            int(qos.get('maxNormalizedIops') or 0))
+
+
+def _row_from_vm(vm):
+    return (vm.name or '',
+            vm.uuid,
+            vm.vcenter or '',
+            vm.host or '',
+            bool(vm.power_state),
+            int(vm.qos_min_iops or 0),
+            int(vm.qos_max_iops or 0))
+
+
+class VMTable(object):
+    """
+
+        A column oriented table of virtual machines backed by numpy arrays, one per column in COLUMNS.
+
+        Rows are selected with boolean masks built from the columns, so queries over tens of thousands of VMs run as
+        a handful of vectorized operations rather than a Python loop over VirtualMachine objects. Every operation
+        returns a new VMTable and leaves the original untouched.
+
+    """
+
+    def __init__(self, columns):
+        """
+        VMTable class initializer. Generally built through from_session, from_items or from_vms.
+
+        :param columns: A dictionary of column name to numpy array. Every array must be the same length.
+        """
+        _require_numpy()
+
+        lengths = set(len(values) for values in columns.values())
+        if len(lengths) > 1:
+            raise ValueError('All columns must be the same length')
+
+        self.columns = columns
+
+    @classmethod
+    def _from_rows(cls, rows):
+        _require_numpy()
+
+        rows = list(rows)
+        if rows:
+            values = list(zip(*rows))
+        else:
+            values = [()] * len(COLUMNS)
+
+        columns = {}
+        for (name, dtype), column in zip(COLUMNS, values):
+            columns[name] = numpy.array(column, dtype=dtype)
+        return cls(columns)
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Builds a table straight from VM dictionaries, without creating VirtualMachine objects.
+
+        :param items: An iterable of VM dictionaries, e.g. session.get_vms()['items']
+        :return: A VMTable
+        """
+        return cls._from_rows(_row_from_item(vm) for vm in items)
+
+    @classmethod
+    def from_vms(cls, vms):
+        """
+        Builds a table from VirtualMachine instances.
+
+        :param vms: An iterable of VirtualMachine instances
+        :return: A VMTable
+        """
+        return cls._from_rows(_row_from_vm(vm) for vm in vms)
+
+    @classmethod
+    def from_session(cls, session, page_size=DEFAULT_PAGE_SIZE, **kwargs):
+        """
+        Builds a table of every VM on a VMstore, walking all pages of the vm listing.
+
+        :param session: An instance of the VMStore object
+        :param page_size: Number of VMs requested per page
+        :param kwargs: The same filters supported by VMStore.get_vms()
+        :return: A VMTable
+        """
+        return cls.from_items(session._iter_pages('vm', page_size=page_size, prefetch=True, **kwargs))
+
+    def __len__(self):
+        return len(self.columns['uuid'])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __iter__(self):
+        return self.iter_rows()
+
+    def iter_rows(self):
+        """Yields each row as a dictionary of column name to python value"""
+        names = [name for name in COLUMN_NAMES if name in self.columns]
+        for row in zip(*[self.columns[name].tolist() for name in names]):
+            yield dict(zip(names, row))
+
+    def filter(self, mask):
+        """
+        Returns the rows where mask is True.
+
+        :param mask: A boolean numpy array the same length as the table, e.g. table['qos_max_iops'] > 5000
+        :return: A VMTable
+        """
+        return VMTable(dict((name, values[mask]) for name, values in self.columns.items()))
+
+    def where(self, **conditions):
+        """
+        Returns the rows where every column equals the given value. A list or tuple value matches any of its items.
+
+        Sample usage:
+            table.where(vcenter=['vc1', 'vc2'], power_state=True)
+
+        :return: A VMTable
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        for name, value in conditions.items():
+            if isinstance(value, (list, tuple, set)):
+                mask &= numpy.isin(self.columns[name], list(value))
+            else:
+                mask &= self.columns[name] == value
+        return self.filter(mask)
+
+    def contains(self, column, text):
+        """Returns the rows where a string column contains text"""
+        return self.filter(numpy.char.find(self.columns[column], text) >= 0)
+
+    def sort(self, column, reverse=False):
+        """
+        Returns the table sorted on a column. The sort is stable so successive sorts can be chained.
+
+        :param column: The column to sort on
+        :param reverse: Sort in descending order
+        :return: A VMTable
+        """
+        values = self.columns[column]
+        if reverse:
+            # Stable descending order: sort the reversed column stably, then map back and reverse, so tied rows keep
+            # their original order
+            order = (len(values) - 1 - numpy.argsort(values[::-1], kind='stable'))[::-1]
+        else:
+            order = numpy.argsort(values, kind='stable')
+        return VMTable(dict((name, values[order]) for name, values in self.columns.items()))
+
+    def group_by(self, column):
+        """
+        Splits the table on the distinct values of a column.
+
+        :return: A dictionary of column value to VMTable
+        """
+        keys, inverse = numpy.unique(self.columns[column], return_inverse=True)
+        inverse = inverse.ravel()
+        # One stable sort puts each group's rows together in table order; split at the group boundaries
+        order = numpy.argsort(inverse, kind='stable')
+        bounds = numpy.cumsum(numpy.bincount(inverse, minlength=len(keys)))[:-1]
+        return dict((key.item(), VMTable(dict((name, values[rows]) for name, values in self.columns.items())))
+                    for key, rows in zip(keys, numpy.split(order, bounds)))
+
+    def count_by(self, column):
+        """Returns a dictionary of distinct column value to the number of rows with that value"""
+        keys, counts = numpy.unique(self.columns[column], return_counts=True)
+        return dict(zip(keys.tolist(), counts.tolist()))
+
+    def sum_by(self, column, value_column):
+        """
+        Sums a numeric column for each distinct value of another column.
+
+        Sample usage:
+            table.sum_by('vcenter', 'qos_min_iops')    # reserved IOPS per vCenter
+
+        :return: A dictionary of distinct column value to the sum of value_column
+        """
+        keys, inverse = numpy.unique(self.columns[column], return_inverse=True)
+        sums = numpy.bincount(inverse.ravel(), weights=self.columns[value_column], minlength=len(keys))
+        return dict(zip(keys.tolist(), sums.tolist()))
+
+    def to_csv(self, path):
+        """Writes the table to a CSV file with a header row"""
+        names = [name for name in COLUMN_NAMES if name in self.columns]
+        with open(path, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(names)
+            writer.writerows(zip(*[self.columns[name].tolist() for name in names]))
+
+    def to_json(self, path=None):
+        """
+        Serializes the table as a JSON list of row objects.
+
+        :param path: If given, the JSON is written to this file, otherwise it's returned as a string
+        """
+        rows = list(self.iter_rows())
+        if path is None:
+            return json.dumps(rows)
+        with open(path, 'w') as f:
+            json.dump(rows, f)
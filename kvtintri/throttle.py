@@ -0,0 +1,210 @@
+"""
+
+    Client-side rate limiting and adaptive concurrency control, so parallel jobs don't overload a VMstore's
+    management plane.
+
+    A Throttle combines a TokenBucket, which caps requests per second, with an AdaptiveLimiter, which caps requests
+    in flight and tunes that cap from observed latency and errors. Every request a VMStore sends, from any thread,
+    passes through its throttle, so bulk updates, prefetching and fleet calls all share one budget per appliance.
+
+    Sample usage:
+        import kvtintri
+        from kvtintri.throttle import throttle_for
+
+        throttle = throttle_for("10.25.36.10", rate=20, max_concurrency=16, target_latency=1.0)
+        session = kvtintri.VMStore.login(device="10.25.36.10", user="admin", password="secret!", throttle=throttle)
+
+        session.set_qos_bulk(vm_list, max_workers=32)     # never more than the limiter allows in flight
+        print(throttle.limiter.limit)
+
+"""
+
+import threading
+import time
+
+DEFAULT_TARGET_LATENCY = 2.0
+
+
+class TokenBucket(object):
+    """
+
+        Allows rate requests per second on average with bursts of up to burst requests.
+
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        TokenBucket class initializer.
+
+        :param rate: Tokens added per second
+        :param burst: Bucket capacity. Defaults to rate, i.e. at most one second's worth at once.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Takes tokens if they're available now. Returns True on success."""
+        with self._lock:
+            self._refill(time.time())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Waits until tokens are available and takes them.
+
+        :param timeout: Seconds to wait at most. Forever if None.
+        :return: True if the tokens were taken, False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+
+            if deadline is not None:
+                if now + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+
+class AdaptiveLimiter(object):
+    """
+
+        Limits the number of requests in flight, adjusting the limit with additive increase, multiplicative decrease
+        (AIMD) as TCP congestion control does.
+
+        Each request answered within target_latency raises the limit by 1/limit, so a full window of fast requests
+        adds one slot. A slow request or an overload error multiplies the limit by backoff, at most once per
+        target_latency so one burst of slow responses doesn't collapse the limit to the minimum.
+
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=32, target_latency=DEFAULT_TARGET_LATENCY, backoff=0.5):
+        """
+        AdaptiveLimiter class initializer.
+
+        :param initial: Starting concurrency limit
+        :param min_limit: The limit never drops below this
+        :param max_limit: The limit never rises above this
+        :param target_latency: Seconds. Requests slower than this are treated as a sign of overload.
+        :param backoff: Factor applied to the limit on overload
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.in_flight = 0
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """
+        Waits for a free slot and takes it.
+
+        :param timeout: Seconds to wait at most. Forever if None.
+        :return: True if a slot was taken, False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency, overloaded=False):
+        """
+        Returns a slot and adjusts the limit.
+
+        :param latency: Seconds the request took
+        :param overloaded: True if the request failed in a way that suggests the appliance is overloaded
+        """
+        with self._condition:
+            self.in_flight -= 1
+
+            now = time.time()
+            if overloaded or latency > self.target_latency:
+                if now - self._last_decrease >= self.target_latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+            self._condition.notify_all()
+
+
+class Throttle(object):
+    """
+
+        A rate limit and an adaptive concurrency limit applied together. Either part may be left out.
+
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=None, initial_concurrency=4, min_concurrency=1,
+                 target_latency=DEFAULT_TARGET_LATENCY):
+        """
+        Throttle class initializer.
+
+        :param rate: Maximum requests per second. Unlimited if None.
+        :param burst: Requests that may be sent at once after a quiet period. Defaults to rate.
+        :param max_concurrency: Upper bound of the adaptive concurrency limit. No concurrency limit if None.
+        :param initial_concurrency: Starting concurrency limit
+        :param min_concurrency: Lower bound of the adaptive concurrency limit
+        :param target_latency: Seconds. Slower requests shrink the concurrency limit.
+        """
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.limiter = None
+        if max_concurrency:
+            self.limiter = AdaptiveLimiter(initial=initial_concurrency, min_limit=min_concurrency,
+                                           max_limit=max_concurrency, target_latency=target_latency)
+
+    def acquire(self):
+        """Waits until a request may be sent. Every acquire() must be followed by a release()."""
+        if self.limiter is not None:
+            self.limiter.acquire()
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    def release(self, latency, overloaded=False):
+        """
+        Reports a finished request.
+
+        :param latency: Seconds the request took
+        :param overloaded: True for connection errors, timeouts and 429/503 style responses
+        """
+        if self.limiter is not None:
+            self.limiter.release(latency, overloaded)
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def throttle_for(device, **kwargs):
+    """
+    Returns the Throttle shared by every session to an appliance in this process, creating it if needed.
+
+    :param kwargs: Throttle settings, used only when the throttle is created
+    """
+    with _throttles_lock:
+        throttle = _throttles.get(device)
+        if throttle is None:
+            throttle = _throttles[device] = Throttle(**kwargs)
+        return throttle
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+
+    Recommends QoS values for every virtual machine on a tintri from its normalized IOPS history and prints what
+    would change. Nothing is modified unless --apply is given.
+
+    History is read from a stats archive holding VM stats, written by get_perf.py --archive --vms or a
+    kvtintri.ArchiveWriter attached to a PerformanceCollector with vms enabled, if --archive is given. Otherwise it's
+    fetched from the VMstore one VM at a time.
+
+"""
+
+import argparse
+import getpass
+import sys
+import time
+import kvtintri
+from kvtintri.recommend import fetch_history, history_from_archive
+
+try:
+    input = raw_input
+except NameError:
+    pass
+
+def getargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--storage',
+                        required=True,
+                        action='store',
+                        help='VMStore VMStor IP or hostname')
+    parser.add_argument('-u', '--username',
+                        required=False,
+                        action='store',
+                        help='Username to access the VMStore')
+    parser.add_argument('--archive',
+                        required=False,
+                        action='store',
+                        help='Stats archive to read VM history from')
+    parser.add_argument('--days',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=7,
+                        help='Days of history to base recommendations on')
+    parser.add_argument('--minpercentile',
+                        required=False,
+                        action='store',
+                        type=float,
+                        default=50,
+                        help='Percentile of observed IOPS used as the minimum')
+    parser.add_argument('--maxpercentile',
+                        required=False,
+                        action='store',
+                        type=float,
+                        default=99,
+                        help='Percentile of observed IOPS used as the maximum, before headroom')
+    parser.add_argument('--headroom',
+                        required=False,
+                        action='store',
+                        type=float,
+                        default=1.25,
+                        help='Multiplier applied to the maximum')
+    parser.add_argument('--capacity',
+                        required=False,
+                        action='store',
+                        type=int,
+                        help='Normalized IOPS the appliance can deliver. Minimums are budgeted against the remaining '
+                             'performance reserve when given.')
+    parser.add_argument('--apply',
+                        required=False,
+                        action='store_true',
+                        help='Apply the recommended values')
+    parser.add_argument('--batchsize',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=kvtintri.bulk.DEFAULT_BATCH_SIZE,
+                        help='Maximum number of VMs updated per request')
+    parser.add_argument('--workers',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=kvtintri.bulk.DEFAULT_WORKERS,
+                        help='Maximum number of concurrent requests')
+    return parser.parse_args()
+
+def main():
+
+    args = getargs()
+    tintri = args.storage
+    username = args.username
+
+    if not username:
+        username = input("VMStore Username:")
+
+    password = getpass.getpass("VMStore Password:")
+
+    since = time.time() - args.days * 86400
+
+    with kvtintri.VMStore.login(tintri, username, password) as session:
+        if args.archive:
+            with kvtintri.ArchiveReader(args.archive) as archive:
+                if not archive.entities('vm'):
+                    sys.exit('%s holds no virtual machine stats. Record it with get_perf.py --archive --vms.'
+                             % args.archive)
+                history = history_from_archive(archive, start=since)
+        else:
+            stamp = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(since))
+            history = fetch_history(session, [vm.uuid for vm in session.iter_vms()], max_workers=args.workers,
+                                    since=stamp)
+
+        recommender = kvtintri.QoSRecommender(min_percentile=args.minpercentile, max_percentile=args.maxpercentile,
+                                              headroom=args.headroom)
+        plan = recommender.recommend_for_session(session, history, capacity_iops=args.capacity)
+
+        changes = plan.diff()
+        for row in sorted(changes, key=lambda r: r['name']):
+            print('%-40s min %6s -> %-6s max %6s -> %-6s (%d samples)' % (row['name'], row['current_min_iops'],
+                                                                          row['min_iops'], row['current_max_iops'],
+                                                                          row['max_iops'], row['samples']))
+        if plan.scale < 1:
+            print('Minimums scaled to %.0f%% to fit the remaining performance reserve' % (plan.scale * 100))
+        print('%d of %d virtual machines would change' % (len(changes), len(plan)))
+
+        if args.apply and changes:
+            results = plan.apply(session, batch_size=args.batchsize, max_workers=args.workers)
+            failed = [r for r in results if not r.success]
+            for result in failed:
+                print('Virtual machine %s FAILED: %s' % (result.name, result.error))
+            print('%d of %d virtual machines updated' % (len(results) - len(failed), len(results)))
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,35 @@
 
     If --maxiops is set to 0 then it will remove the upper limit
 
+    Many virtual machines can be updated in one run with either --regex, which applies --miniops/--maxiops to every
+    VM whose name matches the pattern, or --csv, which reads a file with 'name', 'miniops' and 'maxiops' columns.
+    Blank miniops/maxiops cells in the CSV fall back to the values given on the command line.
+
+    --vcenter, --host and --powered narrow the selection on the VMstore itself, as does the longest literal part of a
+    --regex, so only candidate VMs are downloaded. Short CSV files are looked up by name on the VMstore; longer ones are
+    matched against a kvtintri.VMIndex loaded with one walk of the VM listing.
+
 """
 
 import argparse
+import csv
 import getpass
+import re
 import kvtintri
 
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+try:
+    input = raw_input
+except NameError:
+    pass
+
+# CSV files naming at most this many VMs are looked up one name at a time rather than walking the inventory
+NAME_LOOKUP_LIMIT = 25
+
 def getargs():
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--storage',
@@ -21,58 +44,194 @@ def getargs():
                         required=False,
                         action='store',
                         help='Username to access the VMStore')
-    parser.add_argument('-v', '--vm',
-                        required=True,
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument('-v', '--vm',
+                         action='store',
+                         help='VM to set QoS value on')
+    targets.add_argument('--regex',
+                         action='store',
+                         help='Set QoS values on every VM whose name matches this regular expression')
+    targets.add_argument('--csv',
+                         action='store',
+                         help='CSV file with name, miniops and maxiops columns listing the VMs to update')
+    parser.add_argument('--vcenter',
+                        required=False,
+                        action='store',
+                        help='Only consider VMs in vCenters whose name contains this string')
+    parser.add_argument('--host',
+                        required=False,
                         action='store',
-                        help='VM to set QoS value on')
+                        help='Only consider VMs on this host')
+    parser.add_argument('--powered',
+                        required=False,
+                        action='store',
+                        choices=['on', 'off'],
+                        help='Only consider powered on or powered off VMs')
     parser.add_argument('--miniops',
                         required=False,
                         action='store',
+                        type=int,
                         help='Minimum normalized IOPs for a virtual machine')
     parser.add_argument('--maxiops',
-                        required=True,
+                        required=False,
                         action='store',
+                        type=int,
                         help='Max normalized IOPs for a virtual machine')
+    parser.add_argument('--batchsize',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=kvtintri.bulk.DEFAULT_BATCH_SIZE,
+                        help='Maximum number of VMs updated per request')
+    parser.add_argument('--workers',
+                        required=False,
+                        action='store',
+                        type=int,
+                        default=kvtintri.bulk.DEFAULT_WORKERS,
+                        help='Maximum number of concurrent requests')
+    parser.add_argument('--progress',
+                        required=False,
+                        action='store',
+                        help='Progress file of a bulk update. Rerunning with the same file skips VMs already updated.')
     args = parser.parse_args()
 
+    if args.maxiops is None and not args.csv:
+        parser.error('--maxiops is required unless --csv is used')
+
     return args
 
+def read_targets(path, miniops, maxiops):
+    """Reads a CSV of targets and returns a dictionary of VM name to (miniops, maxiops)"""
+    targets = {}
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            name = row['name'].strip()
+            if not name:
+                continue
+            row_min = row.get('miniops') or miniops
+            row_max = row.get('maxiops') or maxiops
+            if row_max is None or row_max == '':
+                raise ValueError('No maxiops given for %s' % name)
+            targets[name] = (int(row_min), int(row_max))
+    return targets
+
+def server_filters(args):
+    """Returns the vm listing filters the VMstore can apply for the command line options"""
+    filters = {}
+    if args.vcenter:
+        filters['vcenterName'] = args.vcenter
+    if args.host:
+        filters['host'] = args.host
+    if args.powered:
+        filters['isPowered'] = args.powered == 'on'
+    return filters
+
+def literal_fragment(pattern):
+    """
+    Returns the longest run of literal characters every match of a regular expression must contain, or None. The
+    VMstore's name filter is a substring match, so this lets it discard most non-matching VMs.
+    """
+    if pattern.flags & re.IGNORECASE:
+        return None
+
+    best = current = ''
+    for op, value in sre_parse.parse(pattern.pattern):
+        if op == sre_parse.LITERAL:
+            current += chr(value)
+            continue
+        # An alternation at the top level means no single substring is required
+        if op == sre_parse.BRANCH:
+            return None
+        best = max(best, current, key=len)
+        current = ''
+    best = max(best, current, key=len)
+    return best or None
+
+def find_by_name(session, name, filters):
+    """Returns the VM with exactly this name, or None"""
+    # The name filter is a substring match so the exact name is checked here
+    for virtualmachine in session.iter_vms(name=name, **filters):
+        if virtualmachine.name == name:
+            return virtualmachine
+    return None
+
+def update_single(session, vm, miniops, maxiops, filters):
+
+    virtualmachine = find_by_name(session, vm, filters)
+    if virtualmachine is None:
+        print('No virtual machine named %s found.' % vm)
+        return
+
+    virtualmachine.qos_max_iops = maxiops
+    virtualmachine.qos_min_iops = miniops
+    virtualmachine.update_qos(session)
+
+    # TODO add logic here to verify that it actually changed it
+
+    print('Virtual machine %s updated' % virtualmachine.name)
+    print('Min IOPS now: ' +  str(virtualmachine.qos_min_iops))
+    print('Max IOPS now: ' +  str(virtualmachine.qos_max_iops))
+
+def update_bulk(session, args):
+
+    filters = server_filters(args)
+
+    if args.csv:
+        targets = read_targets(args.csv, args.miniops, args.maxiops)
+        if len(targets) <= NAME_LOOKUP_LIMIT:
+            vm_list = [vm for vm in (find_by_name(session, name, filters) for name in targets) if vm is not None]
+        else:
+            index = kvtintri.VMIndex(session, **filters)
+            index.refresh()
+            vm_list = [vm for name in targets for vm in index.by_name(name)]
+    else:
+        pattern = re.compile(args.regex)
+        targets = {}
+        fragment = literal_fragment(pattern)
+        if fragment:
+            filters['name'] = fragment
+        index = kvtintri.VMIndex(session, **filters)
+        index.refresh()
+        vm_list = index.search(pattern)
+
+    for virtualmachine in vm_list:
+        virtualmachine.qos_min_iops, virtualmachine.qos_max_iops = targets.get(virtualmachine.name,
+                                                                                 (args.miniops, args.maxiops))
+
+    for name in sorted(set(targets) - set(i.name for i in vm_list)):
+        print('No virtual machine named %s found.' % name)
+
+    results = session.set_qos_bulk(vm_list, batch_size=args.batchsize, max_workers=args.workers, progress=args.progress)
+
+    failed = 0
+    for result in sorted(results, key=lambda r: r.name):
+        if result.success:
+            print('Virtual machine %s updated (min %s / max %s)' % (result.name, result.min_iops, result.max_iops))
+        else:
+            failed += 1
+            print('Virtual machine %s FAILED: %s' % (result.name, result.error))
+
+    print('%d of %d virtual machines updated' % (len(results) - failed, len(results)))
+
 def main():
 
     args = getargs()
     tintri = args.storage
     username = args.username
-    vm = args.vm
 
     if not username:
-        username = raw_input("VMStore Username:")
+        username = input("VMStore Username:")
 
     if not args.miniops:
         args.miniops = 0
 
     password = getpass.getpass("VMStore Password:")
 
-    session = kvtintri.VMStore.login(tintri, username, password)
-
-    vm_out = session.get_vms()
-
-    virtualmachine = None
-    for i in vm_out['items']:
-        if i['vmware']['name'] == vm:
-            virtualmachine = kvtintri.VirtualMachine.from_uuid(session, i['uuid']['uuid'])
-            break
-    else:
-        print('No virtual machine named %s found.' % vm)
-
-    virtualmachine.qos_max_iops = args.maxiops
-    virtualmachine.qos_min_iops = args.miniops
-    virtualmachine.update_qos(session)
-
-    # TODO add logic here to verify that it actually changed it
-
-    print('Virtual machine %s updated' % virtualmachine.name)
-    print('Min IOPS now: ' +  str(virtualmachine.qos_min_iops))
-    print('Max IOPS now: ' +  str(virtualmachine.qos_max_iops))
+    with kvtintri.VMStore.login(tintri, username, password) as session:
+        if args.vm:
+            update_single(session, args.vm, args.miniops, args.maxiops, server_filters(args))
+        else:
+            update_bulk(session, args)
 
 if __name__ == '__main__':
     main()
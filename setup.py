@@ -9,6 +9,7 @@ setup(
   author_email = 'rpope@kovarus.com',
   url = 'https://github.com/kovarus/tintri-automation',
   keywords = ['tintri'],
-  install_requires = ['requests', 'prettytable'],
+  install_requires = ['requests', 'prettytable', 'futures; python_version < "3.0"'],
+  extras_require = {'async': ['aiohttp'], 'table': ['numpy'], 'test': ['pytest', 'numpy']},
   classifiers = [],
 )
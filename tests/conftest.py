@@ -0,0 +1,17 @@
+import pytest
+
+import kvtintri
+from kvtintri.mockserver import MockVMStore
+
+
+@pytest.fixture
+def server():
+    with MockVMStore(vm_count=250, datastores=2) as server:
+        yield server
+
+
+@pytest.fixture
+def session(server):
+    session = kvtintri.VMStore.login(server.device, "admin", "secret!", scheme='http')
+    yield session
+    session.logout()
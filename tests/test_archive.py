@@ -0,0 +1,40 @@
+import math
+
+from kvtintri.archive import ArchiveReader, ArchiveWriter
+from kvtintri.perf import parse_time, sorted_stats
+
+METRICS = ('spaceUsedGiB', 'latencyTotalMs')
+
+
+def test_stats_round_trip_through_archive(tmp_path, server, session):
+    path = str(tmp_path / 'vmstore.kva')
+    samples = sorted_stats(session.get_datastore_stats_historic('default'))
+
+    with ArchiveWriter(path, metrics=METRICS, block_size=16) as archive:
+        assert archive.write('datastore', 'default', samples) == 60
+        # Samples already written are skipped
+        assert archive.write('datastore', 'default', samples[-5:]) == 0
+
+    with ArchiveReader(path) as archive:
+        assert list(archive.entities('datastore')) == [('datastore', 'default')]
+        times, values = archive.read('datastore', 'default')
+
+    assert list(times) == [parse_time(sample['timeEnd']) for sample in samples]
+    for metric in METRICS:
+        assert list(values[metric]) == [sample[metric] for sample in samples]
+
+
+def test_archive_time_range_and_missing_metrics(tmp_path):
+    path = str(tmp_path / 'vmstore.kva')
+    samples = [{'timeEnd': '2016-03-01T00:%02d:00.000Z' % minute, 'spaceUsedGiB': minute} for minute in range(10)]
+
+    with ArchiveWriter(path, metrics=METRICS) as archive:
+        archive.write('vm', 'vm-1', samples)
+
+    with ArchiveReader(path) as archive:
+        start = parse_time(samples[3]['timeEnd'])
+        end = parse_time(samples[6]['timeEnd'])
+        times, values = archive.read('vm', 'vm-1', start=start, end=end)
+
+    assert list(values['spaceUsedGiB']) == [3, 4, 5, 6]
+    assert all(math.isnan(value) for value in values['latencyTotalMs'])
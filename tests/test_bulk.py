@@ -0,0 +1,79 @@
+import pytest
+
+import kvtintri
+from kvtintri.bulk import BulkProgress, QoSOperation, SelectionOperation, ViewOperation, QOS_CONFIG_TYPEID
+from kvtintri.query import Query
+
+
+def test_qos_operation_batches_requests(server, session):
+    before = server.requests
+    report = session.bulk(None, QoSOperation(0, 5000, batch_size=100))
+
+    assert report.succeeded == 250 and report.failed == 0
+    assert report.requests == 3
+    # One page of the listing plus 3 batches
+    assert server.requests - before == 4
+    assert set(server.qos.values()) == {(0, 5000)}
+
+
+def test_selection_operation_with_query(server, session):
+    operation = SelectionOperation('vm/qosConfig', {'typeId': QOS_CONFIG_TYPEID, 'minNormalizedIops': 10,
+                                                    'maxNormalizedIops': 900})
+    report = session.bulk(Query('vm', name='vm-0001'), operation)
+
+    assert report.selected == 100
+    assert report.succeeded == 100
+    assert set(server.qos.values()) == {(10, 900)}
+
+
+def test_view_operation_posts_without_payload(server, session):
+    report = session.bulk(lambda vm: vm.name.endswith('7'), ViewOperation('vm/{uuid}/snapshot', 'POST'))
+
+    assert report.selected == 25
+    assert not report.failures()
+    assert len(server.snapshots) == 25
+    assert all(bodies == [None] for bodies in server.snapshots.values())
+
+
+def test_view_operation_sends_payload(server, session):
+    vms = list(session.iter_vms(limit=3))
+    operation = ViewOperation('vm/{uuid}/snapshot', 'POST', payload=lambda vm: {'comment': vm.name})
+    report = session.bulk(vms, operation)
+
+    assert report.succeeded == 3
+    assert [bodies[0]['comment'] for _, bodies in sorted(server.snapshots.items())] == [vm.name for vm in vms]
+
+
+def test_view_operation_rejects_get():
+    with pytest.raises(ValueError):
+        ViewOperation('vm/{uuid}', 'GET')
+
+
+def test_progress_resumes_and_reapplies_new_values(tmpdir, server, session):
+    path = str(tmpdir.join('qos.progress'))
+    vms = list(session.iter_vms())[:20]
+    for vm in vms:
+        vm.qos_min_iops, vm.qos_max_iops = 0, 1000
+
+    assert len(session.set_qos_bulk(vms, progress=path)) == 20
+    assert session.set_qos_bulk(vms, progress=path) == []
+
+    for vm in vms:
+        vm.qos_max_iops = 5000
+    results = session.set_qos_bulk(vms, progress=path)
+    assert len(results) == 20 and all(r.success and r.max_iops == 5000 for r in results)
+
+
+def test_progress_refuses_other_operation(tmpdir, session):
+    path = str(tmpdir.join('qos.progress'))
+    session.bulk(None, QoSOperation(0, 1000), progress=path)
+
+    with pytest.raises(ValueError):
+        BulkProgress(path, QoSOperation(0, 2000))
+
+
+def test_failed_batches_are_reported(session):
+    report = session.bulk(None, QoSOperation(5000, 100))
+
+    assert report.failed == 250
+    assert all(isinstance(r.error, kvtintri.exceptions.TintriError) for r in report.failures())
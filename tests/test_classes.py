@@ -0,0 +1,94 @@
+import kvtintri
+from kvtintri.mockserver import MockVMStore, vm_uuid
+
+
+def test_iter_vms_walks_every_page(server, session):
+    before = server.requests
+    vms = list(session.iter_vms(page_size=40))
+
+    assert [vm.name for vm in vms] == ['vm-%06d' % i for i in range(250)]
+    assert server.requests - before == 7
+
+
+def test_iter_vms_without_limit_pages_by_total():
+    with MockVMStore(vm_count=95, page_limit=30) as server:
+        session = kvtintri.VMStore.login(server.device, "admin", "secret!", scheme='http')
+        assert len(set(vm.uuid for vm in session.iter_vms(page_size=30))) == 95
+
+
+def test_get_vms_filters_on_the_appliance(session):
+    vms = list(session.iter_vms(host='esx03.example.com'))
+
+    assert len(vms) == 8
+    assert all(vm.host == 'esx03.example.com' for vm in vms)
+
+
+def test_from_name_matches_exactly(session):
+    vm = kvtintri.VirtualMachine.from_name(session, 'vm-000042')
+
+    assert isinstance(vm, kvtintri.VirtualMachine)
+    assert vm.name == 'vm-000042'
+
+
+def test_from_name_returns_virtual_machines_when_ambiguous(server, session):
+    # The same name in two vCenters. The mock's name filter matches the generated names, so reuse a prefix of them
+    build = server.vm
+
+    def vm(i):
+        item = build(i)
+        if i in (7, 8):
+            item['vmware']['name'] = 'vm-00000'
+        return item
+
+    server.vm = vm
+    index = kvtintri.VMIndex(session)
+    index.refresh()
+
+    for matches in (kvtintri.VirtualMachine.from_name(session, 'vm-00000'),
+                    kvtintri.VirtualMachine.from_name(session, 'vm-00000', index=index)):
+        assert len(matches) == 2
+        assert all(isinstance(match, kvtintri.VirtualMachine) for match in matches)
+
+
+def test_from_name_in_index(session):
+    index = kvtintri.VMIndex(session)
+    index.refresh()
+
+    assert kvtintri.VirtualMachine.from_name(session, 'vm-000042', index=index).name == 'vm-000042'
+    assert kvtintri.VirtualMachine.from_name(session, 'no-such-vm', index=index) == []
+
+
+def test_relogin_after_session_expires(server, session):
+    server.expire_sessions()
+    before = server.requests
+
+    assert session.get_vm(vm_uuid(3))['vmware']['name'] == 'vm-000003'
+    # The rejected request, the login and the retried request
+    assert server.requests - before == 3
+
+
+def test_hydrate_all_attaches_disks(session):
+    vms = kvtintri.VirtualMachine.hydrate_all(session, name='vm-00001')
+
+    assert len(vms) == 10
+    for vm in vms:
+        assert len(vm.virtualdisks) == 2
+        assert all(disk['vmUuid']['uuid'] == vm.uuid for disk in vm.virtualdisks)
+
+
+def test_hydrate_all_fetches_disks_per_vm_for_small_selections(server, session):
+    before = server.requests
+    vms = kvtintri.VirtualMachine.hydrate_all(session, host='esx01.example.com')
+
+    assert len(vms) == 8
+    assert all(len(vm.virtualdisks) == 2 for vm in vms)
+    # One vm page and one virtualDisk request per VM rather than the 500 disk listing
+    assert server.requests - before == 9
+
+
+def test_hydrate_all_walks_disk_listing_when_unfiltered(server, session):
+    before = server.requests
+    vms = kvtintri.VirtualMachine.hydrate_all(session, page_size=100)
+
+    assert sum(len(vm.virtualdisks) for vm in vms) == 500
+    assert server.requests - before == 3 + 5
@@ -0,0 +1,38 @@
+import kvtintri
+from kvtintri.snapshot import SnapshotStore
+
+
+def test_listing_round_trips_through_snapshot(tmp_path, server):
+    store = SnapshotStore(str(tmp_path / 'inventory.db'))
+    session = kvtintri.VMStore.login(server.device, "admin", "secret!", scheme='http', snapshot=store)
+    live = [vm.name for vm in session.iter_vms()]
+
+    assert store.take(session, 'vm') == 250
+    assert store.count(server.device, 'vm') == 250
+
+    before = server.requests
+    assert [vm.name for vm in session.iter_vms()] == live
+    assert server.requests == before
+
+
+def test_snapshot_survives_reopening(tmp_path, server, session):
+    path = str(tmp_path / 'inventory.db')
+    store = SnapshotStore(path)
+    store.take(session, 'virtualDisk')
+    store.close()
+
+    reopened = SnapshotStore(path)
+    disks = list(reopened.items(server.device, 'virtualDisk'))
+    assert len(disks) == 500
+    assert reopened.age(server.device, 'virtualDisk') is not None
+
+
+def test_qos_write_expires_snapshot(tmp_path, server):
+    store = SnapshotStore(str(tmp_path / 'inventory.db'))
+    session = kvtintri.VMStore.login(server.device, "admin", "secret!", scheme='http', snapshot=store)
+    store.take(session, 'vm')
+
+    vms = list(session.iter_vms(limit=2))
+    session.set_qos_bulk(vms)
+
+    assert store.age(server.device, 'vm') is None
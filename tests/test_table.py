@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import kvtintri
+from kvtintri.table import COLUMN_NAMES, VMTable
+
+
+def test_table_from_session(session):
+    table = VMTable.from_session(session, page_size=100)
+
+    assert len(table) == 250
+    assert table['name'][0] == 'vm-000000'
+    assert len(table.where(host='esx01.example.com')) == 8
+
+
+def test_table_matches_vms(session):
+    items = session.get_vms()['items']
+    vms = [kvtintri.VirtualMachine.from_dict(item) for item in items]
+
+    from_items = list(VMTable.from_items(items))
+    assert from_items == list(VMTable.from_vms(vms))
+
+
+def test_table_json_round_trip(tmp_path, session):
+    table = VMTable.from_session(session)
+    path = str(tmp_path / 'vms.json')
+    table.to_json(path)
+
+    with open(path) as f:
+        rows = json.load(f)
+
+    assert rows == list(table)
+    assert sorted(rows[0]) == sorted(COLUMN_NAMES)
+
+
+def test_descending_sort_keeps_ties_in_order(server, session):
+    for i in range(server.vm_count):
+        server.qos[i] = (0, 2000 if i % 2 == 0 else 1000)
+    table = VMTable.from_session(session).sort('qos_max_iops', reverse=True)
+
+    assert list(table['name']) == ['vm-%06d' % i for i in list(range(0, 250, 2)) + list(range(1, 250, 2))]
+
+
+def test_group_by(session):
+    groups = VMTable.from_session(session).group_by('host')
+
+    assert len(groups) == 32
+    assert sum(len(group) for group in groups.values()) == 250
+    assert all(set(group['host']) == {host} for host, group in groups.items())